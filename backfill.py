@@ -1,14 +1,22 @@
-import requests
+import argparse
 import psycopg2
 import os
 from dotenv import load_dotenv
+import cities
+import crash_cells
+import crash_hours
+import data_sync
+import spatial_key
+import outbound
+import http_client
 
 load_dotenv()
 
-def fetch_year_of_crashes():
-    """Fetch last 6+ months of crash data from NYC Open Data"""
+def fetch_year_of_crashes(city=None):
+    """Fetch last 6+ months of crash data from a city's Socrata source (the default city if not given)"""
+    city = city or cities.get_city()
     cutoff_date = "2024-12-01"  # Adjust as needed
-    url = "https://data.cityofnewyork.us/resource/h9gi-nx95.json"
+    url = city.crashes_url
 
     params = {
         "$limit": 50000,
@@ -17,15 +25,33 @@ def fetch_year_of_crashes():
     }
 
     print(f"Fetching crashes since {cutoff_date}...")
-    response = requests.get(url, params=params)
+    response = outbound.call(
+        "socrata",
+        lambda timeout: http_client.get(url, params=params, timeout=timeout),
+    )
+    response.raise_for_status()
     crashes = response.json()
-    print(f"✓ Fetched {len(crashes)} crashes from NYC Open Data")
+    print(f"✓ Fetched {len(crashes)} crashes for {city.name}")
     return crashes
 
 
-def insert_crashes_to_supabase(crashes):
-    """Insert crashes into Supabase database"""
-    
+def crash_row(crash):
+    """Crash table row from a record with NYC Open Data's columns; raises on malformed records"""
+    return (
+        crash.get("collision_id"),
+        crash.get("crash_date"),
+        float(crash.get("latitude", 0)),
+        float(crash.get("longitude", 0)),
+        int(crash.get("number_of_persons_injured", 0)),
+        int(crash.get("number_of_persons_killed", 0)),
+        crash.get("crash_time"),
+    )
+
+
+def insert_crashes_to_supabase(crashes, city=None):
+    """Insert crashes into the city's table in Supabase and rewrite the files served from it"""
+    city = city or cities.get_city()
+
     # Get Supabase connection string from .env
     db_url = os.getenv("SUPABASE_DB_URL")
     
@@ -38,31 +64,34 @@ def insert_crashes_to_supabase(crashes):
     cursor = conn.cursor()
     print(f"✓ Connected!")
 
+    # idempotent: adds and indexes crashes.hkey the first time, keys any stragglers after
+    spatial_key.migrate(conn)
+    crash_hours.migrate(conn)
+    data_sync.ensure_crash_table(cursor, city)
+    conn.commit()
+
     inserted = 0
     skipped = 0
+    inserted_rows = []
     total = len(crashes)
 
-    print(f"Inserting {total} crashes...")
+    print(f"Inserting {total} crashes into {city.table}...")
     
     for i, crash in enumerate(crashes, 1):
         try:
+            row = crash_row(crash)
+            # the Hilbert keys span the default city's bounds only
             cursor.execute(
-                """
-                INSERT INTO crashes (collision_id, crash_date, latitude, longitude, injuries, fatalities)
-                VALUES (%s, %s, %s, %s, %s, %s)
+                f"""
+                INSERT INTO {city.table} (collision_id, crash_date, latitude, longitude, injuries, fatalities, crash_time, hkey)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
                 ON CONFLICT (collision_id) DO NOTHING
             """,
-                (
-                    crash.get("collision_id"),
-                    crash.get("crash_date"),
-                    float(crash.get("latitude", 0)),
-                    float(crash.get("longitude", 0)),
-                    int(crash.get("number_of_persons_injured", 0)),
-                    int(crash.get("number_of_persons_killed", 0)),
-                ),
+                row + (spatial_key.hilbert_key(row[2], row[3]) if city.is_default else None,),
             )
             if cursor.rowcount > 0:
                 inserted += 1
+                inserted_rows.append(row)
         except Exception as e:
             skipped += 1
             if skipped <= 5:  # Only print first 5 errors
@@ -74,20 +103,45 @@ def insert_crashes_to_supabase(crashes):
             conn.commit()  # Commit every 1000 rows
 
     conn.commit()
+
+    # crash times and crash_cells only exist for the default city's table
+    if city.is_default:
+        # crashes stored before crash_time was ingested get it from this fetch
+        timed = crash_hours.fill_missing_times(cursor, [(c.get("collision_id"), c.get("crash_time")) for c in crashes])
+        conn.commit()
+        if timed:
+            print(f"✓ Added crash times to {timed} existing crashes")
+
+        # per-cell aggregates for the query path when serving straight from Postgres
+        cells_updated = crash_cells.sync_cells(conn, [int(row[0]) for row in inserted_rows])
+        print(f"✓ Updated {cells_updated} crash cells")
+
+    data_version = data_sync.bump_version(conn, source=city.table)
+    # the city's snapshot shard, and for the default city the hour histograms and
+    # edge index; only the new crashes need snapping onto street edges
+    data_sync.rebuild_derived(conn, inserted_rows, rebuild_edges=False, city=city)
     conn.close()
-    
+
+    # running workers pick the new data up without a restart
+    data_sync.publish_version(data_version, city=city)
+
     print(f"✓ Inserted {inserted} new crashes")
     print(f"  Skipped {skipped} duplicates")
     print(f"✓ Database updated successfully")
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seed a city's crash table, snapshot shard and indexes")
+    parser.add_argument("--city", help="constants.city_registry key; the default city if omitted")
+    args = parser.parse_args()
+    city = cities.get_city(args.city)
+
     print("="*60)
-    print("SUPABASE DATABASE BACKFILL")
+    print(f"SUPABASE DATABASE BACKFILL: {city.name.upper()}")
     print("="*60)
     
-    crashes = fetch_year_of_crashes()
-    insert_crashes_to_supabase(crashes)
+    crashes = fetch_year_of_crashes(city)
+    insert_crashes_to_supabase(crashes, city)
     
     print("\n" + "="*60)
     print("DONE!")
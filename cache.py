@@ -0,0 +1,401 @@
+import functools
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import orjson
+import xxhash
+
+from constants import CacheConfig, cache_ttls
+
+KEY_VERSION = 1  # bump to orphan every existing entry after a key format change
+
+MISSING = object()
+
+_cache = None
+_cache_lock = threading.Lock()
+
+# version of the crash data this worker serves; bumped by data_sync when new
+# data is swapped in, so results derived from the old data stop being found
+_data_version = 0
+
+
+def _dumps(value):
+    return orjson.dumps(value, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+
+
+def _normalize(part):
+    # coordinates that differ in the 7th decimal are the same request
+    if isinstance(part, float):
+        return round(part, 6)
+    if isinstance(part, (list, tuple)):
+        return [_normalize(p) for p in part]
+    if isinstance(part, dict):
+        return {k: _normalize(v) for k, v in sorted(part.items())}
+    return part
+
+
+def make_key(*parts):
+    """Stable, compact key for any JSON-able arguments"""
+    return xxhash.xxh3_128_hexdigest(_dumps([KEY_VERSION, _normalize(list(parts))]))
+
+
+class CacheBackend:
+    """Namespaced key/value cache with TTLs; values must be JSON-serializable"""
+
+    def __init__(self):
+        self._stats_lock = threading.Lock()
+        self._stats = {}
+
+    def _count(self, namespace, field):
+        with self._stats_lock:
+            ns = self._stats.setdefault(namespace, {"hits": 0, "misses": 0, "sets": 0, "errors": 0})
+            ns[field] += 1
+
+    def get(self, namespace, key):
+        raise NotImplementedError
+
+    def set(self, namespace, key, value, ttl_s=None):
+        raise NotImplementedError
+
+    def delete(self, namespace, key):
+        raise NotImplementedError
+
+    def clear(self, namespace=None):
+        raise NotImplementedError
+
+    def stats(self):
+        with self._stats_lock:
+            return {ns: dict(counts) for ns, counts in self._stats.items()}
+
+
+class LRUCache(CacheBackend):
+    """In-process LRU bounded by the serialized size of its entries"""
+
+    def __init__(self, max_bytes):
+        super().__init__()
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self._entries = OrderedDict()  # (namespace, key) -> (expires_at, size, value)
+        self._lock = threading.Lock()
+
+    def get(self, namespace, key):
+        with self._lock:
+            entry = self._entries.get((namespace, key))
+            if entry is not None and entry[0] is not None and entry[0] < time.time():
+                self._remove((namespace, key))
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end((namespace, key))
+        self._count(namespace, "hits" if entry is not None else "misses")
+        return entry[2] if entry is not None else MISSING
+
+    def set(self, namespace, key, value, ttl_s=None, size=None):
+        if size is None:
+            size = len(_dumps(value))
+        expires_at = time.time() + ttl_s if ttl_s else None
+        with self._lock:
+            self._remove((namespace, key))
+            self._entries[(namespace, key)] = (expires_at, size, value)
+            self.size_bytes += size
+            while self.size_bytes > self.max_bytes and self._entries:
+                self._remove(next(iter(self._entries)))
+        self._count(namespace, "sets")
+
+    def _remove(self, full_key):
+        entry = self._entries.pop(full_key, None)
+        if entry is not None:
+            self.size_bytes -= entry[1]
+
+    def delete(self, namespace, key):
+        with self._lock:
+            self._remove((namespace, key))
+
+    def clear(self, namespace=None):
+        with self._lock:
+            for full_key in [k for k in self._entries if namespace is None or k[0] == namespace]:
+                self._remove(full_key)
+
+    def stats(self):
+        stats = super().stats()
+        with self._lock:
+            return {
+                "backend": "memory",
+                "entries": len(self._entries),
+                "size_bytes": self.size_bytes,
+                "max_bytes": self.max_bytes,
+                "namespaces": stats,
+            }
+
+
+class SQLiteCache(CacheBackend):
+    """
+    Cache in a local SQLite file in WAL mode
+
+    Every worker on the host opens the same file, so one worker's misses warm
+    the others, and entries survive restarts.
+    """
+
+    def __init__(self, path, max_bytes):
+        super().__init__()
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._sets_since_trim = 0
+        self.last_error = None
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS cache (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            ) WITHOUT ROWID
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed_at)")
+        conn.commit()
+
+    def _conn(self):
+        # sqlite connections can't be shared across threads, keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _error(self, namespace, e):
+        # a locked, full or corrupt file degrades to no cache rather than failing the request
+        self.last_error = f"{type(e).__name__}: {e}"
+        self._count(namespace, "errors")
+
+    def get(self, namespace, key):
+        now = time.time()
+        try:
+            row = self._conn().execute(
+                "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?",
+                (namespace, key),
+            ).fetchone()
+            if row is None or (row[1] is not None and row[1] < now):
+                self._count(namespace, "misses")
+                return MISSING
+            self._conn().execute(
+                "UPDATE cache SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                (now, namespace, key),
+            )
+        except sqlite3.Error as e:
+            self._error(namespace, e)
+            self._count(namespace, "misses")
+            return MISSING
+        self._count(namespace, "hits")
+        return orjson.loads(row[0])
+
+    def set(self, namespace, key, value, ttl_s=None):
+        data = _dumps(value)
+        now = time.time()
+        try:
+            self._conn().execute(
+                "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?, ?)",
+                (namespace, key, data, len(data), now + ttl_s if ttl_s else None, now),
+            )
+        except sqlite3.Error as e:
+            self._error(namespace, e)
+            return
+        self._count(namespace, "sets")
+
+        self._sets_since_trim += 1
+        if self._sets_since_trim >= 100:
+            self._sets_since_trim = 0
+            try:
+                self.trim()
+            except sqlite3.Error as e:
+                self._error(namespace, e)
+
+    def trim(self):
+        """Drop expired entries, then least recently used ones until under max_bytes"""
+        conn = self._conn()
+        conn.execute("DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at < ?", (time.time(),))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # oldest-accessed entries first, until enough bytes are freed
+        conn.execute(
+            """
+            DELETE FROM cache WHERE (namespace, key) IN (
+                SELECT namespace, key FROM (
+                    SELECT namespace, key, size,
+                           SUM(size) OVER (ORDER BY accessed_at ROWS UNBOUNDED PRECEDING) AS freed
+                    FROM cache
+                ) WHERE freed - size < ?
+            )
+            """,
+            (total - self.max_bytes,),
+        )
+
+    def delete(self, namespace, key):
+        try:
+            self._conn().execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, key))
+        except sqlite3.Error as e:
+            self._error(namespace, e)
+
+    def clear(self, namespace=None):
+        try:
+            if namespace is None:
+                self._conn().execute("DELETE FROM cache")
+            else:
+                self._conn().execute("DELETE FROM cache WHERE namespace = ?", (namespace,))
+        except sqlite3.Error as e:
+            if namespace is None:
+                self.last_error = f"{type(e).__name__}: {e}"
+            else:
+                self._error(namespace, e)
+
+    def stats(self):
+        try:
+            rows = self._conn().execute(
+                "SELECT namespace, COUNT(*), SUM(size) FROM cache GROUP BY namespace"
+            ).fetchall()
+        except sqlite3.Error as e:
+            self.last_error = f"{type(e).__name__}: {e}"
+            rows = []
+        stored = {ns: {"entries": n, "size_bytes": size} for ns, n, size in rows}
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "entries": sum(s["entries"] for s in stored.values()),
+            "size_bytes": sum(s["size_bytes"] for s in stored.values()),
+            "max_bytes": self.max_bytes,
+            "stored": stored,
+            "namespaces": super().stats(),
+            "last_error": self.last_error,
+        }
+
+
+class TieredCache(CacheBackend):
+    """Small in-process LRU in front of the shared SQLite cache"""
+
+    def __init__(self, local, shared):
+        super().__init__()
+        self.local = local
+        self.shared = shared
+
+    def get(self, namespace, key):
+        value = self.local.get(namespace, key)
+        if value is MISSING:
+            value = self.shared.get(namespace, key)
+            if value is not MISSING:
+                # the L1 copy must not outlive the shared TTL by much
+                self.local.set(namespace, key, value, ttl_s=cache_ttls.get(namespace))
+        self._count(namespace, "hits" if value is not MISSING else "misses")
+        return value
+
+    def set(self, namespace, key, value, ttl_s=None):
+        self.shared.set(namespace, key, value, ttl_s)
+        self.local.set(namespace, key, value, ttl_s)
+        self._count(namespace, "sets")
+
+    def delete(self, namespace, key):
+        self.local.delete(namespace, key)
+        self.shared.delete(namespace, key)
+
+    def clear(self, namespace=None):
+        self.local.clear(namespace)
+        self.shared.clear(namespace)
+
+    def stats(self):
+        return {
+            "backend": "tiered",
+            "namespaces": super().stats(),
+            "local": self.local.stats(),
+            "shared": self.shared.stats(),
+        }
+
+
+def build_cache(backend=None):
+    backend = backend or os.getenv("CACHE_BACKEND", CacheConfig.BACKEND.value)
+    memory_bytes = int(float(CacheConfig.MAX_MEMORY_MB) * 1024 * 1024)
+    disk_bytes = int(float(CacheConfig.MAX_DISK_MB) * 1024 * 1024)
+
+    if backend == "memory":
+        return LRUCache(memory_bytes)
+    if backend == "sqlite":
+        return SQLiteCache(CacheConfig.PATH.value, disk_bytes)
+    if backend == "tiered":
+        return TieredCache(LRUCache(memory_bytes), SQLiteCache(CacheConfig.PATH.value, disk_bytes))
+    raise ValueError(f"Unknown cache backend: {backend}")
+
+
+def get_cache():
+    """Configured cache backend, shared by every memoization layer in this worker"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = build_cache()
+    return _cache
+
+
+def data_version():
+    return _data_version
+
+
+def set_data_version(version):
+    global _data_version
+    _data_version = int(version)
+
+
+def _cacheable(result):
+    # never remember failures, they should be retried next time
+    if isinstance(result, dict):
+        return "error" not in result and result.get("success", True) is not False
+    return result is not None
+
+
+def cached(namespace, ttl_s=None, versioned=False):
+    """
+    Memoize a function in the shared cache under its own namespace
+
+    Arguments form the key (floats rounded to 6 decimals), except a deadline=
+    keyword; error results are not stored. With versioned=True the crash data
+    version is part of the key too.
+    """
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            # a deadline is how long the caller can wait, not part of what it asks for
+            key_kwargs = {k: v for k, v in kwargs.items() if k != "deadline"}
+            try:
+                if versioned:
+                    key = make_key(fn.__qualname__, _data_version, args, key_kwargs)
+                else:
+                    key = make_key(fn.__qualname__, args, key_kwargs)
+            except TypeError:
+                return fn(*args, **kwargs)  # arguments that can't be serialized are never cached
+            cache = get_cache()
+            value = cache.get(namespace, key)
+            if value is not MISSING:
+                return value
+
+            value = fn(*args, **kwargs)
+            if _cacheable(value):
+                try:
+                    cache.set(namespace, key, value, ttl_s or cache_ttls.get(namespace))
+                except (TypeError, sqlite3.Error) as e:
+                    print(f"Could not cache {namespace} result: {e}")
+            return value
+
+        wrapper.uncached = fn
+        return wrapper
+
+    return decorator
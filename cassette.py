@@ -0,0 +1,281 @@
+import argparse
+import asyncio
+import atexit
+import fcntl
+import json
+import os
+import re
+import threading
+import time
+from urllib.parse import parse_qsl, unquote_plus, urlencode
+
+import httpx
+import ormsgpack
+import xxhash
+import zstandard
+
+from constants import CassetteConfig
+
+# Record/replay for outbound HTTP. Every external call (Google, OpenWeather,
+# Socrata, OpenAI) goes through http_client's pooled clients, whose transports
+# get wrapped here: "record" saves each request/response pair with how long it
+# took, "replay" answers from the cassette without touching the network, so a
+# session can be rerun offline as a deterministic benchmark.
+
+FORMAT_VERSION = 2  # 2: dates masked in the keys
+# credentials never reach the cassette and don't take part in matching
+SECRET_PARAMS = {"key", "appid", "api_key", "$$app_token"}
+SECRET_HEADERS = {"authorization", "x-goog-api-key", "x-app-token", "cookie", "set-cookie"}
+# request headers that change the answer, so they are part of the key
+KEY_HEADERS = {"x-goog-fieldmask"} - SECRET_HEADERS
+# the stored body is already decoded, so these no longer describe it
+DROP_RESPONSE_HEADERS = {"content-encoding", "content-length", "transfer-encoding"} | SECRET_HEADERS
+# dates and times in a query (the closures $where asks about "now") are masked
+# in the key, so a session replays the same on any day
+DATE_LITERAL = re.compile(rb"\d{4}-\d{2}-\d{2}(?:[T ]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?)?")
+
+
+class CassetteMissError(httpx.RequestError):
+    """Replaying, and the cassette has no recording of this request"""
+
+
+def settings():
+    """(mode, path, latency) from the environment, defaulting to CassetteConfig"""
+    return (
+        os.getenv("HTTP_CASSETTE_MODE", CassetteConfig.MODE.value),
+        os.getenv("HTTP_CASSETTE_PATH", CassetteConfig.PATH.value),
+        os.getenv("HTTP_CASSETTE_LATENCY", CassetteConfig.LATENCY.value),
+    )
+
+
+def _public_url(url):
+    params = [(k, v) for k, v in parse_qsl(url.query.decode(), keep_blank_values=True) if k not in SECRET_PARAMS]
+    return str(url.copy_with(query=urlencode(sorted(params)).encode() or None))
+
+
+def _normalized_body(request):
+    body = request.content
+    if not body:
+        return b""
+    try:
+        # key order and whitespace don't change what a JSON body asks for
+        return json.dumps(json.loads(body), sort_keys=True, separators=(",", ":")).encode()
+    except ValueError:
+        return body
+
+
+def request_key(request):
+    """Stable key for a request: method, URL without secrets, sorted query, canonical body, dates masked"""
+    headers = sorted((k, v) for k, v in request.headers.items() if k.lower() in KEY_HEADERS)
+    url = unquote_plus(_public_url(request.url))
+    parts = [request.method.encode(), url.encode(), repr(headers).encode(), _normalized_body(request)]
+    return xxhash.xxh3_128_hexdigest(DATE_LITERAL.sub(b"<date>", b"\0".join(parts)))
+
+
+def read(path):
+    """Interactions stored in a cassette file"""
+    with open(path, "rb") as f:
+        data = ormsgpack.unpackb(zstandard.ZstdDecompressor().decompress(f.read()))
+    if data.get("version") != FORMAT_VERSION:
+        raise ValueError(f"{path}: cassette format {data.get('version')}, expected {FORMAT_VERSION}")
+    return data["interactions"]
+
+
+def write(path, interactions):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        data = {"version": FORMAT_VERSION, "interactions": interactions}
+        f.write(zstandard.ZstdCompressor(level=9).compress(ormsgpack.packb(data)))
+    os.replace(tmp_path, path)
+
+
+class Cassette:
+    """Request/response pairs in a zstd-compressed MessagePack file"""
+
+    def __init__(self, path, mode):
+        self.path = path
+        self.mode = mode
+        self.interactions = []
+        self._saved = 0
+        self._by_key = {}
+        self._played = {}
+        self._lock = threading.Lock()
+        if mode == "replay":
+            self.load()
+
+    def load(self):
+        self.interactions = read(self.path)
+        for interaction in self.interactions:
+            self._by_key.setdefault(interaction["key"], []).append(interaction)
+        print(f"✓ Loaded {len(self.interactions)} recorded requests from {self.path}")
+
+    def save(self):
+        """
+        Append what was recorded since the last save to the file
+
+        Every worker of a multi-process server records into the same path, so
+        the file is re-read and extended under a lock rather than overwritten.
+        """
+        with self._lock:
+            new = self.interactions[self._saved :]
+            self._saved = len(self.interactions)
+        if not new:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(f"{self.path}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            interactions = (read(self.path) if os.path.exists(self.path) else []) + new
+            write(self.path, interactions)
+        print(f"✓ Recorded {len(new)} requests to {self.path}, {len(interactions)} in all")
+
+    def record(self, request, response, content, latency_s):
+        interaction = {
+            "key": request_key(request),
+            "method": request.method,
+            "url": _public_url(request.url),
+            "status": response.status_code,
+            "headers": [
+                [k, v] for k, v in response.headers.multi_items() if k.lower() not in DROP_RESPONSE_HEADERS
+            ],
+            "content": content,
+            "latency_s": round(latency_s, 4),
+        }
+        with self._lock:
+            self.interactions.append(interaction)
+
+    def play(self, request):
+        """Next recorded answer to this request; repeats of a request replay in recorded order"""
+        key = request_key(request)
+        with self._lock:
+            recorded = self._by_key.get(key)
+            if not recorded:
+                raise CassetteMissError(f"No recording of {request.method} {_public_url(request.url)}", request=request)
+            played = self._played.get(key, 0)
+            self._played[key] = played + 1
+        # more requests than were recorded get the last answer again
+        return recorded[min(played, len(recorded) - 1)]
+
+
+def _response(interaction, request):
+    return httpx.Response(
+        interaction["status"],
+        headers=interaction["headers"],
+        content=interaction["content"],
+        request=request,
+        extensions={"cassette_latency_s": interaction["latency_s"]},
+    )
+
+
+class CassetteTransport(httpx.BaseTransport):
+    """Records what the wrapped transport answers, or replays it without the network"""
+
+    def __init__(self, transport, cassette, latency="recorded"):
+        self.transport = transport
+        self.cassette = cassette
+        self.latency = latency
+
+    def handle_request(self, request):
+        if self.cassette.mode == "replay":
+            interaction = self.cassette.play(request)
+            if self.latency == "recorded":
+                time.sleep(interaction["latency_s"])
+            return _response(interaction, request)
+
+        started = time.perf_counter()
+        response = self.transport.handle_request(request)
+        try:
+            content = response.read()
+        finally:
+            response.close()
+        self.cassette.record(request, response, content, time.perf_counter() - started)
+        headers = [(k, v) for k, v in response.headers.multi_items() if k.lower() not in DROP_RESPONSE_HEADERS]
+        return httpx.Response(response.status_code, headers=headers, content=content, request=request)
+
+    def close(self):
+        self.transport.close()
+
+
+class AsyncCassetteTransport(httpx.AsyncBaseTransport):
+    """CassetteTransport for the async client"""
+
+    def __init__(self, transport, cassette, latency="recorded"):
+        self.transport = transport
+        self.cassette = cassette
+        self.latency = latency
+
+    async def handle_async_request(self, request):
+        if self.cassette.mode == "replay":
+            interaction = self.cassette.play(request)
+            if self.latency == "recorded":
+                await asyncio.sleep(interaction["latency_s"])
+            return _response(interaction, request)
+
+        started = time.perf_counter()
+        response = await self.transport.handle_async_request(request)
+        try:
+            content = await response.aread()
+        finally:
+            await response.aclose()
+        self.cassette.record(request, response, content, time.perf_counter() - started)
+        headers = [(k, v) for k, v in response.headers.multi_items() if k.lower() not in DROP_RESPONSE_HEADERS]
+        return httpx.Response(response.status_code, headers=headers, content=content, request=request)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+_cassette = None
+_cassette_lock = threading.Lock()
+
+
+def get_cassette():
+    """This process's cassette, or None when record/replay is off"""
+    global _cassette
+    mode, path, _ = settings()
+    if mode not in ("record", "replay"):
+        return None
+    if _cassette is None:
+        with _cassette_lock:
+            if _cassette is None:
+                _cassette = Cassette(path, mode)
+                if mode == "record":
+                    atexit.register(_cassette.save)
+                print(f"HTTP cassette: {mode} {path}")
+    return _cassette
+
+
+def wrap(transport, asynchronous=False):
+    """The transport, wrapped for record/replay if a cassette mode is set"""
+    cassette = get_cassette()
+    if cassette is None:
+        return transport
+    latency = settings()[2]
+    if asynchronous:
+        return AsyncCassetteTransport(transport, cassette, latency)
+    return CassetteTransport(transport, cassette, latency)
+
+
+def save():
+    if _cassette is not None and _cassette.mode == "record":
+        _cassette.save()
+
+
+def summarize(path):
+    """Per host: request count and total recorded latency"""
+    cassette = Cassette(path, "replay")
+    hosts = {}
+    for interaction in cassette.interactions:
+        host = httpx.URL(interaction["url"]).host
+        count, latency_s = hosts.get(host, (0, 0.0))
+        hosts[host] = (count + 1, latency_s + interaction["latency_s"])
+    return hosts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect a recorded HTTP cassette")
+    parser.add_argument("path", nargs="?", default=CassetteConfig.PATH.value)
+    args = parser.parse_args()
+
+    for host, (count, latency_s) in sorted(summarize(args.path).items()):
+        print(f"  {host}: {count} requests, {latency_s:.2f}s recorded")
@@ -0,0 +1,168 @@
+import math
+import threading
+import time
+
+import crash_snapshot
+from constants import CityConfig, city_registry
+
+# Each city in constants.city_registry is a shard: its own crash table and
+# snapshot file. A worker maps a city's snapshot the first time a request
+# starts there and drops it again once nobody has asked for it in a while, so
+# it only holds the cities it actually serves. Requests find their city with
+# one lookup in a coarse lat/lng grid.
+
+GRID_DEG = float(CityConfig.GRID_DEG)
+
+
+class City:
+    def __init__(self, key, config):
+        self.key = key
+        self.name = config["name"]
+        self.bounds = tuple(config["bounds"])
+        self.crashes_url = config["crashes_url"]
+        self.table = config["table"]
+        self.snapshot_path = config["snapshot_path"]
+        self.water_keywords = config["water_keywords"]
+
+    @property
+    def is_default(self):
+        """The default city also has the street graph, land mask, edge index and crash_cells"""
+        return self.key == CityConfig.DEFAULT.value
+
+    def contains(self, lat, lng):
+        lat_min, lat_max, lng_min, lng_max = self.bounds
+        return lat_min <= lat <= lat_max and lng_min <= lng <= lng_max
+
+    def __repr__(self):
+        return f"City({self.key})"
+
+
+_cities = {key: City(key, config) for key, config in city_registry.items()}
+
+
+def _grid_cell(lat, lng):
+    return (math.floor(lat / GRID_DEG), math.floor(lng / GRID_DEG))
+
+
+def _build_grid(cities):
+    """Grid cell -> cities whose bounds overlap it"""
+    grid = {}
+    for city in cities:
+        lat_min, lat_max, lng_min, lng_max = city.bounds
+        (row_lo, col_lo), (row_hi, col_hi) = _grid_cell(lat_min, lng_min), _grid_cell(lat_max, lng_max)
+        for row in range(row_lo, row_hi + 1):
+            for col in range(col_lo, col_hi + 1):
+                grid.setdefault((row, col), []).append(city)
+    return grid
+
+
+_grid = _build_grid(_cities.values())
+
+
+def all_cities():
+    return list(_cities.values())
+
+
+def get_city(key=None):
+    return _cities[key or CityConfig.DEFAULT.value]
+
+
+def city_at(lat, lng):
+    """City a point belongs to; the default city for points outside all of them"""
+    for city in _grid.get(_grid_cell(lat, lng), ()):
+        if city.contains(lat, lng):
+            return city
+    return get_city()
+
+
+class Shard:
+    def __init__(self, city, snapshot):
+        self.city = city
+        self.snapshot = snapshot
+        self.loaded_at = time.time()
+        self.last_used = time.monotonic()
+
+
+_shards = {}
+_shards_lock = threading.Lock()
+_last_sweep = time.monotonic()
+
+
+def _open(city):
+    try:
+        snapshot = crash_snapshot.open_snapshot(city.snapshot_path)
+    except (OSError, ValueError) as e:
+        print(f"Could not open crash snapshot for {city.name}: {e}")
+        return None
+    if snapshot is not None:
+        print(f"✓ Loaded {city.name} crash shard ({snapshot.size} crashes)")
+    return snapshot
+
+
+def get_shard(city):
+    """
+    The city's crash snapshot, mapped on first use; None if it hasn't been exported
+
+    The default city's snapshot is the worker-wide one the edge index, hour
+    histograms and heatmap are built from, so it is never evicted.
+    """
+    # swept on every lookup, so shards nobody asks for go even when all traffic is in the default city
+    _maybe_sweep()
+    if city.is_default:
+        return crash_snapshot.get_snapshot(city.snapshot_path)
+
+    shard = _shards.get(city.key)
+    if shard is None:
+        with _shards_lock:
+            shard = _shards.get(city.key)
+            if shard is None:
+                shard = _shards[city.key] = Shard(city, _open(city))
+    shard.last_used = time.monotonic()
+    return shard.snapshot
+
+
+def snapshot_at(lat, lng):
+    """Crash snapshot of the city a point belongs to"""
+    return get_shard(city_at(lat, lng))
+
+
+def evict_idle(idle_s=None):
+    """Drop shards unused for idle_s; returns the evicted city keys"""
+    idle_s = float(CityConfig.IDLE_EVICT_S) if idle_s is None else idle_s
+    now = time.monotonic()
+    with _shards_lock:
+        evicted = [key for key, shard in _shards.items() if now - shard.last_used > idle_s]
+        for key in evicted:
+            # not closed: requests still reading its columns keep the mapping alive until they finish
+            del _shards[key]
+    for key in evicted:
+        print(f"Evicted idle {_cities[key].name} crash shard")
+    return evicted
+
+
+def _maybe_sweep():
+    global _last_sweep
+    now = time.monotonic()
+    if now - _last_sweep < float(CityConfig.SWEEP_S):
+        return
+    _last_sweep = now
+    evict_idle()
+
+
+def reload_shards():
+    """Remap the loaded shards after a sync; evicted ones load fresh on next use anyway"""
+    for shard in list(_shards.values()):
+        shard.snapshot = _open(shard.city)
+        shard.loaded_at = time.time()
+
+
+def shard_status():
+    now = time.monotonic()
+    return {
+        key: {
+            "crashes": shard.snapshot.size if shard.snapshot is not None else None,
+            "loaded_at": shard.loaded_at,
+            "idle_s": round(now - shard.last_used, 1),
+        }
+        for key, shard in list(_shards.items())
+    }
@@ -48,6 +48,188 @@ class ScheduleConfig(StrEnum):
     DAILY_TIME = "02:00"
     LOG_LEVEL = "INFO"
 
+class SyncConfig(StrEnum):
+    VERSION_PATH = "data/data_version.json"  # published after every sync, polled by the workers
+    POLL_S = "30"
+    INITIAL_LOOKBACK_DAYS = "30"  # first delta sync with no watermark yet
+
+class CityConfig(StrEnum):
+    DEFAULT = "nyc"  # serves starts outside every city; the only one with a street graph, land mask and edge index
+    GRID_DEG = "1.0"  # routing grid; each cell lists the cities overlapping it
+    IDLE_EVICT_S = "1800"  # a city shard nobody asked for this long is dropped
+    SWEEP_S = "60"  # how often idle shards are looked for
+
+class CrashSnapshotConfig(StrEnum):
+    PATH = "data/crashes.rscs"
+    WRITE_COMPRESSED = "true"  # also emit crashes.rscs.zst for shipping to other hosts
+
+class StreetGraphConfig(StrEnum):
+    PATH = "data/street_graph.npz"
+    BACKEND = "google"  # "local" routes on the street graph instead of computeRoutes
+    WALKING_SPEED_KMH = "5.0"
+    MAX_SNAP_METERS = "250"
+
+class EdgeExposureConfig(StrEnum):
+    PATH = "data/edge_exposure.npz"
+    MAX_SNAP_METERS = "40"  # crashes further than this from a walkable edge are not on route
+
+class SafetyConfig(StrEnum):
+    BACKEND = "radius"  # "edges" scores routes from the per-edge exposure index
+    # where crash counts come from: "postgres" (raw rows), "cells" (crash_cells aggregates),
+    # "snapshot" (mmap index) or "auto" (snapshot if exported, else cells, else raw rows)
+    DATA_BACKEND = "auto"
+
+class LandMaskConfig(StrEnum):
+    PATH = "data/land_mask.npz"
+    CELL_DEG = "0.001"  # ~100m cells
+    MAX_NUDGE_FRACTION = "0.3"  # how far back toward the start an endpoint may move
+
+class RouteDedupeConfig(StrEnum):
+    HAUSDORFF_METERS = "250"  # closer than this and two routes are the same run
+    SAMPLES = "32"
+
+class DeadlineConfig(StrEnum):
+    DEFAULT_BUDGET_S = "30"
+    ROUTE_CALL_S = "1.5"  # time one route call needs, stop starting new ones below this
+    PHASE2_MIN_S = "12"
+    SAFETY_FULL_S = "4"  # per route, below this use fewer samples and shared baselines
+    SAFETY_MIN_S = "1"  # per route, below this fall back to the edge index or skip
+    LLM_MIN_S = "5"  # below this return a templated recommendation
+
+class CacheConfig(StrEnum):
+    BACKEND = "tiered"  # "memory", "sqlite" (shared by all workers on the host) or "tiered"
+    PATH = "data/cache.sqlite3"
+    MAX_MEMORY_MB = "64"
+    MAX_DISK_MB = "512"
+
+# seconds each kind of cached result stays valid
+cache_ttls = {
+    "geocode": 30 * 24 * 3600,
+    "route": 7 * 24 * 3600,
+    "weather": 10 * 60,
+    "safety": 24 * 3600,
+    "tile": 30 * 24 * 3600,
+    "closures": 3600,
+    "forecast": 30 * 60,  # one upstream forecast call per geotile per half hour
+}
+
+class CrashCellsConfig(StrEnum):
+    ENABLED = "true"  # aggregate from crash_cells instead of raw rows when the table exists
+    CELL_DEG = "0.002"  # ~200m cells; changing it needs `python crash_cells.py --rebuild`
+
+class CrashHoursConfig(StrEnum):
+    PATH = "data/crash_hours.npz"  # hour/weekday histograms per crash cell, written by backfill.py
+    TIMEZONE = "America/New_York"  # crash_time is local time; planned start times are read in it
+    PRIOR_WEIGHT = "50"  # crashes' worth of citywide pattern blended into each local histogram
+
+class SpatialKeyConfig(StrEnum):
+    # Hilbert curve over the city's bounding box; points outside are clamped to its edge
+    ORDER = "16"  # 2^16 cells a side, under a meter each
+    LAT_MIN = "40.45"
+    LAT_MAX = "40.95"
+    LNG_MIN = "-74.30"
+    LNG_MAX = "-73.65"
+    MAX_RANGES = "16"  # key ranges one box query is split into
+
+class ProfilingConfig(StrEnum):
+    HEADER = "X-Profile"  # "1"/"sampling" or "deterministic" turns profiling on for one request
+    SAMPLE_RATE = "0"  # fraction of requests profiled without being asked
+    DEFAULT_MODE = "sampling"
+    SAMPLE_INTERVAL_MS = "5"
+    OUTPUT_DIR = "data/profiles"
+    TOP_N = "15"
+
+class TileConfig(StrEnum):
+    OUTPUT_DIR = "data/tiles"
+    PRERENDER_ZOOMS = "10,11,12,13,14"
+    MIN_ZOOM = "9"
+    MAX_ZOOM = "17"
+    RADIUS_KM = "0.5"  # neighbourhood each pixel is scored over, same as route samples
+    CELL_M = "50"  # resolution of the risk surface tiles are sampled from
+    MAX_AGE_S = "86400"
+
+class ForecastConfig(StrEnum):
+    TILE_DEG = "0.05"  # ~5km geotiles; everyone in a tile shares one forecast
+    HOURS = "24"  # how far ahead to look for a time to run
+    WINDOWS = "5"  # ranked windows returned
+    CRASH_RISK_WEIGHT = "2"  # weather risk points for the worst crash hour of the day
+
+class ClosureConfig(StrEnum):
+    TOLERANCE_M = "12"  # route within this of a closed street's centerline runs along it
+    MIN_OVERLAP_M = "60"  # shorter matches are crossings (up to ~4x TOLERANCE_M), not runs along the street
+    REFRESH_S = "3600"  # rebuild the closure index this often
+    CHUNK_SEGMENTS = "64"  # route segments compared against the closures at once
+
+class RouteLibraryConfig(StrEnum):
+    PATH = "data/route_library.json.zst"
+    START_TOLERANCE_METERS = "300"
+    DISTANCE_TOLERANCE_KM = "0.25"
+    MAX_AGE_HOURS = "168"  # rebuild weekly
+
+class ResponseConfig(StrEnum):
+    MIN_COMPRESS_BYTES = "1024"  # smaller bodies go out uncompressed
+    ZSTD_LEVEL = "3"
+    GZIP_LEVEL = "6"
+
+
+class HttpClientConfig(StrEnum):
+    TIMEOUT_S = "10"
+    CONNECT_TIMEOUT_S = "3"
+    MAX_CONNECTIONS = "100"
+    MAX_KEEPALIVE = "20"
+    KEEPALIVE_EXPIRY_S = "60"
+    HTTP2 = "false"  # needs the h2 package
+
+class CassetteConfig(StrEnum):
+    MODE = "off"  # "record" (appends to an existing cassette) or "replay"; HTTP_CASSETTE_MODE overrides
+    PATH = "data/cassettes/session.cassette"  # HTTP_CASSETTE_PATH overrides
+    LATENCY = "recorded"  # replay with the recorded latencies, or "zero"
+
+# per-host connection pools, anything else uses the HttpClientConfig defaults
+http_hosts = {
+    "routes.googleapis.com": {"max_connections": 50, "max_keepalive": 20},
+    "maps.googleapis.com": {"max_connections": 20, "max_keepalive": 10},
+    "api.openweathermap.org": {"max_connections": 10, "max_keepalive": 5},
+    "data.cityofnewyork.us": {"max_connections": 4, "max_keepalive": 2},
+    "api.openai.com": {"max_connections": 20, "max_keepalive": 10},
+}
+
+# per-provider outbound limits; rates sit just under each API's quota
+_outbound_defaults = {
+    "timeout_s": 10,
+    "max_wait_s": 5,  # longest we'll queue for a token before giving up
+    "max_attempts": 3,
+    "backoff_s": 0.25,
+    "backoff_max_s": 4,
+    "failure_threshold": 5,
+    "reset_after_s": 30,
+    "hedge_after_s": None,
+}
+
+outbound_providers = {
+    "google_routes": {**_outbound_defaults, "rate_per_s": 45, "burst": 20, "hedge_after_s": 1.5},
+    "google_geocoding": {**_outbound_defaults, "rate_per_s": 45, "burst": 20},
+    "openweather": {**_outbound_defaults, "rate_per_s": 0.9, "burst": 10},
+    "socrata": {**_outbound_defaults, "rate_per_s": 5, "burst": 5, "timeout_s": 60},
+    "openai": {**_outbound_defaults, "rate_per_s": 8, "burst": 8, "timeout_s": 60},
+}
+
+# well-known starts served from the precomputed route library
+popular_starts = [
+    {"name": "Central Park - Columbus Circle", "lat": 40.768044, "lng": -73.981893},
+    {"name": "Central Park - Engineers' Gate", "lat": 40.785091, "lng": -73.959537},
+    {"name": "Washington Square Park", "lat": 40.730823, "lng": -73.997332},
+    {"name": "Brooklyn Bridge - Manhattan", "lat": 40.712217, "lng": -74.004898},
+    {"name": "Brooklyn Bridge Park - Pier 1", "lat": 40.702112, "lng": -73.996792},
+    {"name": "Prospect Park - Grand Army Plaza", "lat": 40.673987, "lng": -73.970171},
+    {"name": "Williamsburg Bridge - Brooklyn", "lat": 40.710760, "lng": -73.961360},
+    {"name": "Hudson River Park - Chelsea Piers", "lat": 40.746826, "lng": -74.008292},
+    {"name": "Riverside Park - 72nd St", "lat": 40.780502, "lng": -73.986160},
+    {"name": "East River Park - Grand St", "lat": 40.714881, "lng": -73.975563},
+]
+
+standard_distances_km = [3.0, 5.0, 10.0, 21.0]
+
 ignore = [
     "North America",
     "Atlantic Ocean",
@@ -63,4 +245,18 @@ ignore = [
     "Plus Code",
 ]
 
+# cities served: start points inside bounds (lat_min, lat_max, lng_min, lng_max)
+# use that city's crash source, table, snapshot shard and water keywords.
+# Sources are Socrata datasets with NYC's crash columns.
+city_registry = {
+    "nyc": {
+        "name": "New York City",
+        "bounds": (40.45, 40.95, -74.30, -73.65),
+        "crashes_url": APIConfig.NYC_CRASHES_URL.value,
+        "table": "crashes",
+        "snapshot_path": CrashSnapshotConfig.PATH.value,
+        "water_keywords": ignore,
+    },
+}
+
 R = 6371  # earth's radius in kilometers
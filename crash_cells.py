@@ -0,0 +1,351 @@
+import argparse
+import math
+
+import spatial_key
+import utils
+from constants import CrashCellsConfig
+
+# Pre-aggregated crashes per grid cell and day, maintained by backfill.py.
+#
+# A query region is answered as: whole cells that lie inside it, summed from
+# crash_cells, plus the raw rows of the partly covered border cells. The split
+# uses the same cell expression on both sides, so results match a raw scan exactly.
+CELL_DEG = float(CrashCellsConfig.CELL_DEG)
+CELL_LAT_SQL = f"floor(latitude / {CELL_DEG})::int"
+CELL_LNG_SQL = f"floor(longitude / {CELL_DEG})::int"
+
+# interior cells must clear the region edge by this much, covers float rounding
+EDGE_MARGIN_DEG = 1e-9
+EDGE_MARGIN_KM = 1e-6
+
+ATTRS = ("crashes", "injuries", "fatalities")
+
+_table_exists = None
+
+
+def ensure_table(cursor):
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS crash_cells (
+            cell_lat INTEGER NOT NULL,
+            cell_lng INTEGER NOT NULL,
+            day DATE NOT NULL,
+            crashes INTEGER NOT NULL,
+            injuries INTEGER NOT NULL,
+            fatalities INTEGER NOT NULL,
+            PRIMARY KEY (cell_lat, cell_lng, day)
+        )
+        """
+    )
+
+
+def update_cells(cursor, collision_ids):
+    """
+    Add newly inserted crashes to their cells
+
+    Only call this with rows that were actually inserted, re-adding a crash
+    would count it twice.
+    """
+    if not collision_ids:
+        return 0
+    cursor.execute(
+        f"""
+        INSERT INTO crash_cells (cell_lat, cell_lng, day, crashes, injuries, fatalities)
+        SELECT {CELL_LAT_SQL}, {CELL_LNG_SQL}, crash_date::date,
+               COUNT(*), COALESCE(SUM(injuries), 0), COALESCE(SUM(fatalities), 0)
+        FROM crashes
+        WHERE collision_id = ANY(%s::bigint[])
+        AND latitude IS NOT NULL AND longitude IS NOT NULL
+        GROUP BY 1, 2, 3
+        ON CONFLICT (cell_lat, cell_lng, day) DO UPDATE SET
+            crashes = crash_cells.crashes + EXCLUDED.crashes,
+            injuries = crash_cells.injuries + EXCLUDED.injuries,
+            fatalities = crash_cells.fatalities + EXCLUDED.fatalities
+        """,
+        ([int(collision_id) for collision_id in collision_ids],),
+    )
+    return cursor.rowcount
+
+
+def rebuild_cells(conn):
+    """Recompute crash_cells from scratch, e.g. after changing CELL_DEG"""
+    cursor = conn.cursor()
+    ensure_table(cursor)
+    cursor.execute("TRUNCATE crash_cells")
+    cursor.execute(
+        f"""
+        INSERT INTO crash_cells (cell_lat, cell_lng, day, crashes, injuries, fatalities)
+        SELECT {CELL_LAT_SQL}, {CELL_LNG_SQL}, crash_date::date,
+               COUNT(*), COALESCE(SUM(injuries), 0), COALESCE(SUM(fatalities), 0)
+        FROM crashes
+        WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+        GROUP BY 1, 2, 3
+        """
+    )
+    cells = cursor.rowcount
+    conn.commit()
+    return cells
+
+
+def cells_of(cursor, collision_ids):
+    """Cells the given crashes are in as currently stored, with the same expression as the table"""
+    if not collision_ids:
+        return set()
+    cursor.execute(
+        f"""
+        SELECT DISTINCT {CELL_LAT_SQL}, {CELL_LNG_SQL} FROM crashes
+        WHERE collision_id = ANY(%s::bigint[]) AND latitude IS NOT NULL AND longitude IS NOT NULL
+        """,
+        ([int(collision_id) for collision_id in collision_ids],),
+    )
+    return set(cursor.fetchall())
+
+
+def recompute_cells(cursor, cells):
+    """
+    Recount whole cells from raw rows
+
+    For crashes that were edited or moved: adding them again would double
+    count, so every cell they were or now are in is rebuilt.
+    """
+    if not cells:
+        return 0
+    cell_lats, cell_lngs = zip(*cells)
+    cursor.execute(
+        """
+        DELETE FROM crash_cells
+        WHERE (cell_lat, cell_lng) IN (SELECT * FROM unnest(%s::int[], %s::int[]))
+        """,
+        (list(cell_lats), list(cell_lngs)),
+    )
+    cursor.execute(
+        f"""
+        INSERT INTO crash_cells (cell_lat, cell_lng, day, crashes, injuries, fatalities)
+        SELECT {CELL_LAT_SQL}, {CELL_LNG_SQL}, crash_date::date,
+               COUNT(*), COALESCE(SUM(injuries), 0), COALESCE(SUM(fatalities), 0)
+        FROM crashes
+        WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+        AND ({CELL_LAT_SQL}, {CELL_LNG_SQL}) IN (SELECT * FROM unnest(%s::int[], %s::int[]))
+        GROUP BY 1, 2, 3
+        """,
+        (list(cell_lats), list(cell_lngs)),
+    )
+    return cursor.rowcount
+
+
+def sync_cells(conn, collision_ids):
+    """Bring crash_cells up to date after an ingest; builds it on first use"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT to_regclass('crash_cells') IS NOT NULL")
+    if not cursor.fetchone()[0]:
+        return rebuild_cells(conn)
+    updated = update_cells(cursor, collision_ids)
+    conn.commit()
+    return updated
+
+
+def cells_available(cursor):
+    """True if cell aggregates are enabled and the table has been created"""
+    global _table_exists
+    if CrashCellsConfig.ENABLED != "true":
+        return False
+    if not _table_exists:
+        # only a positive answer is kept, so a table built after startup gets picked up
+        cursor.execute("SELECT to_regclass('crash_cells') IS NOT NULL")
+        _table_exists = bool(cursor.fetchone()[0])
+    return _table_exists
+
+
+def _cell_totals(cursor, cells):
+    """(crashes, injuries, fatalities) summed over whole cells"""
+    if not cells:
+        return (0, 0, 0)
+    cell_lats, cell_lngs = zip(*cells)
+    cursor.execute(
+        """
+        SELECT COALESCE(SUM(c.crashes), 0), COALESCE(SUM(c.injuries), 0),
+               COALESCE(SUM(c.fatalities), 0)
+        FROM crash_cells c
+        JOIN unnest(%s::int[], %s::int[]) AS wanted(cell_lat, cell_lng)
+        USING (cell_lat, cell_lng)
+        """,
+        (list(cell_lats), list(cell_lngs)),
+    )
+    return tuple(int(total) for total in cursor.fetchone())
+
+
+def border_boxes(box, interior):
+    """
+    Sub-boxes covering the part of box outside the interior cells
+
+    Interior cells form whole rows with one contiguous run of columns each (a
+    rectangle for boxes, a disk for radii), so the border is the strips above
+    and below them plus a strip left and right of each run; rows with the same
+    run share one strip, which makes it four sub-boxes for a rectangle. Strips
+    reach EDGE_MARGIN_DEG into the interior so rows right on a cell boundary
+    are never lost to float rounding.
+    """
+    if not interior:
+        return [box]
+    lat_min, lat_max, lng_min, lng_max = box
+    runs = {}
+    for i, j in interior:
+        j_lo, j_hi = runs.get(i, (j, j))
+        runs[i] = (min(j_lo, j), max(j_hi, j))
+    i_lo, i_hi = min(runs), max(runs)
+
+    boxes = [
+        (lat_min, i_lo * CELL_DEG + EDGE_MARGIN_DEG, lng_min, lng_max),
+        ((i_hi + 1) * CELL_DEG - EDGE_MARGIN_DEG, lat_max, lng_min, lng_max),
+    ]
+    start = i_lo
+    for i in range(i_lo, i_hi + 1):
+        if i < i_hi and runs.get(i + 1) == runs.get(i):
+            continue
+        row_lo, row_hi = start * CELL_DEG - EDGE_MARGIN_DEG, (i + 1) * CELL_DEG + EDGE_MARGIN_DEG
+        if i not in runs:
+            boxes.append((row_lo, row_hi, lng_min, lng_max))
+        else:
+            j_lo, j_hi = runs[i]
+            boxes.append((row_lo, row_hi, lng_min, j_lo * CELL_DEG + EDGE_MARGIN_DEG))
+            boxes.append((row_lo, row_hi, (j_hi + 1) * CELL_DEG - EDGE_MARGIN_DEG, lng_max))
+        start = i + 1
+    # clip to the box; strips that end up empty are dropped
+    clipped = [
+        (max(b[0], lat_min), min(b[1], lat_max), max(b[2], lng_min), min(b[3], lng_max)) for b in boxes
+    ]
+    return [b for b in clipped if b[0] <= b[1] and b[2] <= b[3]]
+
+
+def _border_rows(cursor, box, interior):
+    """Raw rows in the box that are not in one of the interior cells, read from the border strips only"""
+    cell_lats, cell_lngs = zip(*interior) if interior else ((), ())
+    wheres, params = [], []
+    for strip in border_boxes(box, interior):
+        where, strip_params = spatial_key.box_where(cursor, strip)
+        wheres.append(f"({where})")
+        params.extend(strip_params)
+    # strips overlap the interior by EDGE_MARGIN_DEG; the cell test keeps the split exact
+    cursor.execute(
+        f"""
+        SELECT collision_id, crash_date, latitude, longitude, injuries, fatalities
+        FROM crashes
+        WHERE ({" OR ".join(wheres)})
+        AND ({CELL_LAT_SQL}, {CELL_LNG_SQL}) NOT IN (
+            SELECT * FROM unnest(%s::int[], %s::int[])
+        )
+        """,
+        (*params, list(cell_lats), list(cell_lngs)),
+    )
+    return cursor.fetchall()
+
+
+def box_interior_cells(lat_min, lat_max, lng_min, lng_max):
+    """Cells lying entirely inside a lat/lng box"""
+    i0 = math.floor((lat_min + EDGE_MARGIN_DEG) / CELL_DEG) + 1
+    i1 = math.floor((lat_max - EDGE_MARGIN_DEG) / CELL_DEG) - 1
+    j0 = math.floor((lng_min + EDGE_MARGIN_DEG) / CELL_DEG) + 1
+    j1 = math.floor((lng_max - EDGE_MARGIN_DEG) / CELL_DEG) - 1
+    return [(i, j) for i in range(i0, i1 + 1) for j in range(j0, j1 + 1)]
+
+
+def radius_interior_cells(lat, lng, radius_km, box):
+    """Cells whose four corners are all within radius_km of the point"""
+    inside = []
+    for i, j in box_interior_cells(*box):
+        corners = [((i + di) * CELL_DEG, (j + dj) * CELL_DEG) for di in (0, 1) for dj in (0, 1)]
+        if all(
+            utils.euc_distance(lat, lng, c_lat, c_lng) <= radius_km - EDGE_MARGIN_KM
+            for c_lat, c_lng in corners
+        ):
+            inside.append((i, j))
+    return inside
+
+
+def aggregate_box(cursor, attr, lat_min, lat_max, lng_min, lng_max):
+    """Crash count or SUM(attr) over a box, same result as scanning the raw rows"""
+    if attr not in ATTRS:
+        raise ValueError(f"Unknown crash attribute: {attr}")
+    column = ATTRS.index(attr)
+    box = (lat_min, lat_max, lng_min, lng_max)
+    interior = box_interior_cells(*box)
+
+    total = _cell_totals(cursor, interior)[column]
+    for row in _border_rows(cursor, box, interior):
+        total += 1 if column == 0 else row[3 + column] or 0
+    return total
+
+
+def radius_totals(cursor, lat, lng, radius_km, box):
+    """
+    (crashes, injuries, fatalities) within radius_km of a point
+
+    Args:
+        cursor: Open Postgres cursor
+        lat, lng: Search center
+        radius_km: Search radius, measured with utils.euc_distance like the raw path
+        box: (lat_min, lat_max, lng_min, lng_max) bounding the circle
+
+    Returns:
+        Tuple of totals
+    """
+    interior = radius_interior_cells(lat, lng, radius_km, box)
+    totals = list(_cell_totals(cursor, interior))
+
+    for row in _border_rows(cursor, box, interior):
+        if utils.euc_distance(lat, lng, float(row[2]), float(row[3])) <= radius_km:
+            totals[0] += 1
+            totals[1] += row[4] or 0
+            totals[2] += row[5] or 0
+    return tuple(totals)
+
+
+def verify(conn, points, radius_km=0.5):
+    """Compare cell-based and raw-row answers at some points; returns the mismatches"""
+    cursor = conn.cursor()
+    mismatches = []
+    for lat, lng in points:
+        lat_buffer = radius_km / 111.0
+        lng_buffer = radius_km / (111.0 * math.cos(math.radians(lat)))
+        box = (lat - lat_buffer, lat + lat_buffer, lng - lng_buffer, lng + lng_buffer)
+
+        cursor.execute(
+            """
+            SELECT latitude, longitude, injuries, fatalities FROM crashes
+            WHERE latitude BETWEEN %s AND %s AND longitude BETWEEN %s AND %s
+            """,
+            box,
+        )
+        rows = cursor.fetchall()
+        raw_box = (len(rows), sum(r[2] or 0 for r in rows), sum(r[3] or 0 for r in rows))
+        near = [r for r in rows if utils.euc_distance(lat, lng, float(r[0]), float(r[1])) <= radius_km]
+        raw_radius = (len(near), sum(r[2] or 0 for r in near), sum(r[3] or 0 for r in near))
+
+        cell_box = tuple(aggregate_box(cursor, attr, *box) for attr in ATTRS)
+        cell_radius = radius_totals(cursor, lat, lng, radius_km, box)
+        if raw_box != cell_box or raw_radius != cell_radius:
+            mismatches.append(
+                {"point": (lat, lng), "raw": (raw_box, raw_radius), "cells": (cell_box, cell_radius)}
+            )
+    return mismatches
+
+
+if __name__ == "__main__":
+    import safety_engine
+    from constants import popular_starts
+
+    parser = argparse.ArgumentParser(description="Maintain the crash_cells aggregate table")
+    parser.add_argument("--rebuild", action="store_true", help="recompute every cell from crashes")
+    parser.add_argument("--verify", action="store_true", help="check cells against raw rows")
+    args = parser.parse_args()
+
+    conn = safety_engine.get_db_connection()
+    if args.rebuild:
+        print(f"✓ Rebuilt {rebuild_cells(conn)} crash cells")
+    if args.verify:
+        points = [(start["lat"], start["lng"]) for start in popular_starts]
+        mismatches = verify(conn, points)
+        for mismatch in mismatches:
+            print(f"   MISMATCH {mismatch}")
+        print(f"✓ {len(points) - len(mismatches)}/{len(points)} points match raw rows")
+    conn.close()
@@ -0,0 +1,215 @@
+import argparse
+import math
+import os
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+import cities
+import crash_snapshot
+from constants import CrashCellsConfig, CrashHoursConfig, SpatialKeyConfig
+
+# Crash counts by hour of day and by weekday for every crash_cells-sized cell
+# over the city. Counts are stored as uint16 and served from summed-area tables,
+# so the histogram of any box is four lookups per bin whatever its size.
+CELL_DEG = float(CrashCellsConfig.CELL_DEG)
+LAT_MIN = float(SpatialKeyConfig.LAT_MIN)
+LNG_MIN = float(SpatialKeyConfig.LNG_MIN)
+SHAPE = (
+    math.ceil((float(SpatialKeyConfig.LAT_MAX) - LAT_MIN) / CELL_DEG),
+    math.ceil((float(SpatialKeyConfig.LNG_MAX) - LNG_MIN) / CELL_DEG),
+)
+TIMEZONE = ZoneInfo(CrashHoursConfig.TIMEZONE.value)
+
+_crash_hours = None
+_loaded = False
+
+
+def migrate(conn):
+    """Add the crash_time column; crashes stored before it stay NULL until refetched"""
+    cursor = conn.cursor()
+    cursor.execute("ALTER TABLE crashes ADD COLUMN IF NOT EXISTS crash_time TIME")
+    conn.commit()
+
+
+def fill_missing_times(cursor, rows):
+    """
+    Set crash_time on existing crashes stored before it was ingested
+
+    Args:
+        rows: (collision_id, 'H:MM' crash_time) pairs from a fresh fetch
+
+    Returns:
+        Number of crashes that got a time
+    """
+    known = [(collision_id, crash_time) for collision_id, crash_time in rows if crash_time]
+    if not known:
+        return 0
+    cursor.execute(
+        """
+        UPDATE crashes SET crash_time = batch.crash_time
+        FROM unnest(%s::bigint[], %s::time[]) AS batch(collision_id, crash_time)
+        WHERE crashes.collision_id = batch.collision_id AND crashes.crash_time IS NULL
+        """,
+        ([int(row[0]) for row in known], [row[1] for row in known]),
+    )
+    return cursor.rowcount
+
+
+def _summed(counts):
+    table = np.zeros((counts.shape[0] + 1, counts.shape[1] + 1, counts.shape[2]), dtype=np.int32)
+    table[1:, 1:] = counts.cumsum(axis=0, dtype=np.int32).cumsum(axis=1, dtype=np.int32)
+    return table
+
+
+class CrashHours:
+    """Per-cell hour-of-day (24) and weekday (7, Monday first) crash histograms"""
+
+    def __init__(self, hours, weekdays):
+        self.hours = hours
+        self.weekdays = weekdays
+        self._hour_table = _summed(hours)
+        self._weekday_table = _summed(weekdays)
+        self.city_hours = self._hour_table[-1, -1].astype(np.float64)
+        self.city_weekdays = self._weekday_table[-1, -1].astype(np.float64)
+
+    @classmethod
+    def from_arrays(cls, lat, lng, epoch_days, minutes):
+        """Histograms from crash columns; minutes < 0 (unknown time) only count toward weekdays"""
+        rows = np.floor((np.asarray(lat) - LAT_MIN) / CELL_DEG).astype(np.int64)
+        cols = np.floor((np.asarray(lng) - LNG_MIN) / CELL_DEG).astype(np.int64)
+        inside = (rows >= 0) & (rows < SHAPE[0]) & (cols >= 0) & (cols < SHAPE[1])
+        cells = rows * SHAPE[1] + cols
+        minutes = np.asarray(minutes)
+        # 1970-01-01 was a Thursday
+        weekday = (np.asarray(epoch_days, dtype=np.int64) + 3) % 7
+        timed = inside & (minutes >= 0)
+
+        def histogram(cell, bins, size):
+            counts = np.bincount(cell * size + bins, minlength=SHAPE[0] * SHAPE[1] * size)
+            return np.minimum(counts, np.iinfo(np.uint16).max).astype(np.uint16).reshape(SHAPE + (size,))
+
+        return cls(
+            histogram(cells[timed], minutes[timed] // 60, 24),
+            histogram(cells[inside], weekday[inside], 7),
+        )
+
+    def save(self, path=CrashHoursConfig.PATH.value):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp.{os.getpid()}.npz"
+        np.savez_compressed(tmp_path, hours=self.hours, weekdays=self.weekdays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=CrashHoursConfig.PATH.value):
+        with np.load(path) as data:
+            return cls(data["hours"], data["weekdays"])
+
+    def box_histograms(self, lat_min, lat_max, lng_min, lng_max):
+        """(hours, weekdays) crash counts of the cells a box touches"""
+        r0 = min(max(int(math.floor((lat_min - LAT_MIN) / CELL_DEG)), 0), SHAPE[0])
+        r1 = min(max(int(math.floor((lat_max - LAT_MIN) / CELL_DEG)) + 1, 0), SHAPE[0])
+        c0 = min(max(int(math.floor((lng_min - LNG_MIN) / CELL_DEG)), 0), SHAPE[1])
+        c1 = min(max(int(math.floor((lng_max - LNG_MIN) / CELL_DEG)) + 1, 0), SHAPE[1])
+
+        def box(table):
+            return table[r1, c1] - table[r0, c1] - table[r1, c0] + table[r0, c0]
+
+        return box(self._hour_table), box(self._weekday_table)
+
+    def _shares(self, lat, lng, radius_km):
+        # local pattern shrunk toward the citywide one, so sparse areas don't swing wildly
+        lat_buffer = radius_km / 111.0
+        lng_buffer = radius_km / (111.0 * math.cos(math.radians(lat)))
+        hours, weekdays = self.box_histograms(lat - lat_buffer, lat + lat_buffer, lng - lng_buffer, lng + lng_buffer)
+        prior = float(CrashHoursConfig.PRIOR_WEIGHT)
+
+        def blend(local, city):
+            city_share = city / max(city.sum(), 1.0)
+            return (local + prior * city_share) / (local.sum() + prior)
+
+        return blend(hours, self.city_hours), blend(weekdays, self.city_weekdays)
+
+    def time_factor(self, lat, lng, radius_km, when):
+        """How many times the average crash rate this area sees at `when` (1.0 = average)"""
+        when = local_time(when)
+        hour_share, weekday_share = self._shares(lat, lng, radius_km)
+        return float(hour_share[when.hour] * 24 * weekday_share[when.weekday()] * 7)
+
+    def hour_risk(self, lat, lng, radius_km):
+        """Relative crash risk by local hour of day, scaled so the worst hour is 1"""
+        hour_share, _ = self._shares(lat, lng, radius_km)
+        return hour_share / max(hour_share.max(), 1e-12)
+
+
+def local_time(when):
+    """A planned start time in the city's timezone; naive times are taken as local already"""
+    if when.tzinfo is None:
+        return when
+    return when.astimezone(TIMEZONE)
+
+
+def rebuild(snapshot=None, path=CrashHoursConfig.PATH.value):
+    """Recompute the histograms from the crash snapshot and save them; returns the crashes with a time"""
+    global _crash_hours, _loaded
+    snapshot = snapshot or crash_snapshot.get_snapshot()
+    if snapshot is None:
+        raise RuntimeError("No crash snapshot to build crash hour histograms from")
+    crash_hours = CrashHours.from_arrays(snapshot.lat, snapshot.lng, snapshot.date, snapshot.minute)
+    crash_hours.save(path)
+    _crash_hours, _loaded = crash_hours, True
+    return int(crash_hours.city_hours.sum())
+
+
+def get_crash_hours(path=CrashHoursConfig.PATH.value):
+    """Shared histograms for this worker, None if they haven't been built"""
+    global _crash_hours, _loaded
+    if not _loaded:
+        _loaded = True
+        try:
+            _crash_hours = CrashHours.load(path)
+        except (OSError, KeyError, ValueError) as e:
+            print(f"Crash hour histograms unavailable: {e}")
+            _crash_hours = None
+    return _crash_hours
+
+
+def reload(path=CrashHoursConfig.PATH.value):
+    """Load rebuilt histograms and swap them in for this worker"""
+    global _crash_hours, _loaded
+    crash_hours = CrashHours.load(path)
+    _crash_hours, _loaded = crash_hours, True
+    return crash_hours
+
+
+def time_factor(lat, lng, radius_km, when):
+    """CrashHours.time_factor, or 1.0 (time-agnostic) when there are no histograms or no time"""
+    crash_hours = get_crash_hours()
+    # the histograms cover the default city only
+    if when is None or crash_hours is None or not cities.city_at(lat, lng).is_default:
+        return 1.0
+    return crash_hours.time_factor(lat, lng, radius_km, when)
+
+
+def hour_risk(lat, lng, radius_km=1.0):
+    """CrashHours.hour_risk, or None when there are no histograms for the point's city"""
+    crash_hours = get_crash_hours()
+    if crash_hours is None or not cities.city_at(lat, lng).is_default:
+        return None
+    return crash_hours.hour_risk(lat, lng, radius_km)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Crash hour-of-day and weekday histograms")
+    parser.add_argument("--rebuild", action="store_true", help="Recompute from the crash snapshot")
+    parser.add_argument("--lat", type=float, default=40.7580)
+    parser.add_argument("--lng", type=float, default=-73.9855)
+    args = parser.parse_args()
+
+    if args.rebuild:
+        print(f"✓ Histograms built from {rebuild()} timed crashes into {CrashHoursConfig.PATH.value}")
+
+    risk = hour_risk(args.lat, args.lng)
+    if risk is not None:
+        for hour, value in enumerate(risk):
+            print(f"   {hour:02d}:00 {'#' * int(value * 40)}")
@@ -0,0 +1,213 @@
+import mmap
+import os
+import struct
+from datetime import date
+
+import numpy as np
+import zstandard
+
+from constants import CrashSnapshotConfig
+
+# File layout (little endian):
+#   64 byte header: magic, format version, row count
+#   fixed-width columns back to back, rows sorted by latitude
+MAGIC = b"RSCS"
+FORMAT_VERSION = 2  # v2 added the minute column
+HEADER = struct.Struct("<4sHxxQ")
+HEADER_SIZE = 64
+
+# widest dtypes first so every column stays naturally aligned
+COLUMNS = [
+    ("lat", np.float64),
+    ("lng", np.float64),
+    ("collision_id", np.int64),
+    ("date", np.int32),  # days since 1970-01-01
+    ("minute", np.int16),  # crash_time as minutes after midnight, -1 if unknown
+    ("injuries", np.int16),
+    ("fatalities", np.int16),
+]
+
+EPOCH = date(1970, 1, 1)
+
+_snapshot = None  # one mapping per worker; the pages themselves live in the shared page cache
+
+
+def write_snapshot(rows, path=CrashSnapshotConfig.PATH.value, compress=False):
+    """
+    Write crash rows to a columnar snapshot file
+
+    Args:
+        rows: Iterable of (collision_id, crash_date, latitude, longitude, injuries, fatalities),
+            optionally followed by crash_time
+        path: Destination of the uncompressed snapshot
+        compress: Also write a zstd-compressed copy at path + '.zst'
+
+    Returns:
+        Number of rows written
+    """
+    rows = list(rows)
+    n = len(rows)
+
+    columns = {
+        "lat": np.fromiter((float(r[2]) for r in rows), dtype=np.float64, count=n),
+        "lng": np.fromiter((float(r[3]) for r in rows), dtype=np.float64, count=n),
+        "collision_id": np.fromiter((int(r[0]) for r in rows), dtype=np.int64, count=n),
+        "date": np.fromiter((_to_epoch_days(r[1]) for r in rows), dtype=np.int32, count=n),
+        "minute": np.fromiter((_to_minutes(r[6] if len(r) > 6 else None) for r in rows), dtype=np.int16, count=n),
+        "injuries": np.fromiter((int(r[4] or 0) for r in rows), dtype=np.int16, count=n),
+        "fatalities": np.fromiter((int(r[5] or 0) for r in rows), dtype=np.int16, count=n),
+    }
+
+    # sorted by latitude so box queries are a binary search plus a small scan
+    order = np.argsort(columns["lat"], kind="stable")
+
+    payload = bytearray(HEADER.pack(MAGIC, FORMAT_VERSION, n).ljust(HEADER_SIZE, b"\0"))
+    for name, dtype in COLUMNS:
+        payload += columns[name][order].astype(dtype).tobytes()
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    _atomic_write(path, payload)
+    if compress:
+        _atomic_write(f"{path}.zst", zstandard.ZstdCompressor(level=10).compress(bytes(payload)))
+
+    return n
+
+
+def write_snapshot_from_db(conn, path=CrashSnapshotConfig.PATH.value, compress=None, table="crashes"):
+    """Export a whole crash table (one city's) to a snapshot file"""
+    if compress is None:
+        compress = CrashSnapshotConfig.WRITE_COMPRESSED == "true"
+
+    cursor = conn.cursor()
+    cursor.execute(
+        f"""
+        SELECT collision_id, crash_date, latitude, longitude, injuries, fatalities, crash_time
+        FROM {table}
+        WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+        """
+    )
+    n = write_snapshot(cursor.fetchall(), path, compress=compress)
+    cursor.close()
+    return n
+
+
+class CrashSnapshot:
+    """Read-only, memory-mapped view over a snapshot file"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, n = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a crash snapshot")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"{path} has snapshot format v{version}, expected v{FORMAT_VERSION}")
+
+        self.version = version
+        self.size = n
+        self.mtime = os.path.getmtime(path)
+
+        # zero-copy column views over the mapping
+        offset = HEADER_SIZE
+        for name, dtype in COLUMNS:
+            setattr(self, name, np.frombuffer(self._mmap, dtype=dtype, count=n, offset=offset))
+            offset += n * np.dtype(dtype).itemsize
+
+    def box_indices(self, lat_lo, lat_hi, lng_lo, lng_hi):
+        """Row indices inside a lat/lng bounding box (inclusive, like SQL BETWEEN)"""
+        start = np.searchsorted(self.lat, lat_lo, side="left")
+        stop = np.searchsorted(self.lat, lat_hi, side="right")
+        lng = self.lng[start:stop]
+        return start + np.nonzero((lng >= lng_lo) & (lng <= lng_hi))[0]
+
+    def rows_in_box(self, lat_lo, lat_hi, lng_lo, lng_hi):
+        """Rows in the same tuple shape as the crashes SELECT"""
+        idx = self.box_indices(lat_lo, lat_hi, lng_lo, lng_hi)
+        return [
+            (
+                int(self.collision_id[i]),
+                _from_epoch_days(self.date[i]),
+                float(self.lat[i]),
+                float(self.lng[i]),
+                int(self.injuries[i]),
+                int(self.fatalities[i]),
+            )
+            for i in idx
+        ]
+
+    def aggregate_box(self, attr, lat_lo, lat_hi, lng_lo, lng_hi):
+        """Equivalent of COUNT(*) / COALESCE(SUM(attr), 0) over a bounding box"""
+        idx = self.box_indices(lat_lo, lat_hi, lng_lo, lng_hi)
+        if attr == "crashes":
+            return int(len(idx))
+        return int(getattr(self, attr)[idx].sum(dtype=np.int64))
+
+    def close(self):
+        self._mmap.close()
+
+
+def open_snapshot(path=CrashSnapshotConfig.PATH.value):
+    """Open a snapshot, inflating the .zst variant next to it if only that exists"""
+    if not os.path.exists(path):
+        compressed = f"{path}.zst"
+        if not os.path.exists(compressed):
+            return None
+        with open(compressed, "rb") as f:
+            _atomic_write(path, zstandard.ZstdDecompressor().decompress(f.read()))
+    return CrashSnapshot(path)
+
+
+def get_snapshot(path=CrashSnapshotConfig.PATH.value):
+    """Shared snapshot for this worker, or None when no snapshot has been exported"""
+    global _snapshot
+    if _snapshot is None or _snapshot.path != path:
+        try:
+            _snapshot = open_snapshot(path)
+        except (OSError, ValueError) as e:
+            print(f"Could not open crash snapshot: {e}")
+            _snapshot = None
+    return _snapshot
+
+
+def reload_snapshot(path=CrashSnapshotConfig.PATH.value):
+    """
+    Map a freshly exported snapshot and swap it in for this worker
+
+    The old mapping isn't closed: requests still holding its column views keep
+    it alive, and it is released once they are done with it.
+    """
+    global _snapshot
+    snapshot = open_snapshot(path)
+    if snapshot is not None:
+        _snapshot = snapshot
+    return snapshot
+
+
+def _atomic_write(path, data):
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _to_epoch_days(value):
+    if isinstance(value, str):
+        value = date.fromisoformat(value[:10])
+    if hasattr(value, "date"):
+        value = value.date()
+    return (value - EPOCH).days
+
+
+def _to_minutes(value):
+    if value is None:
+        return -1
+    if hasattr(value, "hour"):
+        return value.hour * 60 + value.minute
+    hours, minutes = str(value).split(":")[:2]
+    return int(hours) * 60 + int(minutes)
+
+
+def _from_epoch_days(days):
+    return date.fromordinal(EPOCH.toordinal() + int(days))
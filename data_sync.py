@@ -0,0 +1,372 @@
+import argparse
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from psycopg2.extras import execute_values
+
+import backfill
+import cache
+import cities
+import crash_cells
+import crash_hours
+import crash_snapshot
+import edge_exposure
+import heatmap_tiles
+import http_client
+import outbound
+import safety_engine
+import spatial_key
+from constants import APIConfig, ScheduleConfig, SyncConfig
+
+# Delta sync: pull crashes a city's open data portal changed since the last
+# watermark (Socrata's :updated_at), upsert them into the city's table, refresh
+# the derived aggregates and files, then publish a new data version. Workers poll
+# the version file and swap their in-memory indexes in the background
+# (Reloader), so nothing restarts. Each city keeps its own watermark under its
+# table name; the data version is shared, the highest any city has reached.
+
+
+def ensure_state_table(cursor, source="crashes"):
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS sync_state (
+            source TEXT PRIMARY KEY,
+            watermark TEXT,
+            version BIGINT NOT NULL DEFAULT 0,
+            synced_at TIMESTAMPTZ
+        )
+        """
+    )
+    cursor.execute("INSERT INTO sync_state (source) VALUES (%s) ON CONFLICT DO NOTHING", (source,))
+
+
+def get_state(cursor, source="crashes"):
+    """(watermark, version) of the source's last sync"""
+    ensure_state_table(cursor, source)
+    cursor.execute("SELECT watermark, version FROM sync_state WHERE source = %s", (source,))
+    return cursor.fetchone()
+
+
+def bump_version(conn, watermark=None, source="crashes"):
+    """Move the data version past every source's (and the watermark if given); returns the new version"""
+    cursor = conn.cursor()
+    ensure_state_table(cursor, source)
+    cursor.execute(
+        """
+        UPDATE sync_state
+        SET version = (SELECT MAX(version) FROM sync_state) + 1, watermark = COALESCE(%s, watermark), synced_at = now()
+        WHERE source = %s RETURNING version
+        """,
+        (watermark, source),
+    )
+    version = cursor.fetchone()[0]
+    conn.commit()
+    return version
+
+
+def publish_version(version, path=SyncConfig.VERSION_PATH.value, city=None, **details):
+    """Tell workers on this host that the city's files for `version` are in place"""
+    published = read_published(path) or {}
+    city_versions = {**published.get("cities", {}), (city or cities.get_city()).key: version}
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, "w") as f:
+        json.dump(
+            {
+                "version": max(version, published.get("version", 0)),
+                "published_at": datetime.now(timezone.utc).isoformat(),
+                "cities": city_versions,
+                **details,
+            },
+            f,
+        )
+    os.replace(tmp_path, path)
+
+
+def published_city_version(city, path=SyncConfig.VERSION_PATH.value):
+    """Version the city's files were last published at, None if never"""
+    published = read_published(path) or {}
+    if "cities" not in published and city.is_default:
+        return published.get("version")  # written before there were several cities
+    return published.get("cities", {}).get(city.key)
+
+
+def read_published(path=SyncConfig.VERSION_PATH.value):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def fetch_changes(watermark, page_size=None, url=APIConfig.NYC_CRASHES_URL.value):
+    """Every crash record updated after the watermark, oldest change first"""
+    page_size = page_size or int(APIConfig.REQUEST_LIMIT)
+    changes = []
+    while True:
+        params = {
+            "$select": ":*, *",
+            "$where": f":updated_at > '{watermark}' AND latitude IS NOT NULL AND longitude IS NOT NULL",
+            "$order": ":updated_at, :id",
+            "$limit": page_size,
+            "$offset": len(changes),
+        }
+        response = outbound.call(
+            "socrata",
+            lambda timeout: http_client.get(url, params=params, timeout=timeout),
+        )
+        response.raise_for_status()
+        page = response.json()
+        changes.extend(page)
+        print(f"   Fetched {len(changes)} changed crashes")
+        if len(page) < page_size:
+            return changes
+
+
+def ensure_crash_table(cursor, city):
+    """Create a new city's crash table with the default city's columns, primary key and indexes"""
+    if city.is_default:
+        return
+    default_table = cities.get_city().table
+    cursor.execute(
+        f"CREATE TABLE IF NOT EXISTS {city.table} (LIKE {default_table} INCLUDING ALL)"
+    )
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS {city.table}_lat_lng_idx ON {city.table} (latitude, longitude)")
+
+
+def apply_changes(conn, changes, city=None):
+    """
+    Upsert changed crashes into the city's table and keep crash_cells exact
+
+    Returns:
+        (inserted rows, number of existing crashes that were updated)
+    """
+    rows = []
+    for crash in changes:
+        try:
+            rows.append(backfill.crash_row(crash))
+        except (TypeError, ValueError):
+            continue
+    if not rows:
+        return [], 0
+
+    city = city or cities.get_city()
+    # crash_cells and the Hilbert keys only exist for the default city
+    with_cells = city.is_default and crash_cells.cells_available(conn.cursor())
+    cursor = conn.cursor()
+    ids = [int(row[0]) for row in rows]
+    cursor.execute(f"SELECT collision_id FROM {city.table} WHERE collision_id = ANY(%s::bigint[])", (ids,))
+    existing = {row[0] for row in cursor.fetchall()}
+    cells_before = crash_cells.cells_of(cursor, existing) if with_cells else set()
+
+    execute_values(
+        cursor,
+        f"""
+        INSERT INTO {city.table} (collision_id, crash_date, latitude, longitude, injuries, fatalities, crash_time, hkey)
+        VALUES %s
+        ON CONFLICT (collision_id) DO UPDATE SET
+            crash_date = EXCLUDED.crash_date,
+            latitude = EXCLUDED.latitude,
+            longitude = EXCLUDED.longitude,
+            injuries = EXCLUDED.injuries,
+            fatalities = EXCLUDED.fatalities,
+            crash_time = EXCLUDED.crash_time,
+            hkey = EXCLUDED.hkey
+        """,
+        [row + (spatial_key.hilbert_key(row[2], row[3]) if city.is_default else None,) for row in rows],
+    )
+
+    inserted = [row for row in rows if int(row[0]) not in existing]
+    if with_cells:
+        # new crashes are added to their cells; edited ones get their old and new cells recounted
+        crash_cells.update_cells(cursor, [int(row[0]) for row in inserted])
+        crash_cells.recompute_cells(cursor, cells_before | crash_cells.cells_of(cursor, existing))
+    return inserted, len(existing)
+
+
+def rebuild_derived(conn, inserted, rebuild_edges, city=None):
+    """Rewrite the files workers serve from: snapshot, and for the default city hour histograms and edge index"""
+    city = city or cities.get_city()
+    snapshot_rows = crash_snapshot.write_snapshot_from_db(conn, city.snapshot_path, table=city.table)
+    print(f"✓ Wrote {snapshot_rows} crashes to {city.snapshot_path}")
+    if not city.is_default:
+        return
+    snapshot = crash_snapshot.open_snapshot(city.snapshot_path)
+
+    timed = crash_hours.rebuild(snapshot)
+    print(f"✓ Rebuilt hour/weekday histograms from {timed} timed crashes")
+
+    if rebuild_edges:
+        # edited crashes can't be folded in incrementally, their old counts are in the index
+        edges = edge_exposure.rebuild_saved_index(edge_exposure.fetch_crash_arrays(snapshot))
+        print(f"✓ Rebuilt the edge exposure index ({edges} crashes)")
+    else:
+        edges = edge_exposure.update_saved_index(inserted)
+        print(f"✓ Added {edges} crashes to the edge exposure index")
+
+
+def sync(conn=None, city=None):
+    """
+    One delta sync of a city (the default one if not given); returns the published
+    data version, or None if nothing changed
+
+    The watermark and version only move once the database changes are committed,
+    and the version is published only after every derived file is rewritten, so a
+    failed run is simply picked up again by the next one.
+    """
+    city = city or cities.get_city()
+    conn = conn or safety_engine.get_db_connection()
+    cursor = conn.cursor()
+    spatial_key.migrate(conn)
+    crash_hours.migrate(conn)
+    ensure_crash_table(cursor, city)
+    watermark, version = get_state(cursor, city.table)
+    conn.commit()
+
+    if watermark is None:
+        lookback = timedelta(days=int(SyncConfig.INITIAL_LOOKBACK_DAYS))
+        watermark = (datetime.now(timezone.utc) - lookback).strftime("%Y-%m-%dT%H:%M:%S")
+    print(f"Syncing {city.name} crashes changed after {watermark}...")
+
+    # a run that committed but died before publishing left the files behind
+    pending = bool(version) and published_city_version(city) != version
+
+    changes = fetch_changes(watermark, url=city.crashes_url)
+    if not changes and not pending:
+        print("✓ No changes")
+        return None
+
+    inserted, updated = [], 0
+    if changes:
+        inserted, updated = apply_changes(conn, changes, city)
+        watermark = max(change[":updated_at"] for change in changes)
+        # commits the upserts together with the new watermark and version
+        version = bump_version(conn, watermark=watermark, source=city.table)
+        print(f"✓ Inserted {len(inserted)} and updated {updated} crashes, data version {version}")
+
+    rebuild_derived(conn, inserted, rebuild_edges=updated > 0 or pending, city=city)
+    publish_version(version, city=city, watermark=watermark, inserted=len(inserted), updated=updated)
+    return version
+
+
+def seconds_until(daily_time, now=None):
+    """Seconds from now until the next HH:MM (local time)"""
+    now = now or datetime.now()
+    hour, minute = (int(part) for part in daily_time.split(":"))
+    next_run = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if next_run <= now:
+        next_run += timedelta(days=1)
+    return (next_run - now).total_seconds()
+
+
+def run_daily(daily_time=ScheduleConfig.DAILY_TIME.value):
+    """Sync every city once a day at daily_time, forever"""
+    while True:
+        wait_s = seconds_until(daily_time)
+        print(f"Next crash sync in {wait_s / 3600:.1f}h ({daily_time})")
+        time.sleep(wait_s)
+        for city in cities.all_cities():
+            try:
+                sync(city=city)
+            except Exception as e:
+                # keep the schedule; the watermark didn't move so tomorrow catches up
+                print(f"{city.name} crash sync failed: {e}")
+
+
+def default_reload_steps():
+    """Each swaps a freshly loaded index in for the one this worker is serving"""
+    return [
+        ("crash_snapshot", crash_snapshot.reload_snapshot),
+        ("crash_hours", crash_hours.reload),
+        ("edge_index", edge_exposure.reload_edge_index),
+        ("heatmap_surface", heatmap_tiles.reload_surface),
+        ("city_shards", cities.reload_shards),
+    ]
+
+
+class Reloader:
+    """
+    Polls the published data version and hot-swaps this worker's indexes
+
+    New indexes are loaded in a background thread while requests keep using
+    the old ones; each swap is a single reference assignment. The cache data
+    version moves last, so cached results computed before it stop matching.
+    """
+
+    def __init__(self, steps, path=SyncConfig.VERSION_PATH.value, poll_s=None):
+        self.steps = steps
+        self.path = path
+        self.poll_s = poll_s or float(SyncConfig.POLL_S)
+        self.mtime = None
+        self.last_reload = None
+        self.errors = {}
+        self._stop = threading.Event()
+        published = read_published(path)
+        if published:
+            cache.set_data_version(published["version"])
+
+    def check(self):
+        """Swap in newly published data; returns True if every reload step succeeded"""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return False
+        if mtime == self.mtime:
+            return False
+        self.mtime = mtime
+        published = read_published(self.path)
+        if not published or published["version"] <= cache.data_version():
+            return False
+
+        started = time.perf_counter()
+        timings_ms = {}
+        self.errors = {}
+        for name, step in self.steps:
+            step_started = time.perf_counter()
+            try:
+                step()
+            except Exception as e:
+                self.errors[name] = str(e)
+                print(f"   Reload step {name} failed: {e}")
+            timings_ms[name] = round((time.perf_counter() - step_started) * 1000, 1)
+        if self.errors:
+            # keep serving cached results under the old version, and retry on the next poll
+            self.mtime = None
+            self.last_reload = {"version": published["version"], "timings_ms": timings_ms, "failed": True}
+            return False
+        cache.set_data_version(published["version"])
+        self.last_reload = {"version": published["version"], "timings_ms": timings_ms}
+        print(f"✓ Serving crash data v{published['version']} ({time.perf_counter() - started:.1f}s)")
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self.poll_s):
+            self.check()
+
+    def start(self):
+        threading.Thread(target=self._run, name="data-reloader", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    def status(self):
+        return {
+            "data_version": cache.data_version(),
+            "last_reload": self.last_reload,
+            "errors": dict(self.errors),
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incremental crash data sync")
+    parser.add_argument("--once", action="store_true", help="Sync now and exit instead of daily")
+    parser.add_argument("--city", help="City to sync with --once (constants.city_registry key)")
+    args = parser.parse_args()
+
+    if args.once:
+        sync(city=cities.get_city(args.city))
+    else:
+        run_daily()
@@ -0,0 +1,39 @@
+import time
+
+
+class Deadline:
+    """
+    Latency budget for one request
+
+    Stages check how much time is left before starting expensive work and record
+    the shortcut they took instead, so the response can say what was degraded.
+    """
+
+    def __init__(self, budget_s):
+        self.budget_s = budget_s
+        self.started = time.monotonic()
+        self.expires_at = self.started + budget_s
+        self.degradations = []
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def has(self, seconds):
+        """True if at least `seconds` of budget are left"""
+        return self.remaining() >= seconds
+
+    def degrade(self, name):
+        if name not in self.degradations:
+            print(f"⏱  Degrading: {name} ({self.remaining():.1f}s left)")
+            self.degradations.append(name)
+
+
+def has_time(deadline, seconds):
+    """has() that treats a missing deadline as unlimited"""
+    return deadline is None or deadline.has(seconds)
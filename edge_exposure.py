@@ -0,0 +1,360 @@
+import math
+import os
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+import crash_snapshot
+import safety_engine
+import street_graph
+from constants import EdgeExposureConfig
+
+# baseline grid resolution in degrees; box sums come from a summed-area table
+GRID_DEG = 0.0005
+# same neighbourhood safety_wrapper samples: 5x5 points, 0.01 degrees apart
+BASELINE_OFFSETS = np.array([-2, -1, 0, 1, 2]) * 0.01
+ATTRS = ("crashes", "injuries", "fatalities")
+
+_index = None
+_edge_tree = None  # (graph, tree, sample edge ids, lat0), rebuilt if the graph changes
+
+
+def _project(lat, lng, lat0):
+    """Local equirectangular projection in meters, good enough for snapping"""
+    return np.column_stack((np.asarray(lng) * 111320 * math.cos(math.radians(lat0)), np.asarray(lat) * 110540))
+
+
+def _get_edge_tree(graph, spacing_m=15.0):
+    """KD-tree over points sampled along every edge, labelled with their edge id"""
+    global _edge_tree
+    if _edge_tree is not None and _edge_tree[0] is graph:
+        return _edge_tree[1], _edge_tree[2], _edge_tree[3]
+
+    per_edge = np.ceil(graph.edge_length_m / spacing_m).astype(np.int64) + 1
+    edge_ids = np.repeat(np.arange(graph.num_edges), per_edge)
+    # fraction along each edge: 0 .. 1 inclusive
+    first = np.repeat(np.cumsum(per_edge) - per_edge, per_edge)
+    t = (np.arange(len(edge_ids)) - first) / np.repeat(per_edge - 1, per_edge)
+
+    u, v = graph.edge_u[edge_ids], graph.edge_v[edge_ids]
+    lat = graph.node_lat[u] + t * (graph.node_lat[v] - graph.node_lat[u])
+    lng = graph.node_lng[u] + t * (graph.node_lng[v] - graph.node_lng[u])
+
+    lat0 = float(np.mean(graph.node_lat))
+    tree = cKDTree(_project(lat, lng, lat0))
+    _edge_tree = (graph, tree, edge_ids, lat0)
+    return tree, edge_ids, lat0
+
+
+def snap_to_edges(graph, lat, lng, max_distance_m=float(EdgeExposureConfig.MAX_SNAP_METERS)):
+    """Nearest edge id per point, -1 where nothing is within max_distance_m"""
+    tree, edge_ids, lat0 = _get_edge_tree(graph)
+    if len(lat) == 0:
+        return np.empty(0, dtype=np.int64)
+    distance, nearest = tree.query(_project(lat, lng, lat0), distance_upper_bound=max_distance_m)
+    found = np.isfinite(distance)
+    snapped = np.full(len(distance), -1, dtype=np.int64)
+    snapped[found] = edge_ids[nearest[found]]
+    return snapped
+
+
+def fetch_crash_arrays(snapshot=None):
+    """All crashes as column arrays, from the mmap snapshot if present, else Postgres"""
+    snapshot = snapshot or crash_snapshot.get_snapshot()
+    if snapshot is not None:
+        return {
+            "collision_id": np.array(snapshot.collision_id),
+            "lat": np.array(snapshot.lat),
+            "lng": np.array(snapshot.lng),
+            "injuries": np.array(snapshot.injuries, dtype=np.int64),
+            "fatalities": np.array(snapshot.fatalities, dtype=np.int64),
+        }
+
+    conn = safety_engine.get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        SELECT collision_id, crash_date, latitude, longitude, injuries, fatalities
+        FROM crashes
+        WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+        """
+    )
+    rows = cursor.fetchall()
+    conn.close()
+    return rows_to_arrays(rows)
+
+
+def rows_to_arrays(rows):
+    """(collision_id, crash_date, latitude, longitude, injuries, fatalities) rows to arrays"""
+    return {
+        "collision_id": np.array([int(r[0]) for r in rows], dtype=np.int64),
+        "lat": np.array([float(r[2]) for r in rows], dtype=np.float64),
+        "lng": np.array([float(r[3]) for r in rows], dtype=np.float64),
+        "injuries": np.array([int(r[4] or 0) for r in rows], dtype=np.int64),
+        "fatalities": np.array([int(r[5] or 0) for r in rows], dtype=np.int64),
+    }
+
+
+def build_edge_index(graph, crashes, radius_km=0.5):
+    """
+    Snap crashes onto street edges and precompute per-edge counts and baselines
+
+    Args:
+        graph: StreetGraph the routes are expressed on
+        crashes: Column arrays as returned by fetch_crash_arrays
+        radius_km: Neighbourhood box half-size, the radius safety_wrapper is called with
+
+    Returns:
+        Index dict of NumPy arrays (see save_edge_index)
+    """
+    pad = 2 * 0.01 + radius_km / 80  # sample offsets plus box half-width, with margin
+    origin_lat = float(graph.node_lat.min()) - pad
+    origin_lng = float(graph.node_lng.min()) - pad
+    shape = (
+        int(math.ceil((graph.node_lat.max() + pad - origin_lat) / GRID_DEG)) + 1,
+        int(math.ceil((graph.node_lng.max() + pad - origin_lng) / GRID_DEG)) + 1,
+    )
+
+    index = {
+        "num_edges": np.int64(graph.num_edges),
+        "radius_km": np.float64(radius_km),
+        "origin": np.array([origin_lat, origin_lng]),
+        "grid": np.zeros((len(ATTRS),) + shape, dtype=np.int32),
+        "edge_counts": np.zeros((len(ATTRS), graph.num_edges), dtype=np.int32),
+        "collision_ids": np.empty(0, dtype=np.int64),
+    }
+
+    # street length per grid cell, used to turn box medians into per-edge expectations
+    mid_lat = (graph.node_lat[graph.edge_u] + graph.node_lat[graph.edge_v]) / 2
+    mid_lng = (graph.node_lng[graph.edge_u] + graph.node_lng[graph.edge_v]) / 2
+    rows, cols = _grid_cells(index, mid_lat, mid_lng)
+    street_grid = np.zeros(shape, dtype=np.float64)
+    np.add.at(street_grid, (rows, cols), graph.edge_length_m)
+    index["street_grid"] = street_grid
+
+    apply_new_crashes(index, graph, crashes)
+    return index
+
+
+def apply_new_crashes(index, graph, crashes):
+    """Add crashes not already in the index and refresh baselines; returns count added"""
+    new = ~np.isin(crashes["collision_id"], index["collision_ids"])
+    if not new.any():
+        return 0
+
+    lat, lng = crashes["lat"][new], crashes["lng"][new]
+    weights = (np.ones(int(new.sum()), dtype=np.int64), crashes["injuries"][new], crashes["fatalities"][new])
+
+    # neighbourhood grid sees every crash, like the radius queries do
+    rows, cols = _grid_cells(index, lat, lng)
+    inside = (rows >= 0) & (rows < index["grid"].shape[1]) & (cols >= 0) & (cols < index["grid"].shape[2])
+    for k, w in enumerate(weights):
+        np.add.at(index["grid"][k], (rows[inside], cols[inside]), w[inside])
+
+    # per-edge counts only for crashes that happened on the walkable network
+    edges = snap_to_edges(graph, lat, lng)
+    on_edge = edges >= 0
+    for k, w in enumerate(weights):
+        np.add.at(index["edge_counts"][k], edges[on_edge], w[on_edge])
+
+    index["collision_ids"] = np.union1d(index["collision_ids"], crashes["collision_id"][new])
+    _compute_baselines(index, graph)
+    return int(new.sum())
+
+
+def _grid_cells(index, lat, lng):
+    origin_lat, origin_lng = index["origin"]
+    rows = np.floor((np.asarray(lat) - origin_lat) / GRID_DEG).astype(np.int64)
+    cols = np.floor((np.asarray(lng) - origin_lng) / GRID_DEG).astype(np.int64)
+    return rows, cols
+
+
+def _box_sums(table, row_lo, row_hi, col_lo, col_hi):
+    """Sum of grid cells in inclusive boxes using a summed-area table"""
+    h, w = table.shape[0] - 1, table.shape[1] - 1
+    row_lo, row_hi = np.clip(row_lo, 0, h), np.clip(row_hi + 1, 0, h)
+    col_lo, col_hi = np.clip(col_lo, 0, w), np.clip(col_hi + 1, 0, w)
+    return table[row_hi, col_hi] - table[row_lo, col_hi] - table[row_hi, col_lo] + table[row_lo, col_lo]
+
+
+def _summed_area(grid):
+    table = np.zeros((grid.shape[0] + 1, grid.shape[1] + 1), dtype=np.float64)
+    table[1:, 1:] = grid.cumsum(0).cumsum(1)
+    return table
+
+
+def _compute_baselines(index, graph):
+    """Expected crashes/injuries/fatalities per edge from the safety_wrapper neighbourhood"""
+    radius_km = float(index["radius_km"])
+    mid_lat = (graph.node_lat[graph.edge_u] + graph.node_lat[graph.edge_v]) / 2
+    mid_lng = (graph.node_lng[graph.edge_u] + graph.node_lng[graph.edge_v]) / 2
+
+    # (edges, 25) sample points around every edge midpoint
+    sample_lat = np.repeat(mid_lat[:, None] + BASELINE_OFFSETS[None, :], 5, axis=1)
+    sample_lng = np.tile(mid_lng[:, None] + BASELINE_OFFSETS[None, :], (1, 5))
+    lat_buffer = radius_km / 111.0
+    lng_buffer = radius_km / (111.0 * np.cos(np.radians(sample_lat)))
+    row_lo, col_lo = _grid_cells(index, sample_lat - lat_buffer, sample_lng - lng_buffer)
+    row_hi, col_hi = _grid_cells(index, sample_lat + lat_buffer, sample_lng + lng_buffer)
+
+    # the centre box tells us how much street the median box count is spread across
+    street = _box_sums(_summed_area(index["street_grid"]), row_lo, row_hi, col_lo, col_hi)[:, 12]
+    share = graph.edge_length_m / np.maximum(street, graph.edge_length_m)
+
+    baselines = np.zeros((len(ATTRS), graph.num_edges), dtype=np.float64)
+    for k in range(len(ATTRS)):
+        counts = _box_sums(_summed_area(index["grid"][k]), row_lo, row_hi, col_lo, col_hi)
+        # same p50 pick as get_area_crash_percentiles: sorted[int(0.5 * 25)]
+        baselines[k] = np.sort(counts, axis=1)[:, 12] * share
+    index["edge_baselines"] = baselines
+
+
+def save_edge_index(index, path=EdgeExposureConfig.PATH.value):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp.npz"
+    np.savez_compressed(tmp_path, **index)
+    os.replace(tmp_path, path)
+
+
+def load_edge_index(path=EdgeExposureConfig.PATH.value):
+    with np.load(path) as data:
+        return {key: data[key] for key in data.files}
+
+
+def get_edge_index(path=EdgeExposureConfig.PATH.value):
+    """Shared index for this worker, or None if missing or built for another graph"""
+    global _index
+    if _index is None:
+        graph = street_graph.get_street_graph()
+        if graph is None or not os.path.exists(path):
+            return None
+        index = load_edge_index(path)
+        if int(index["num_edges"]) != graph.num_edges:
+            print("Edge exposure index was built for a different street graph, ignoring")
+            return None
+        _index = index
+    return _index
+
+
+def reload_edge_index(path=EdgeExposureConfig.PATH.value):
+    """Load a rewritten index and swap it in, if this worker had one loaded"""
+    global _index
+    if _index is None:
+        return None  # the next get_edge_index loads the new file anyway
+    graph = street_graph.get_street_graph()
+    index = load_edge_index(path)
+    if int(index["num_edges"]) == graph.num_edges:
+        _index = index
+    return _index
+
+
+def rebuild_saved_index(crashes, path=EdgeExposureConfig.PATH.value):
+    """Rebuild the saved index from scratch, when crashes were changed rather than only added"""
+    graph = street_graph.get_street_graph()
+    if graph is None or not os.path.exists(path):
+        return 0
+    index = build_edge_index(graph, crashes, radius_km=float(load_edge_index(path)["radius_km"]))
+    save_edge_index(index, path)
+    return len(index["collision_ids"])
+
+
+def update_saved_index(rows, path=EdgeExposureConfig.PATH.value):
+    """Fold newly ingested crash rows into the saved index, if one has been built"""
+    graph = street_graph.get_street_graph()
+    if graph is None or not os.path.exists(path):
+        return 0
+    index = load_edge_index(path)
+    if int(index["num_edges"]) != graph.num_edges:
+        print("Edge exposure index is for a different street graph, rebuild it")
+        return 0
+    added = apply_new_crashes(index, graph, rows_to_arrays(rows))
+    if added:
+        save_edge_index(index, path)
+    return added
+
+
+def route_edge_ids(graph, route, dense_coords, sample_spacing_m=10):
+    """Edges a route runs along: taken from local routing, else snapped from its polyline"""
+    if route.get("edge_ids"):
+        return np.asarray(route["edge_ids"], dtype=np.int64)
+
+    edges = snap_to_edges(graph, dense_coords[:, 0], dense_coords[:, 1])
+    edges = edges[edges >= 0]
+    if len(edges) == 0:
+        return edges
+
+    # consecutive samples on the same edge count once; a lone sample near an
+    # intersection is usually the cross street, so it needs the edge to be short
+    starts = np.flatnonzero(np.concatenate(([True], edges[1:] != edges[:-1])))
+    run_lengths = np.diff(np.append(starts, len(edges)))
+    runs = edges[starts]
+    keep = (run_lengths > 1) | (graph.edge_length_m[runs] < 2 * sample_spacing_m)
+    return runs[keep]
+
+
+def score_route_edges(index, graph, edge_ids, num_segments=5, score_function=None):
+    """
+    Score a route by summing per-edge exposure, split into segments along the route
+
+    Returns:
+        Dict shaped like analyze_route_safety_detailed's 'safety_analysis'
+    """
+    if score_function is None:
+        score_function = safety_engine.calculate_safety_score_logarithmic
+    if len(edge_ids) == 0:
+        return {"overall_safety_score": 100.0, "dangerous_segments": []}
+
+    lengths = graph.edge_length_m[edge_ids]
+    progress = np.cumsum(lengths) / lengths.sum()
+    segment = np.minimum((progress * num_segments - 1e-9).astype(np.int64), num_segments - 1)
+
+    counts = np.zeros((len(ATTRS), num_segments), dtype=np.int64)
+    expected = np.zeros((len(ATTRS), num_segments), dtype=np.float64)
+    for k in range(len(ATTRS)):
+        counts[k] = np.bincount(segment, weights=index["edge_counts"][k][edge_ids], minlength=num_segments)
+        expected[k] = np.bincount(segment, weights=index["edge_baselines"][k][edge_ids], minlength=num_segments)
+
+    segment_analyses = []
+    for s in range(num_segments):
+        if not (segment == s).any():
+            continue
+        crash_r, injury_r, fatality_r = (
+            counts[k, s] / expected[k, s] if expected[k, s] > 0 else counts[k, s]
+            for k in range(len(ATTRS))
+        )
+        mid_edge = edge_ids[np.flatnonzero(segment == s)[len(np.flatnonzero(segment == s)) // 2]]
+        segment_analyses.append(
+            {
+                "point_index": s,
+                "route_progress": round(float(progress[segment == s][-1]) * 100, 1),
+                "coordinates": {
+                    "lat": float(graph.node_lat[graph.edge_u[mid_edge]]),
+                    "lng": float(graph.node_lng[graph.edge_u[mid_edge]]),
+                },
+                "counts": {
+                    "total_crashes": int(counts[0, s]),
+                    "total_injuries": int(counts[1, s]),
+                    "total_fatalities": int(counts[2, s]),
+                },
+                "safety_score": score_function(crash_r, injury_r, fatality_r),
+            }
+        )
+
+    overall = sum(seg["safety_score"] for seg in segment_analyses) / len(segment_analyses)
+    return {
+        "overall_safety_score": round(overall, 1),
+        "dangerous_segments": [seg for seg in segment_analyses if seg["safety_score"] < 80],
+    }
+
+
+if __name__ == "__main__":
+    graph = street_graph.get_street_graph()
+    if graph is None:
+        print("No street graph found, build one with street_graph.py first")
+    else:
+        print("Building edge exposure index...")
+        crashes = fetch_crash_arrays()
+        index = build_edge_index(graph, crashes)
+        save_edge_index(index)
+        snapped = int(index["edge_counts"][0].sum())
+        print(f"✓ Snapped {snapped}/{len(crashes['lat'])} crashes onto {graph.num_edges} edges")
@@ -1,6 +1,77 @@
-import requests
+import math
+import threading
+import time
 from datetime import datetime, timedelta
 
+import httpx
+import numpy as np
+
+import cache
+import http_client
+import outbound
+import polyline_safety_analysis as psa
+from constants import APIConfig, ClosureConfig, SpatialKeyConfig
+
+CLOSURES_URL = "https://data.cityofnewyork.us/resource/i6b5-j7bu.json"
+
+# local meters around the middle of the city, shared by routes and closures
+ORIGIN_LAT = (float(SpatialKeyConfig.LAT_MIN) + float(SpatialKeyConfig.LAT_MAX)) / 2
+METERS_PER_DEG_LAT = 110540
+METERS_PER_DEG_LNG = 111320 * math.cos(math.radians(ORIGIN_LAT))
+
+_index = None
+_index_checked_at = None
+_index_lock = threading.Lock()
+
+
+@cache.cached("closures")
+def fetch_closures(days_back: int = 14):
+    """Raw closure records that started in the last days_back days, citywide"""
+    start_date_str = (datetime.now() - timedelta(days=days_back)).strftime('%Y-%m-%d')
+    params = {
+        "$limit": 5000,
+        "$where": f"work_start_date >= '{start_date_str}' AND the_geom IS NOT NULL",
+        "$order": "work_start_date DESC"
+    }
+    response = outbound.call(
+        "socrata",
+        lambda timeout: http_client.get(CLOSURES_URL, params=params, timeout=timeout),
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+@cache.cached("closures")
+def fetch_active_closures(as_of: str):
+    """Raw closure records in effect at as_of (a Socrata timestamp), citywide, however long ago they started"""
+    params = {
+        "$limit": int(APIConfig.REQUEST_LIMIT),
+        "$where": f"work_start_date <= '{as_of}' AND work_end_date >= '{as_of}' AND the_geom IS NOT NULL",
+        "$order": "work_start_date DESC",
+    }
+    response = outbound.call(
+        "socrata",
+        lambda timeout: http_client.get(CLOSURES_URL, params=params, timeout=timeout),
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+def closure_details(closure, location=None):
+    details = {
+        "work_start_date": closure.get("work_start_date"),
+        "work_end_date": closure.get("work_end_date"),
+        "street_name": closure.get("onstreetname"),
+        "from_street": closure.get("fromstreetname"),
+        "to_street": closure.get("tostreetname"),
+        "borough": closure.get("borough_code"),
+        "purpose": closure.get("purpose"),
+    }
+    if location is not None:
+        details["location"] = location
+    return details
+
+
 def get_street_closures(lat: float, lng: float, radius_km: float = 0.5, days_back: int = 14):
     """
     Get street closures near a location from NYC DOT data
@@ -15,28 +86,12 @@ def get_street_closures(lat: float, lng: float, radius_km: float = 0.5, days_bac
         dict with closure information
     """
     
-    url = "https://data.cityofnewyork.us/resource/i6b5-j7bu.json"
-    
-    # Calculate date range
-    end_date = datetime.now()
-    start_date = end_date - timedelta(days=days_back)
-    start_date_str = start_date.strftime('%Y-%m-%d')
-    
     # Calculate bounding box
     lat_buffer = radius_km / 111.0
     lng_buffer = radius_km / (111.0 * 0.8)
     
-    # Get recent closures
-    params = {
-        "$limit": 5000,
-        "$where": f"work_start_date >= '{start_date_str}' AND the_geom IS NOT NULL",
-        "$order": "work_start_date DESC"
-    }
-    
     try:
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        closures = response.json()
+        closures = fetch_closures(days_back)
         
         print(f"   Fetched {len(closures)} total closures from API")
         
@@ -69,19 +124,9 @@ def get_street_closures(lat: float, lng: float, radius_km: float = 0.5, days_bac
                         break
                 
                 if is_nearby:
-                    nearby_closures.append({
-                        "work_start_date": closure.get("work_start_date"),
-                        "work_end_date": closure.get("work_end_date"),
-                        "street_name": closure.get("onstreetname"),
-                        "from_street": closure.get("fromstreetname"),
-                        "to_street": closure.get("tostreetname"),
-                        "borough": closure.get("borough_code"),
-                        "purpose": closure.get("purpose"),
-                        "location": {
-                            "lat": rep_lat,
-                            "lng": rep_lng
-                        }
-                    })
+                    nearby_closures.append(
+                        closure_details(closure, location={"lat": rep_lat, "lng": rep_lng})
+                    )
                     
             except (ValueError, TypeError, KeyError, IndexError) as e:
                 continue
@@ -96,12 +141,203 @@ def get_street_closures(lat: float, lng: float, radius_km: float = 0.5, days_bac
             "closures": nearby_closures
         }
         
-    except requests.exceptions.RequestException as e:
+    except (httpx.HTTPError, outbound.RateLimitedError, outbound.CircuitOpenError) as e:
         return {"error": f"Street closure API request failed: {str(e)}"}
     except Exception as e:
         return {"error": f"Unexpected error: {str(e)}"}
 
 
+def to_meters(lat, lng):
+    """(n, 2) local x/y meters for lat/lng arrays"""
+    return np.column_stack((np.asarray(lng) * METERS_PER_DEG_LNG, np.asarray(lat) * METERS_PER_DEG_LAT))
+
+
+def _point_segment_distances(p, s0, s1):
+    v = s1 - s0
+    length_sq = np.maximum((v * v).sum(axis=-1), 1e-12)
+    t = np.clip(((p - s0) * v).sum(axis=-1) / length_sq, 0, 1)
+    return np.linalg.norm(p - (s0 + t[..., None] * v), axis=-1)
+
+
+def _cross(o, a, b):
+    return (a[..., 0] - o[..., 0]) * (b[..., 1] - o[..., 1]) - (a[..., 1] - o[..., 1]) * (b[..., 0] - o[..., 0])
+
+
+def segment_distances(a0, a1, b0, b1):
+    """
+    Minimum distance between every pair of 2D segments, vectorized
+
+    Args:
+        a0, a1: (M, 2) start and end points of the first set
+        b0, b1: (K, 2) start and end points of the second set
+
+    Returns:
+        (M, K) distances, 0 where segments cross
+    """
+    a0, a1 = a0[:, None, :], a1[:, None, :]
+    b0, b1 = b0[None, :, :], b1[None, :, :]
+    distances = np.minimum.reduce(
+        [
+            _point_segment_distances(a0, b0, b1),
+            _point_segment_distances(a1, b0, b1),
+            _point_segment_distances(b0, a0, a1),
+            _point_segment_distances(b1, a0, a1),
+        ]
+    )
+    crosses = (_cross(a0, a1, b0) * _cross(a0, a1, b1) < 0) & (_cross(b0, b1, a0) * _cross(b0, b1, a1) < 0)
+    return np.where(crosses, 0.0, distances)
+
+
+class ClosureIndex:
+    """
+    Closure MultiLineStrings flattened into segment arrays in local meters
+
+    Each segment keeps its closure's position in `closures` and a bounding box,
+    so a route chunk only measures against the segments its own box reaches.
+    """
+
+    def __init__(self, closures):
+        starts, ends, owners = [], [], []
+        self.closures = []
+        for closure in closures:
+            try:
+                lines = (closure.get("the_geom") or {}).get("coordinates") or []
+                segments = [
+                    np.asarray(line, dtype=np.float64)[:, :2] for line in lines if len(line) >= 2
+                ]
+            except (ValueError, TypeError):
+                continue
+            if not segments:
+                continue
+            for coords in segments:
+                points = to_meters(coords[:, 1], coords[:, 0])
+                starts.append(points[:-1])
+                ends.append(points[1:])
+                owners.append(np.full(len(points) - 1, len(self.closures)))
+            self.closures.append(closure_details(closure))
+
+        self.starts = np.vstack(starts) if starts else np.empty((0, 2))
+        self.ends = np.vstack(ends) if ends else np.empty((0, 2))
+        self.owners = np.concatenate(owners) if owners else np.empty(0, dtype=np.int64)
+        self.lo = np.minimum(self.starts, self.ends)
+        self.hi = np.maximum(self.starts, self.ends)
+
+    def __len__(self):
+        return len(self.closures)
+
+    def candidates(self, lo, hi, tolerance_m):
+        """Indices of segments whose box comes within tolerance_m of the box lo..hi"""
+        mask = ((self.hi >= lo - tolerance_m) & (self.lo <= hi + tolerance_m)).all(axis=1)
+        return np.flatnonzero(mask)
+
+    def nearest_closures(self, starts, ends, tolerance_m):
+        """Closure position nearest each route segment within tolerance_m, -1 where there is none"""
+        nearest = np.full(len(starts), -1, dtype=np.int64)
+        chunk = int(ClosureConfig.CHUNK_SEGMENTS)
+        for i in range(0, len(starts), chunk):
+            a0, a1 = starts[i:i + chunk], ends[i:i + chunk]
+            idx = self.candidates(np.minimum(a0, a1).min(axis=0), np.maximum(a0, a1).max(axis=0), tolerance_m)
+            if not len(idx):
+                continue
+            distances = segment_distances(a0, a1, self.starts[idx], self.ends[idx])
+            best = distances.argmin(axis=1)
+            within = distances[np.arange(len(a0)), best] <= tolerance_m
+            nearest[i:i + chunk][within] = self.owners[idx[best[within]]]
+        return nearest
+
+
+def densify(points, spacing_m):
+    """Polyline with extra vertices so no segment is longer than spacing_m"""
+    lengths = np.linalg.norm(np.diff(points, axis=0), axis=1)
+    pieces = np.maximum(np.ceil(lengths / spacing_m).astype(np.int64), 1)
+    segment = np.repeat(np.arange(len(lengths)), pieces)
+    # position of each new vertex within its segment: 0, 1/n, ..., (n-1)/n
+    fraction = (np.arange(pieces.sum()) - np.repeat(np.cumsum(pieces) - pieces, pieces)) / pieces[segment]
+    start = points[segment]
+    return np.vstack((start + fraction[:, None] * (points[segment + 1] - start), points[-1:]))
+
+
+def route_closures(encoded_polyline, index, tolerance_m=None, min_overlap_m=None):
+    """
+    Stretches of a route that run along a closed street
+
+    Args:
+        encoded_polyline: Google encoded route polyline
+        index: ClosureIndex to check against
+        tolerance_m: How close to a closure's centerline counts as on it
+        min_overlap_m: Shorter matches are treated as crossing the street and dropped
+
+    Returns:
+        List of closed stretches in route order, with the closure and how far
+        along the route (km and fraction) each one starts and ends
+    """
+    if tolerance_m is None:
+        tolerance_m = float(ClosureConfig.TOLERANCE_M)
+    if min_overlap_m is None:
+        min_overlap_m = float(ClosureConfig.MIN_OVERLAP_M)
+    try:
+        coords = psa.decode_polyline_array(encoded_polyline)
+    except ValueError:
+        return []
+    if len(coords) < 2 or not len(index):
+        return []
+
+    # split long segments so a match is measured by the distance actually spent
+    # near the closure, not by whichever long segment happened to touch it
+    points = densify(to_meters(coords[:, 0], coords[:, 1]), tolerance_m)
+    nearest = index.nearest_closures(points[:-1], points[1:], tolerance_m)
+    if (nearest < 0).all():
+        return []
+
+    progress_m = np.concatenate(([0.0], np.cumsum(np.linalg.norm(np.diff(points, axis=0), axis=1))))
+    total_m = max(progress_m[-1], 1e-9)
+
+    # runs of consecutive route segments on the same closure
+    boundaries = np.flatnonzero(np.diff(nearest)) + 1
+    stretches = []
+    for start, end in zip(np.concatenate(([0], boundaries)), np.concatenate((boundaries, [len(nearest)]))):
+        closure = nearest[start]
+        length_m = progress_m[end] - progress_m[start]
+        if closure < 0 or length_m < min_overlap_m:
+            continue
+        stretches.append(
+            {
+                **index.closures[closure],
+                "start_km": round(float(progress_m[start]) / 1000, 3),
+                "end_km": round(float(progress_m[end]) / 1000, 3),
+                "start_fraction": round(float(progress_m[start] / total_m), 3),
+                "end_fraction": round(float(progress_m[end] / total_m), 3),
+                "length_m": round(float(length_m), 1),
+            }
+        )
+    return stretches
+
+
+def get_closure_index(refresh=True):
+    """
+    Shared closure index, rebuilt every ClosureConfig.REFRESH_S seconds
+
+    With refresh=False a stale (or missing) index is returned as is rather
+    than fetching closures on the caller's time. None if closures can't be had.
+    """
+    global _index, _index_checked_at
+    stale = _index_checked_at is None or time.monotonic() - _index_checked_at > float(ClosureConfig.REFRESH_S)
+    if not (stale and refresh):
+        return _index
+    with _index_lock:
+        if _index_checked_at is None or time.monotonic() - _index_checked_at > float(ClosureConfig.REFRESH_S):
+            # a failed fetch also waits out REFRESH_S, so an outage isn't retried per request
+            _index_checked_at = time.monotonic()
+            try:
+                # to the hour, so workers share the cached fetch
+                as_of = datetime.now().strftime("%Y-%m-%dT%H:00:00")
+                _index = ClosureIndex(fetch_active_closures(as_of))
+                print(f"Indexed {len(_index)} street closures ({len(_index.starts)} segments)")
+            except (httpx.HTTPError, outbound.RateLimitedError, outbound.CircuitOpenError) as e:
+                print(f"Street closures unavailable: {e}")
+    return _index
+
+
 def assess_closure_impact(closures_data: dict) -> dict:
     """
     Assess how street closures might impact running route
@@ -1,10 +1,17 @@
 import math
-import requests
 import os
 from dotenv import load_dotenv
-import constants as const
 import utils
-from constants import Direction, CompassBearing, MapsApi
+import street_graph
+import land_mask
+import outbound
+import http_client
+import route_similarity
+import cache
+import cities
+import get_closures
+from deadline import has_time
+from constants import Direction, CompassBearing, MapsApi, StreetGraphConfig, DeadlineConfig
 
 load_dotenv()
 
@@ -58,8 +65,9 @@ def generate_optimized_endpoints(
     return endpoints
 
 
-def test_google_routes_distance(start_lat, start_lng, end_lat, end_lng, mapi=MapsApi):
-    """Test actual walking distance using Google Routes API"""
+@cache.cached("route")
+def test_google_routes_distance(start_lat, start_lng, end_lat, end_lng, mapi=MapsApi, deadline=None):
+    """Test actual walking distance using Google Routes API, within the deadline if given"""
 
     api_key = os.getenv("GOOGLE_ROUTES_API_KEY")
     url = mapi.COMPUTE_ROUTES.value
@@ -81,7 +89,12 @@ def test_google_routes_distance(start_lat, start_lng, end_lat, end_lng, mapi=Map
     }
 
     try:
-        response = requests.post(url, json=data, headers=headers)
+        response = outbound.call(
+            "google_routes",
+            lambda timeout: http_client.post(url, json=data, headers=headers, timeout=timeout),
+            hedge=True,
+            deadline=deadline,
+        )
         response.raise_for_status()
         result = response.json()
 
@@ -103,23 +116,51 @@ def test_google_routes_distance(start_lat, start_lng, end_lat, end_lng, mapi=Map
     return {"error": "No routes found", "success": False}
 
 
+def get_local_street_graph():
+    """Street graph when the local routing backend is selected and available"""
+    if os.getenv("ROUTING_BACKEND", StreetGraphConfig.BACKEND.value) != "local":
+        return None
+    return street_graph.get_street_graph()
+
+
+def compute_walking_route(start_lat, start_lng, end_lat, end_lng, deadline=None):
+    """One-way walking route from the configured backend, Google unless local is selected"""
+    graph = get_local_street_graph()
+    if graph is not None and cities.city_at(start_lat, start_lng).is_default:
+        return graph.compute_route(start_lat, start_lng, end_lat, end_lng)
+    return test_google_routes_distance(start_lat, start_lng, end_lat, end_lng, deadline=deadline)
+
+
 def calculate_and_test_endpoints(
-    start_lat, start_lng, target_distance, all_routes=[], optimal_multiplier=0.4
+    start_lat, start_lng, target_distance, all_routes=None, optimal_multiplier=0.4,
+    deadline=None, closure_index=None,
 ):
+    if all_routes is None:
+        all_routes = []  # fresh list per search, a shared default leaks routes across calls
     one_way_distance = target_distance * optimal_multiplier
     print(f"One-way distance entering endpoint generation: {one_way_distance:.2f}km")
 
     # generating optimized endpoints based on multiplier
     endpoints = generate_optimized_endpoints(start_lat, start_lng, one_way_distance)
-    endpoints = reverse_geocode_and_filter(endpoints)
+    # the land mask and street graph only cover the default city
+    city = cities.city_at(start_lat, start_lng)
+    if city.is_default and land_mask.get_land_mask() is not None:
+        # local land/water check replaces the per-endpoint geocoding calls
+        endpoints = land_mask.filter_endpoints(endpoints, start_lat, start_lng)
+    elif not city.is_default or get_local_street_graph() is None:
+        # the local graph rejects off-network endpoints itself, no geocoding needed
+        endpoints = reverse_geocode_and_filter(endpoints, water_keywords=city.water_keywords)
 
     phase1_routes = []
 
     for i, endpoint in enumerate(endpoints):
+        if not has_time(deadline, float(DeadlineConfig.ROUTE_CALL_S)):
+            deadline.degrade("partial_route_search")
+            break
         print(f"   Testing {endpoint['direction']} route...")
 
-        google_result = test_google_routes_distance(
-            start_lat, start_lng, endpoint["lat"], endpoint["lng"]
+        google_result = compute_walking_route(
+            start_lat, start_lng, endpoint["lat"], endpoint["lng"], deadline=deadline
         )
 
         if google_result["success"]:
@@ -139,6 +180,12 @@ def calculate_and_test_endpoints(
                 "endpoint": {"lat": endpoint["lat"], "lng": endpoint["lng"]},
                 "polyline": google_result.get("polyline", ""),
             }
+            if "edge_ids" in google_result:
+                route_info["edge_ids"] = google_result["edge_ids"]
+            if closure_index is not None:
+                route_info["closed_stretches"] = get_closures.route_closures(
+                    route_info["polyline"], closure_index
+                )
             phase1_routes.append(route_info)
             all_routes.append(route_info)
         else:
@@ -147,10 +194,70 @@ def calculate_and_test_endpoints(
     return phase1_routes, all_routes
 
 
-def optimized_route_finder(start_lat, start_lng, target_distance):
+def calculate_and_test_loops(start_lat, start_lng, target_distance, graph, all_routes, deadline=None, closure_index=None):
+    """
+    Loop candidates from the local street graph, one per compass direction
+
+    A loop's whole length is walked once, so it is scored against the target
+    directly instead of doubled like an out-and-back.
+    """
+    loop_routes = []
+    for direction in Direction:
+        if not has_time(deadline, float(DeadlineConfig.ROUTE_CALL_S)):
+            deadline.degrade("partial_route_search")
+            break
+        result = graph.loop_route(start_lat, start_lng, target_distance, bearing=CompassBearing[direction.name].value)
+        if not result["success"]:
+            continue
+
+        total_distance = result["distance_km"]
+        accuracy = 100 * (1 - abs(total_distance - target_distance) / target_distance)
+        # the loop's far point, halfway between the waypoints it turns at
+        far_lat = sum(w["lat"] for w in result["waypoints"]) / len(result["waypoints"])
+        far_lng = sum(w["lng"] for w in result["waypoints"]) / len(result["waypoints"])
+        route_info = {
+            "id": len(all_routes) + 1,
+            "direction": f"{direction.value} loop",
+            "accuracy": accuracy,
+            "distance": {
+                "target_distance": target_distance,
+                "total_distance": total_distance,
+            },
+            "endpoint": {"lat": far_lat, "lng": far_lng},
+            "polyline": result["polyline"],
+            "edge_ids": result["edge_ids"],
+            "loop": True,
+        }
+        if closure_index is not None:
+            route_info["closed_stretches"] = get_closures.route_closures(route_info["polyline"], closure_index)
+        loop_routes.append(route_info)
+        all_routes.append(route_info)
+    return loop_routes, all_routes
+
+
+def _rank_key(route):
+    # routes that don't run along a closed street first, then by accuracy
+    return (not route.get("closed_stretches"), route["accuracy"])
+
+
+def optimized_route_finder(start_lat, start_lng, target_distance, deadline=None):
+    # only (re)fetch closures when the budget allows it, a stale index is fine otherwise
+    closure_index = get_closures.get_closure_index(
+        refresh=has_time(deadline, float(DeadlineConfig.ROUTE_CALL_S))
+    )
+    if closure_index is None and deadline is not None:
+        deadline.degrade("skipped_closure_check")
+
     phase1_routes, all_routes = calculate_and_test_endpoints(
-        start_lat, start_lng, target_distance
+        start_lat, start_lng, target_distance, deadline=deadline, closure_index=closure_index
     )
+    # the local street graph can also route loops of the target length, Google only out-and-backs
+    graph = get_local_street_graph()
+    if graph is not None and cities.city_at(start_lat, start_lng).is_default:
+        loop_routes, all_routes = calculate_and_test_loops(
+            start_lat, start_lng, target_distance, graph, all_routes, deadline=deadline, closure_index=closure_index
+        )
+        phase1_routes = phase1_routes + loop_routes
 
     excellent_phase1 = [r for r in phase1_routes if r["accuracy"] >= 95]
     good_phase1 = [r for r in phase1_routes if r["accuracy"] >= 90]
@@ -164,11 +271,16 @@ def optimized_route_finder(start_lat, start_lng, target_distance):
     if len(excellent_phase1) >= 3:
         print("✅ SUCCESS: Found 3+ excellent routes in Phase 1! Stopping here.")
         final_routes = sorted(
-            excellent_phase1, key=lambda x: x["accuracy"], reverse=True
+            excellent_phase1, key=_rank_key, reverse=True
         )
     elif len(good_phase1) >= 3:
         print("✅ SUCCESS: Found 3+ good routes in Phase 1! Stopping here.")
-        final_routes = sorted(good_phase1, key=lambda x: x["accuracy"], reverse=True)
+        final_routes = sorted(good_phase1, key=_rank_key, reverse=True)
+    elif not has_time(deadline, float(DeadlineConfig.PHASE2_MIN_S)):
+        # no budget for another 16 route calls, make do with what Phase 1 found
+        deadline.degrade("skipped_phase2")
+        decent_routes = [r for r in all_routes if r["accuracy"] >= 80]
+        final_routes = sorted(decent_routes, key=_rank_key, reverse=True)
     else:
         print("🔍 PHASE 2: Testing backup multipliers for better coverage")
         print("=" * 50)
@@ -182,12 +294,17 @@ def optimized_route_finder(start_lat, start_lng, target_distance):
                 target_distance,
                 all_routes=all_routes,
                 optimal_multiplier=multiplier,
+                deadline=deadline,
+                closure_index=closure_index,
             )
             print()
 
         # Select final routes from all phases
         decent_routes = [r for r in all_routes if r["accuracy"] >= 80]
-        final_routes = sorted(decent_routes, key=lambda x: x["accuracy"], reverse=True)
+        final_routes = sorted(decent_routes, key=_rank_key, reverse=True)
+
+    # neighbouring directions often share most of their path, keep the best of each
+    final_routes = route_similarity.prune_near_duplicates(final_routes)
 
     print(f"🏆 FINAL TOP 3 ROUTES:")
     print("=" * 60)
@@ -195,6 +312,11 @@ def optimized_route_finder(start_lat, start_lng, target_distance):
     for i, route in enumerate(final_routes, 1):
         print(f"{i}. {route['direction']}")
         print(f"   🎯 Accuracy: {route['accuracy']:.1f}%")
+        for stretch in route.get("closed_stretches", []):
+            print(
+                f"   🚧 Closed: {stretch['street_name']} "
+                f"({stretch['start_km']:.2f}-{stretch['end_km']:.2f}km, {stretch['purpose']})"
+            )
         print(
             f"   📍 Endpoint: ({route['endpoint']['lat']:.4f}, {route['endpoint']['lng']:.4f})"
         )
@@ -202,18 +324,34 @@ def optimized_route_finder(start_lat, start_lng, target_distance):
     return final_routes
 
 
-def reverse_geocode_and_filter(endpoints, water_keywords=const.ignore, mapi=MapsApi):
+@cache.cached("geocode")
+def reverse_geocode(lat, lng):
+    """Formatted address for a coordinate via Google geocoding (None if there is none)"""
+    params = {"latlng": f"{lat},{lng}", "key": os.getenv("GOOGLE_ROUTES_API_KEY")}
+    response = outbound.call(
+        "google_geocoding",
+        lambda timeout: http_client.get(MapsApi.GEOCODING.value, params=params, timeout=timeout),
+    )
+    response.raise_for_status()
+    result = response.json()
+
+    if result["status"] == "OK" and result["results"]:
+        return {"address": result["results"][0]["formatted_address"]}
+    return {"address": None}
+
+
+def reverse_geocode_and_filter(endpoints, water_keywords):
     """
     Reverse geocode endpoints and filter out water/invalid locations
 
     Args:
         endpoints: List of endpoint dicts with 'lat', 'lng', 'direction' keys
+        water_keywords: address substrings that mark an endpoint as water/invalid
 
     Returns:
         List of valid endpoints with added 'address' field
     """
 
-    api_key = os.getenv("GOOGLE_ROUTES_API_KEY")
     valid_endpoints = []
 
     print(
@@ -225,17 +363,10 @@ def reverse_geocode_and_filter(endpoints, water_keywords=const.ignore, mapi=Maps
         lng = endpoint["lng"]
         direction = endpoint["direction"]
 
-        # google geocoding API call
-        geocoding_url = mapi.GEOCODING.value
-        params = {"latlng": f"{lat},{lng}", "key": api_key}
-
         try:
-            response = requests.get(geocoding_url, params=params, timeout=10)
-            response.raise_for_status()
-            result = response.json()
+            address = reverse_geocode(lat, lng)["address"]
 
-            if result["status"] == "OK" and result["results"]:
-                address = result["results"][0]["formatted_address"]
+            if address:
                 is_water = any(keyword in address for keyword in water_keywords)
 
                 if is_water:
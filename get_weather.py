@@ -1,9 +1,25 @@
+import math
 import os
-import requests
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+import httpx
+import numpy as np
 from dotenv import load_dotenv
+import outbound
+import http_client
+import cache
+from constants import ForecastConfig
 
 load_dotenv()
 
+FORECAST_URL = "https://api.openweathermap.org/data/2.5/forecast"
+
+# a fixed pool of locks shared out by geotile, so concurrent requests in a tile
+# wait for a single fetch without a lock being kept for every tile ever seen
+_forecast_locks = [threading.Lock() for _ in range(64)]
+
+@cache.cached("weather")
 def get_weather_conditions(lat: float, lng: float):
     """
     Get current weather conditions from OpenWeatherMap API
@@ -28,7 +44,10 @@ def get_weather_conditions(lat: float, lng: float):
     }
     
     try:
-        response = requests.get(url, params=params, timeout=10)
+        response = outbound.call(
+            "openweather",
+            lambda timeout: http_client.get(url, params=params, timeout=timeout),
+        )
         response.raise_for_status()
         data = response.json()
         
@@ -57,7 +76,7 @@ def get_weather_conditions(lat: float, lng: float):
         
         return weather_info
         
-    except requests.exceptions.RequestException as e:
+    except (httpx.HTTPError, outbound.RateLimitedError, outbound.CircuitOpenError) as e:
         return {"error": f"Weather API request failed: {str(e)}"}
     except KeyError as e:
         return {"error": f"Unexpected weather API response format: {str(e)}"}
@@ -125,6 +144,185 @@ def assess_weather_risk(weather_data: dict) -> dict:
     }
 
 
+def forecast_tile(lat: float, lng: float, tile_deg=None):
+    """Center of the geotile a point falls in; forecasts are fetched per tile"""
+    tile_deg = tile_deg or float(ForecastConfig.TILE_DEG)
+    return (
+        round((math.floor(lat / tile_deg) + 0.5) * tile_deg, 6),
+        round((math.floor(lng / tile_deg) + 0.5) * tile_deg, 6),
+    )
+
+
+@cache.cached("forecast")
+def fetch_forecast(tile_lat: float, tile_lng: float):
+    """
+    5-day forecast for a geotile center from OpenWeatherMap, as column lists
+
+    The 2.5 forecast comes in 3-hour steps; precipitation is converted to the
+    per-hour rates assess_weather_risk expects.
+    """
+    api_key = os.getenv("OPENWEATHER_API_KEY")
+
+    if not api_key:
+        return {"error": "OPENWEATHER_API_KEY not found in .env"}
+
+    params = {
+        "lat": tile_lat,
+        "lon": tile_lng,
+        "appid": api_key,
+        "units": "imperial"  # Fahrenheit
+    }
+
+    try:
+        response = outbound.call(
+            "openweather",
+            lambda timeout: http_client.get(FORECAST_URL, params=params, timeout=timeout),
+        )
+        response.raise_for_status()
+        data = response.json()
+
+        steps = data["list"]
+        return {
+            "tile": {"lat": tile_lat, "lng": tile_lng},
+            "timezone_offset_s": data["city"].get("timezone", 0),
+            "fetched_at": time.time(),
+            "times": [step["dt"] for step in steps],
+            "temperature_f": [step["main"]["temp"] for step in steps],
+            "visibility_meters": [step.get("visibility", 10000) for step in steps],
+            "rain_mm_1h": [step.get("rain", {}).get("3h", 0) / 3 for step in steps],
+            "snow_mm_1h": [step.get("snow", {}).get("3h", 0) / 3 for step in steps],
+            "description": [step["weather"][0]["description"] for step in steps],
+        }
+
+    except (httpx.HTTPError, outbound.RateLimitedError, outbound.CircuitOpenError) as e:
+        return {"error": f"Weather API request failed: {str(e)}"}
+    except (KeyError, IndexError) as e:
+        return {"error": f"Unexpected weather API response format: {str(e)}"}
+
+
+def get_forecast(lat: float, lng: float):
+    """Forecast for the geotile around a point, shared by every caller in the tile"""
+    tile = forecast_tile(lat, lng)
+    with _forecast_locks[hash(tile) % len(_forecast_locks)]:
+        return fetch_forecast(*tile)
+
+
+def hourly_forecast(forecast: dict, hours: int, now=None):
+    """
+    The forecast on whole hours from now, each hour taking the nearest forecast step
+
+    Returns:
+        dict of arrays (times, temperature_f, ...), hours past the forecast dropped
+    """
+    times = np.asarray(forecast["times"], dtype=np.int64)
+    now = time.time() if now is None else now
+    slots = (int(now) // 3600 + np.arange(hours)) * 3600
+    slots = slots[slots <= times[-1] + 3 * 3600]
+
+    # nearest step: the one before or after each slot, whichever is closer
+    after = np.clip(np.searchsorted(times, slots), 0, len(times) - 1)
+    before = np.clip(after - 1, 0, len(times) - 1)
+    nearest = np.where(np.abs(times[before] - slots) <= np.abs(times[after] - slots), before, after)
+
+    hourly = {"times": slots}
+    for field in ("temperature_f", "visibility_meters", "rain_mm_1h", "snow_mm_1h", "description"):
+        hourly[field] = np.asarray(forecast[field])[nearest]
+    return hourly
+
+
+def weather_risk_scores(temperature_f, visibility_meters, rain_mm_1h, snow_mm_1h):
+    """assess_weather_risk's risk_score over NumPy arrays of hours"""
+    visibility = np.select([visibility_meters < 1000, visibility_meters < 3000], [3, 1], 0)
+    rain = np.select([rain_mm_1h > 5, rain_mm_1h > 0], [2, 1], 0)
+    snow = np.where(snow_mm_1h > 0, 2, 0)
+    temperature = np.where((temperature_f < 20) | (temperature_f > 95), 1, 0)
+    return visibility + rain + snow + temperature
+
+
+def risk_levels(risk_scores):
+    """assess_weather_risk's risk_level for an array of scores"""
+    return np.select([risk_scores == 0, risk_scores <= 2], ["low", "moderate"], "high")
+
+
+def best_run_windows(lat: float, lng: float, duration_h: int = 1, hours=None, hour_risk=None, top_n=None, now=None):
+    """
+    Best times to run over the coming hours, lowest risk first
+
+    Args:
+        lat, lng: Where the run starts
+        duration_h: Length of each window in hours
+        hours: How far ahead to search (default ForecastConfig.HOURS)
+        hour_risk: Optional 24 values in [0, 1], relative crash risk by local
+            hour of day; adds up to ForecastConfig.CRASH_RISK_WEIGHT points
+        top_n: Number of non-overlapping windows to return
+
+    Returns:
+        dict with ranked windows and the hourly risk they were picked from
+    """
+    hours = int(ForecastConfig.HOURS) if hours is None else hours
+    top_n = top_n or int(ForecastConfig.WINDOWS)
+    if duration_h < 1 or hours < 1:
+        return {"error": "duration_h and hours must be at least 1"}
+
+    forecast = get_forecast(lat, lng)
+    if "error" in forecast:
+        return forecast
+
+    hourly = hourly_forecast(forecast, hours, now=now)
+    if len(hourly["times"]) < duration_h:
+        return {"error": "Forecast does not cover the requested hours"}
+
+    weather_risk = weather_risk_scores(
+        hourly["temperature_f"], hourly["visibility_meters"], hourly["rain_mm_1h"], hourly["snow_mm_1h"]
+    )
+    local_hours = (hourly["times"] + forecast["timezone_offset_s"]) // 3600 % 24
+    if hour_risk is not None:
+        crash_risk = np.asarray(hour_risk, dtype=np.float64)[local_hours] * float(ForecastConfig.CRASH_RISK_WEIGHT)
+    else:
+        crash_risk = np.zeros(len(weather_risk))
+
+    # a window is as risky as its worst hour for weather, and its average hour for crashes
+    windows = np.lib.stride_tricks.sliding_window_view
+    window_weather = windows(weather_risk, duration_h).max(axis=1)
+    window_crash = windows(crash_risk, duration_h).mean(axis=1)
+    scores = window_weather + window_crash
+
+    tz = timezone(timedelta(seconds=forecast["timezone_offset_s"]))
+    ranked = []
+    for start in np.lexsort((np.arange(len(scores)), scores)):
+        if any(abs(start - other) < duration_h for other in ranked):
+            continue
+        ranked.append(int(start))
+        if len(ranked) == top_n:
+            break
+
+    return {
+        "tile": forecast["tile"],
+        "forecast_age_s": round(time.time() - forecast["fetched_at"]),
+        "duration_h": duration_h,
+        "windows": [
+            {
+                "start": datetime.fromtimestamp(int(hourly["times"][i]), tz).isoformat(),
+                "end": datetime.fromtimestamp(int(hourly["times"][i]) + duration_h * 3600, tz).isoformat(),
+                "score": round(float(scores[i]), 2),
+                "risk_level": str(risk_levels(window_weather[i])),
+                "weather_risk": int(window_weather[i]),
+                "crash_risk": round(float(window_crash[i]), 2),
+                "weather_summary": f"{hourly['description'][i]}, {hourly['temperature_f'][i]:.0f}°F",
+            }
+            for i in ranked
+        ],
+        "hourly": [
+            {
+                "time": datetime.fromtimestamp(int(t), tz).isoformat(),
+                "weather_risk": int(w),
+                "crash_risk": round(float(c), 2),
+            }
+            for t, w, c in zip(hourly["times"], weather_risk, crash_risk)
+        ],
+    }
+
+
 if __name__ == "__main__":
     # Test the weather functions
     print("Testing weather functions...")
@@ -142,4 +340,9 @@ if __name__ == "__main__":
     
     print("\nRisk Assessment:")
     risk = assess_weather_risk(weather)
-    print(risk)
\ No newline at end of file
+    print(risk)
+
+    print("\nBest times to run:")
+    best = best_run_windows(test_lat, test_lng)
+    for window in best.get("windows", []):
+        print(f"   {window['start']}: {window['risk_level']} ({window['weather_summary']})")
@@ -0,0 +1,264 @@
+import argparse
+import io
+import math
+import os
+import threading
+
+import numpy as np
+import xxhash
+from matplotlib import colormaps
+from matplotlib import image as mpimg
+from scipy import ndimage
+from scipy.signal import fftconvolve
+
+import cache
+import edge_exposure
+import safety_engine
+from constants import SpatialKeyConfig, TileConfig, cache_ttls
+
+# bump when the rendering changes so cached tiles are re-rendered
+RENDER_VERSION = 1
+TILE_SIZE = 256
+LAYERS = ("density", "safety")
+
+# same 5x5 neighbourhood get_area_crash_percentiles draws its p50 baselines from
+BASELINE_OFFSETS = np.array(safety_engine.BASELINE_OFFSETS)
+BASELINE_STRIDE = 4  # baselines change slowly, compute them on every 4th cell
+
+_surface = None
+_surface_lock = threading.Lock()
+
+
+class RiskSurface:
+    """
+    City-wide crash totals and safety scores on a regular lat/lng grid
+
+    Every cell holds what get_crashes_near_me and safety_wrapper would report
+    for a point there: crashes, injuries and fatalities within radius_km, and
+    p50 baselines over the same 5x5 neighbourhood of boxes. Tiles only sample
+    these arrays, so serving them never touches the database.
+    """
+
+    def __init__(self, crashes, radius_km=None, cell_m=None, bounds=None):
+        self.radius_km = radius_km or float(TileConfig.RADIUS_KM)
+        cell_km = (cell_m or float(TileConfig.CELL_M)) / 1000
+        self.lat_min, self.lat_max, self.lng_min, self.lng_max = bounds or (
+            float(SpatialKeyConfig.LAT_MIN),
+            float(SpatialKeyConfig.LAT_MAX),
+            float(SpatialKeyConfig.LNG_MIN),
+            float(SpatialKeyConfig.LNG_MAX),
+        )
+        # square cells in km, with the 111 km/degree the crash queries use
+        lat0 = (self.lat_min + self.lat_max) / 2
+        self.dlat = cell_km / 111.0
+        self.dlng = cell_km / (111.0 * math.cos(math.radians(lat0)))
+        shape = (
+            int(math.ceil((self.lat_max - self.lat_min) / self.dlat)),
+            int(math.ceil((self.lng_max - self.lng_min) / self.dlng)),
+        )
+
+        rows = np.floor((crashes["lat"] - self.lat_min) / self.dlat).astype(np.int64)
+        cols = np.floor((crashes["lng"] - self.lng_min) / self.dlng).astype(np.int64)
+        inside = (rows >= 0) & (rows < shape[0]) & (cols >= 0) & (cols < shape[1])
+        weights = [np.ones(len(rows)), crashes["injuries"], crashes["fatalities"]]
+        grids = [
+            np.bincount(rows[inside] * shape[1] + cols[inside], weights=w[inside], minlength=shape[0] * shape[1])
+            .reshape(shape)
+            .astype(np.float64)
+            for w in weights
+        ]
+
+        # totals within radius_km: convolve with a disk
+        r = self.radius_km / cell_km
+        span = np.arange(-int(r), int(r) + 1)
+        disk = (span[:, None] ** 2 + span[None, :] ** 2 <= r * r).astype(np.float64)
+        self.near = np.stack([np.rint(np.maximum(fftconvolve(g, disk, mode="same"), 0)) for g in grids])
+        self.baselines = np.stack([self._baseline_grid(g, cell_km) for g in grids])
+
+        self.version = xxhash.xxh3_64_hexdigest(
+            b"".join(np.ascontiguousarray(a).tobytes() for a in (self.near, self.baselines))
+        )
+
+    def _baseline_grid(self, grid, cell_km):
+        """p50 of the 25 neighbourhood box counts, on every BASELINE_STRIDE-th cell"""
+        table = np.zeros((grid.shape[0] + 1, grid.shape[1] + 1))
+        table[1:, 1:] = grid.cumsum(0).cumsum(1)
+        h, w = grid.shape
+
+        half = self.radius_km / cell_km  # box half-size in cells, both directions
+        centers_r = np.arange(0, h, BASELINE_STRIDE)
+        centers_c = np.arange(0, w, BASELINE_STRIDE)
+        counts = []
+        for lat_offset in BASELINE_OFFSETS:
+            for lng_offset in BASELINE_OFFSETS:
+                # box edges in cell units, rounded to the nearest cell boundary
+                r = centers_r[:, None] + 0.5 + lat_offset / self.dlat
+                c = centers_c[None, :] + 0.5 + lng_offset / self.dlng
+                r_lo = np.clip(np.rint(r - half), 0, h).astype(np.int64)
+                r_hi = np.clip(np.rint(r + half), 0, h).astype(np.int64)
+                c_lo = np.clip(np.rint(c - half), 0, w).astype(np.int64)
+                c_hi = np.clip(np.rint(c + half), 0, w).astype(np.int64)
+                counts.append(table[r_hi, c_hi] - table[r_lo, c_hi] - table[r_hi, c_lo] + table[r_lo, c_lo])
+        # same pick as get_area_crash_percentiles: sorted[int(0.5 * 25)]
+        return np.sort(np.stack(counts), axis=0)[len(counts) // 2]
+
+    def sample(self, lat, lng):
+        """(near, baselines) arrays at the given points; NaN outside the city"""
+        rows = (lat - self.lat_min) / self.dlat - 0.5
+        cols = (lng - self.lng_min) / self.dlng - 0.5
+        near = np.stack(
+            [ndimage.map_coordinates(g, [rows, cols], order=1, cval=np.nan) for g in self.near]
+        )
+        base_rows, base_cols = rows / BASELINE_STRIDE, cols / BASELINE_STRIDE
+        baselines = np.stack(
+            [ndimage.map_coordinates(g, [base_rows, base_cols], order=1, mode="nearest") for g in self.baselines]
+        )
+        return near, baselines
+
+
+def _ratios(near, baselines):
+    # where the neighbourhood p50 is zero the raw total stands in, like safety_wrapper's fatality rule
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(baselines > 0, near / baselines, near)
+
+
+def tile_bounds(z, x, y):
+    """(lat_min, lat_max, lng_min, lng_max) of an XYZ (web mercator) tile"""
+    n = 2**z
+    lng_min, lng_max = x / n * 360 - 180, (x + 1) / n * 360 - 180
+    lat_max = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    lat_min = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return lat_min, lat_max, lng_min, lng_max
+
+
+def _pixel_centers(z, x, y):
+    n = 2**z
+    offsets = (np.arange(TILE_SIZE) + 0.5) / TILE_SIZE
+    lng = (x + offsets) / n * 360 - 180
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (y + offsets) / n))))
+    return np.meshgrid(lat, lng, indexing="ij")
+
+
+def render_tile(surface, layer, z, x, y):
+    """PNG bytes for one tile of a layer"""
+    lat, lng = _pixel_centers(z, x, y)
+    near, baselines = surface.sample(lat, lng)
+    ratios = _ratios(near, baselines)
+    outside = np.isnan(near[0])
+    ratios = np.nan_to_num(ratios)
+
+    if layer == "density":
+        # crash_penalty from calculate_safety_score_logarithmic, 0..30 scaled to 0..1
+        intensity = np.clip(15 * np.log(np.maximum(ratios[0], 0.1)), 0, 30) / 30
+        rgba = colormaps["YlOrRd"](intensity)
+        rgba[..., 3] = 0.75 * intensity
+    else:
+        score = safety_engine.safety_score_array(ratios[0], ratios[1], ratios[2])
+        rgba = colormaps["RdYlGn"](score / 100)
+        rgba[..., 3] = 0.55
+    rgba[outside] = 0
+
+    buffer = io.BytesIO()
+    mpimg.imsave(buffer, rgba, format="png")
+    return buffer.getvalue()
+
+
+def get_surface():
+    """Risk surface for this worker, built from the crash snapshot (or database) once"""
+    global _surface
+    if _surface is None:
+        with _surface_lock:
+            if _surface is None:
+                _surface = RiskSurface(edge_exposure.fetch_crash_arrays())
+                print(f"Built heatmap risk surface {_surface.near.shape[1:]} ({_surface.version})")
+    return _surface
+
+
+def reload_surface():
+    """Rebuild the risk surface from the current crash data and swap it in, if one was built"""
+    global _surface
+    if _surface is None:
+        return None
+    surface = RiskSurface(edge_exposure.fetch_crash_arrays())
+    _surface = surface  # tiles key on surface.version, so stale ones are simply not found
+    return surface
+
+
+def _tile_key(surface, layer, z, x, y):
+    return cache.make_key("tile", RENDER_VERSION, surface.version, layer, z, x, y)
+
+
+def _blob_path(digest, output_dir=None):
+    return os.path.join(output_dir or TileConfig.OUTPUT_DIR.value, "blobs", digest[:2], f"{digest}.png")
+
+
+def tile_etag(layer, z, x, y):
+    """ETag of an already rendered tile, without reading it; None if not rendered yet"""
+    digest = cache.get_cache().get("tile", _tile_key(get_surface(), layer, z, x, y))
+    return None if digest is cache.MISSING else digest
+
+
+def get_tile(layer, z, x, y):
+    """
+    (etag, png bytes) for a tile, rendering and storing it on first request
+
+    Blobs are stored under the hash of their bytes, so the many identical
+    empty or uniform tiles share one file; the shared cache maps a tile's
+    inputs (surface version, layer, z/x/y) to that hash.
+    """
+    surface = get_surface()
+    key = _tile_key(surface, layer, z, x, y)
+    digest = cache.get_cache().get("tile", key)
+    if digest is not cache.MISSING and os.path.exists(_blob_path(digest)):
+        with open(_blob_path(digest), "rb") as f:
+            return digest, f.read()
+
+    data = render_tile(surface, layer, z, x, y)
+    digest = xxhash.xxh3_128_hexdigest(data)
+    path = _blob_path(digest)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp.{os.getpid()}"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    cache.get_cache().set("tile", key, digest, ttl_s=cache_ttls.get("tile"))
+    return digest, data
+
+
+def tiles_covering(lat_min, lat_max, lng_min, lng_max, z):
+    """XYZ tile coordinates covering a box at zoom z"""
+    n = 2**z
+
+    def tile_y(lat):
+        lat_rad = math.radians(lat)
+        return int((1 - math.asinh(math.tan(lat_rad)) / math.pi) / 2 * n)
+
+    x_lo, x_hi = int((lng_min + 180) / 360 * n), int((lng_max + 180) / 360 * n)
+    y_lo, y_hi = tile_y(lat_max), tile_y(lat_min)
+    return [(x, y) for x in range(x_lo, x_hi + 1) for y in range(y_lo, y_hi + 1)]
+
+
+def prerender(zooms=None, layers=LAYERS):
+    """Render every tile over the city at the given zooms; returns how many were rendered"""
+    if zooms is None:
+        zooms = [int(z) for z in TileConfig.PRERENDER_ZOOMS.split(",")]
+    surface = get_surface()
+    bounds = (surface.lat_min, surface.lat_max, surface.lng_min, surface.lng_max)
+    rendered = 0
+    for z in zooms:
+        tiles = tiles_covering(*bounds, z)
+        for layer in layers:
+            for x, y in tiles:
+                get_tile(layer, z, x, y)
+                rendered += 1
+        print(f"   z{z}: {len(tiles)} tiles per layer")
+    return rendered
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-render crash heatmap tiles")
+    parser.add_argument("--zooms", nargs="+", type=int, help="defaults to TileConfig.PRERENDER_ZOOMS")
+    args = parser.parse_args()
+
+    print(f"✓ Rendered {prerender(args.zooms)} tiles into {TileConfig.OUTPUT_DIR.value}")
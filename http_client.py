@@ -0,0 +1,97 @@
+import threading
+
+import httpx
+
+import cassette
+from constants import HttpClientConfig, http_hosts
+
+_client = None
+_async_client = None
+_lock = threading.Lock()
+
+
+def _http2_enabled():
+    if HttpClientConfig.HTTP2 != "true":
+        return False
+    try:
+        import h2  # noqa: F401  httpx needs the h2 package for HTTP/2
+    except ImportError:
+        print("HTTP/2 requested but the h2 package is not installed, using HTTP/1.1")
+        return False
+    return True
+
+
+def _limits(config):
+    return httpx.Limits(
+        max_connections=int(config.get("max_connections", HttpClientConfig.MAX_CONNECTIONS)),
+        max_keepalive_connections=int(config.get("max_keepalive", HttpClientConfig.MAX_KEEPALIVE)),
+        keepalive_expiry=float(HttpClientConfig.KEEPALIVE_EXPIRY_S),
+    )
+
+
+def _timeout():
+    return httpx.Timeout(
+        float(HttpClientConfig.TIMEOUT_S), connect=float(HttpClientConfig.CONNECT_TIMEOUT_S)
+    )
+
+
+def _build(transport_class, client_class):
+    http2 = _http2_enabled()
+    asynchronous = client_class is httpx.AsyncClient
+    # each configured host gets its own pool so one slow API can't starve the others
+    mounts = {
+        f"https://{host}": cassette.wrap(
+            transport_class(limits=_limits(config), http2=http2, retries=1), asynchronous
+        )
+        for host, config in http_hosts.items()
+    }
+    return client_class(
+        timeout=_timeout(),
+        transport=cassette.wrap(transport_class(limits=_limits({}), http2=http2), asynchronous),
+        mounts=mounts,
+        follow_redirects=True,
+    )
+
+
+def get_client():
+    """Process-wide pooled keep-alive client for synchronous code"""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = _build(httpx.HTTPTransport, httpx.Client)
+    return _client
+
+
+def get_async_client():
+    """Process-wide pooled keep-alive client for async code"""
+    global _async_client
+    if _async_client is None:
+        with _lock:
+            if _async_client is None:
+                _async_client = _build(httpx.AsyncHTTPTransport, httpx.AsyncClient)
+    return _async_client
+
+
+def close_clients():
+    global _client
+    with _lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+    cassette.save()
+
+
+async def aclose_clients():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+
+def get(url, **kwargs):
+    return get_client().get(url, **kwargs)
+
+
+def post(url, **kwargs):
+    return get_client().post(url, **kwargs)
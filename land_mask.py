@@ -0,0 +1,235 @@
+import math
+import os
+import sys
+
+import numpy as np
+import orjson
+
+from constants import LandMaskConfig
+
+OUTSIDE, INSIDE, BOUNDARY = 0, 1, 2
+
+_mask = None
+
+
+class LandMask:
+    """
+    Rasterized land / in-city mask
+
+    Cells fully inside or outside the polygons answer from the bitmap alone; only
+    cells a polygon boundary passes through fall back to an exact ray-casting test.
+    """
+
+    def __init__(self, cells, origin, cell_deg, edges):
+        self.cells = cells  # uint8 grid of OUTSIDE / INSIDE / BOUNDARY
+        self.origin_lat, self.origin_lng = float(origin[0]), float(origin[1])
+        self.cell_deg = float(cell_deg)
+        self.edges = edges  # (n, 4) lng1, lat1, lng2, lat2 of every polygon ring segment
+
+    def contains(self, lat, lng):
+        """True if the point is on land inside the mapped area"""
+        row = int(math.floor((lat - self.origin_lat) / self.cell_deg))
+        col = int(math.floor((lng - self.origin_lng) / self.cell_deg))
+        if row < 0 or col < 0 or row >= self.cells.shape[0] or col >= self.cells.shape[1]:
+            return False
+
+        state = self.cells[row, col]
+        if state != BOUNDARY:
+            return state == INSIDE
+        return point_in_polygons(lat, lng, self.edges)
+
+    def nudge_onto_land(self, start_lat, start_lng, lat, lng, max_fraction=None, steps=20):
+        """
+        Pull a point back toward the start until it lands inside the mask
+
+        Returns:
+            (lat, lng) on land, or None if nothing within max_fraction of the way back
+        """
+        if max_fraction is None:
+            max_fraction = float(LandMaskConfig.MAX_NUDGE_FRACTION)
+        for t in np.linspace(0, max_fraction, steps + 1):
+            candidate_lat = float(lat + (start_lat - lat) * t)
+            candidate_lng = float(lng + (start_lng - lng) * t)
+            if self.contains(candidate_lat, candidate_lng):
+                return candidate_lat, candidate_lng
+        return None
+
+
+def point_in_polygons(lat, lng, edges):
+    """Even-odd ray casting against every ring segment, vectorized over segments"""
+    lng1, lat1, lng2, lat2 = edges.T
+    spans = (lat1 > lat) != (lat2 > lat)
+    x_cross = lng1[spans] + (lat - lat1[spans]) * (lng2[spans] - lng1[spans]) / (lat2[spans] - lat1[spans])
+    return bool(np.count_nonzero(x_cross > lng) % 2)
+
+
+def polygon_edges_from_geojson(path):
+    """All ring segments of the Polygon / MultiPolygon features in a GeoJSON file"""
+    with open(path, "rb") as f:
+        data = orjson.loads(f.read())
+
+    features = data["features"] if data.get("type") == "FeatureCollection" else [data]
+    segments = []
+    for feature in features:
+        geom = feature.get("geometry", feature)
+        if geom["type"] == "Polygon":
+            polygons = [geom["coordinates"]]
+        elif geom["type"] == "MultiPolygon":
+            polygons = geom["coordinates"]
+        else:
+            continue
+
+        for rings in polygons:
+            for ring in rings:  # holes are rings too, even-odd takes care of them
+                ring = np.asarray(ring, dtype=np.float64)[:, :2]
+                if len(ring) < 3:
+                    continue
+                if not np.array_equal(ring[0], ring[-1]):
+                    ring = np.vstack((ring, ring[:1]))
+                ring_segments = np.hstack((ring[:-1], ring[1:]))
+                # repeated consecutive vertices (common in GeoJSON) make zero-length edges
+                segments.append(ring_segments[np.any(ring[:-1] != ring[1:], axis=1)])
+
+    return np.vstack(segments)
+
+
+def _traversed_cells(edges, origin, cell_deg):
+    """
+    (rows, cols) of every cell a segment passes through, however little of it
+
+    Exact grid traversal: each segment is cut where it crosses a grid line, and
+    every piece between two cuts lies in one cell, found from its midpoint.
+    """
+    lng1, lat1, lng2, lat2 = edges.T
+    r1, r2 = np.floor((lat1 - origin[0]) / cell_deg), np.floor((lat2 - origin[0]) / cell_deg)
+    c1, c2 = np.floor((lng1 - origin[1]) / cell_deg), np.floor((lng2 - origin[1]) / cell_deg)
+    row_cuts = np.abs(r2 - r1).astype(np.int64)
+    col_cuts = np.abs(c2 - c1).astype(np.int64)
+
+    def cuts(count, start, coord1, coord2, offset):
+        # t along each segment where it meets the grid lines between its end cells
+        ids = np.repeat(np.arange(len(edges)), count)
+        k = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+        lines = np.where(coord2[ids] > coord1[ids], start[ids] + 1 + k, start[ids] - k)
+        return ids, (offset + lines * cell_deg - coord1[ids]) / (coord2[ids] - coord1[ids])
+
+    row_ids, row_t = cuts(row_cuts, r1, lat1, lat2, origin[0])
+    col_ids, col_t = cuts(col_cuts, c1, lng1, lng2, origin[1])
+    ends = np.arange(len(edges))
+    ids = np.concatenate((ends, ends, row_ids, col_ids))
+    t = np.clip(np.concatenate((np.zeros(len(edges)), np.ones(len(edges)), row_t, col_t)), 0, 1)
+    order = np.lexsort((t, ids))
+    ids, t = ids[order], t[order]
+
+    same = ids[1:] == ids[:-1]
+    mid_ids, mid_t = ids[1:][same], (t[1:][same] + t[:-1][same]) / 2
+    rows = np.floor((lat1[mid_ids] + mid_t * (lat2[mid_ids] - lat1[mid_ids]) - origin[0]) / cell_deg)
+    cols = np.floor((lng1[mid_ids] + mid_t * (lng2[mid_ids] - lng1[mid_ids]) - origin[1]) / cell_deg)
+    # the end cells too, in case a segment ends exactly on a grid line
+    rows = np.concatenate((rows, r1, r2)).astype(np.int64)
+    cols = np.concatenate((cols, c1, c2)).astype(np.int64)
+    return rows, cols
+
+
+def rasterize(edges, cell_deg):
+    """Classify grid cells as OUTSIDE / INSIDE / BOUNDARY with one scanline pass per row"""
+    lng_min, lng_max = edges[:, [0, 2]].min(), edges[:, [0, 2]].max()
+    lat_min, lat_max = edges[:, [1, 3]].min(), edges[:, [1, 3]].max()
+    origin = (lat_min - cell_deg, lng_min - cell_deg)
+    rows = int(math.ceil((lat_max - origin[0]) / cell_deg)) + 2
+    cols = int(math.ceil((lng_max - origin[1]) / cell_deg)) + 2
+
+    # inside/outside at every cell corner from scanline crossings
+    corner_lng = origin[1] + np.arange(cols + 1) * cell_deg
+    corners = np.zeros((rows + 1, cols + 1), dtype=bool)
+    lng1, lat1, lng2, lat2 = edges.T
+    for r in range(rows + 1):
+        y = origin[0] + r * cell_deg
+        spans = (lat1 > y) != (lat2 > y)
+        x_cross = np.sort(
+            lng1[spans] + (y - lat1[spans]) * (lng2[spans] - lng1[spans]) / (lat2[spans] - lat1[spans])
+        )
+        corners[r] = (len(x_cross) - np.searchsorted(x_cross, corner_lng, side="right")) % 2 == 1
+
+    all_in = corners[:-1, :-1] & corners[1:, :-1] & corners[:-1, 1:] & corners[1:, 1:]
+    any_in = corners[:-1, :-1] | corners[1:, :-1] | corners[:-1, 1:] | corners[1:, 1:]
+    cells = np.where(all_in, INSIDE, OUTSIDE).astype(np.uint8)
+    cells[any_in & ~all_in] = BOUNDARY
+
+    # cells a segment passes through can be boundary even when all four corners agree
+    r, c = _traversed_cells(edges, origin, cell_deg)
+    cells[r, c] = BOUNDARY
+
+    return cells, np.array(origin)
+
+
+def build_land_mask(geojson_path, out_path=LandMaskConfig.PATH.value, cell_deg=None):
+    """Rasterize land polygons from GeoJSON and save the mask for fast loading"""
+    if cell_deg is None:
+        cell_deg = float(LandMaskConfig.CELL_DEG)
+
+    edges = polygon_edges_from_geojson(geojson_path)
+    cells, origin = rasterize(edges, cell_deg)
+
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    np.savez_compressed(out_path, cells=cells, origin=origin, cell_deg=cell_deg, edges=edges)
+
+    boundary = np.count_nonzero(cells == BOUNDARY)
+    print(f"✓ Wrote {cells.shape[0]}x{cells.shape[1]} mask ({boundary} boundary cells) to {out_path}")
+
+
+def load_land_mask(path=LandMaskConfig.PATH.value):
+    with np.load(path) as data:
+        return LandMask(data["cells"], data["origin"], data["cell_deg"], data["edges"])
+
+
+def get_land_mask(path=LandMaskConfig.PATH.value):
+    """Shared mask for this worker, or None when no mask has been built"""
+    global _mask
+    if _mask is None:
+        if not os.path.exists(path):
+            return None
+        _mask = load_land_mask(path)
+    return _mask
+
+
+def filter_endpoints(endpoints, start_lat, start_lng, mask=None):
+    """
+    Drop or nudge endpoints that fall in water or outside the city, without any API call
+
+    Returns:
+        Endpoints on land; nudged ones keep their original position under 'original'
+    """
+    mask = mask or get_land_mask()
+    if mask is None:
+        return endpoints
+
+    valid_endpoints = []
+    for endpoint in endpoints:
+        if mask.contains(endpoint["lat"], endpoint["lng"]):
+            valid_endpoints.append(endpoint)
+            continue
+
+        nudged = mask.nudge_onto_land(start_lat, start_lng, endpoint["lat"], endpoint["lng"])
+        if nudged is None:
+            print(f"   {endpoint['direction']}: in water / out of city (FILTERED)")
+            continue
+
+        print(f"   {endpoint['direction']}: nudged onto land")
+        valid_endpoints.append(
+            {
+                **endpoint,
+                "lat": nudged[0],
+                "lng": nudged[1],
+                "original": {"lat": endpoint["lat"], "lng": endpoint["lng"]},
+            }
+        )
+
+    return valid_endpoints
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python land_mask.py <land_polygons.geojson> [out.npz]")
+        sys.exit(1)
+    build_land_mask(*sys.argv[1:3])
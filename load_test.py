@@ -0,0 +1,364 @@
+import argparse
+import asyncio
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import httpx
+import numpy as np
+import orjson
+
+import cassette
+import constants as const
+
+# environment for a server that never leaves the machine: local street graph
+# routing, the crash snapshot, templated recommendations instead of the LLM, and
+# outbound HTTP replayed from a cassette so nothing can reach a live API
+OFFLINE_ENV = {
+    "ROUTING_BACKEND": "local",
+    "SAFETY_DATA_BACKEND": "snapshot",
+    "OPENAI_API_KEY": "",
+    "HTTP_CASSETTE_MODE": "replay",
+}
+# local indexes the offline server answers from; without them it would go to Google or Postgres
+OFFLINE_INDEXES = [const.StreetGraphConfig.PATH.value, const.CrashSnapshotConfig.PATH.value]
+
+ENDPOINT = "/api/routes/generate"
+
+
+def build_mix(starts=None, distances_km=None, jitter_m=0.0, size=200, seed=0):
+    """
+    Requests to replay: every start/distance pair, shuffled and repeated to size
+
+    jitter_m moves each start up to that far so repeats don't all hit caches.
+    """
+    starts = starts or const.popular_starts
+    distances_km = distances_km or const.standard_distances_km
+    rng = random.Random(seed)
+    pairs = [(start, distance) for start in starts for distance in distances_km]
+
+    mix = []
+    while len(mix) < size:
+        start, distance = rng.choice(pairs)
+        lat, lng = start["lat"], start["lng"]
+        if jitter_m:
+            angle = rng.uniform(0, 2 * math.pi)
+            offset_km = rng.uniform(0, jitter_m) / 1000
+            lat += offset_km * math.cos(angle) / 111.0
+            lng += offset_km * math.sin(angle) / (111.0 * math.cos(math.radians(lat)))
+        mix.append({"start_lat": round(lat, 6), "start_lng": round(lng, 6), "target_distance_km": distance})
+    return mix
+
+
+class ProcessMonitor:
+    """CPU and RSS of the server process, read from /proc (Linux only)"""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.clock_ticks = os.sysconf("SC_CLK_TCK")
+        self.page_size = os.sysconf("SC_PAGE_SIZE")
+        self.rss_samples = []
+
+    def _pids(self):
+        # uvicorn --workers forks children; count them with the parent
+        try:
+            with open(f"/proc/{self.pid}/task/{self.pid}/children") as f:
+                return [self.pid] + [int(pid) for pid in f.read().split()]
+        except OSError:
+            return [self.pid]
+
+    def _cpu_seconds(self):
+        total = 0.0
+        for pid in self._pids():
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            # utime and stime, fields 14 and 15 of stat (offset by the split above)
+            total += (int(fields[11]) + int(fields[12])) / self.clock_ticks
+        return total
+
+    def _rss_mb(self):
+        total = 0
+        for pid in self._pids():
+            with open(f"/proc/{pid}/statm") as f:
+                total += int(f.read().split()[1]) * self.page_size
+        return total / 1024 / 1024
+
+    def start(self):
+        self.cpu_start = self._cpu_seconds()
+        self.wall_start = time.monotonic()
+        self.rss_samples = [self._rss_mb()]
+
+    def sample(self):
+        self.rss_samples.append(self._rss_mb())
+
+    def stop(self):
+        wall = time.monotonic() - self.wall_start
+        return {
+            "cpu_percent": round((self._cpu_seconds() - self.cpu_start) / wall * 100, 1),
+            "rss_mb_max": round(max(self.rss_samples + [self._rss_mb()]), 1),
+        }
+
+
+async def _send(client, params, results):
+    started = time.perf_counter()
+    try:
+        response = await client.get(ENDPOINT, params=params)
+        if response.status_code != 200:
+            error = f"HTTP {response.status_code}"
+        elif response.content in (b"", b"null"):
+            error = "empty_response"  # the endpoint swallowed an exception
+        else:
+            error = None
+        ok = error is None
+        degradations = response.headers.get("X-Degradations", "none")
+    except httpx.HTTPError as e:
+        ok, error, degradations = False, type(e).__name__, "none"
+    results.append(
+        {
+            "latency_ms": (time.perf_counter() - started) * 1000,
+            "ok": ok,
+            "error": error,
+            "degraded": degradations != "none",
+        }
+    )
+
+
+async def run_level(base_url, mix, concurrency, duration_s, rate=None, timeout_s=60, monitor=None):
+    """
+    Drive the service for duration_s with at most `concurrency` requests in flight
+
+    With a rate, arrivals are Poisson (open loop) and requests that find every
+    slot busy wait their turn; their queueing time counts toward latency, which
+    is what a user would see. Without one, each slot sends back to back.
+    """
+    results = []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout_s, limits=limits) as client:
+        semaphore = asyncio.Semaphore(concurrency)
+        started = time.monotonic()
+        deadline = started + duration_s
+        tasks = []
+        sent = 0
+
+        async def limited(params):
+            async with semaphore:
+                await _send(client, params, results)
+
+        async def closed_loop_worker(offset):
+            nonlocal sent
+            i = offset
+            while time.monotonic() < deadline:
+                await _send(client, mix[i % len(mix)], results)
+                sent += 1
+                i += concurrency
+
+        async def sample_resources():
+            while time.monotonic() < deadline:
+                monitor.sample()
+                await asyncio.sleep(0.5)
+
+        if monitor:
+            monitor.start()
+            sampler = asyncio.create_task(sample_resources())
+
+        if rate:
+            rng = random.Random(concurrency)
+            next_at = started
+            while next_at < deadline:
+                await asyncio.sleep(max(0.0, next_at - time.monotonic()))
+                tasks.append(asyncio.create_task(limited(mix[sent % len(mix)])))
+                sent += 1
+                next_at += rng.expovariate(rate)
+            await asyncio.gather(*tasks)
+        else:
+            await asyncio.gather(*(closed_loop_worker(i) for i in range(concurrency)))
+
+        elapsed = time.monotonic() - started
+        resources = {}
+        if monitor:
+            sampler.cancel()
+            resources = monitor.stop()
+
+    return summarize(results, elapsed, concurrency, rate, resources)
+
+
+def summarize(results, elapsed_s, concurrency, rate, resources):
+    latencies = np.array([r["latency_ms"] for r in results if r["ok"]]) if results else np.array([])
+    errors = {}
+    for r in results:
+        if r["error"]:
+            errors[r["error"]] = errors.get(r["error"], 0) + 1
+
+    def pct(q):
+        return round(float(np.percentile(latencies, q)), 1) if len(latencies) else None
+
+    ok = int(sum(r["ok"] for r in results))
+    return {
+        "concurrency": concurrency,
+        "target_rate_rps": rate,
+        "requests": len(results),
+        "ok": ok,
+        "error_rate": round(1 - ok / len(results), 4) if results else None,
+        "errors": errors,
+        "degraded_rate": round(sum(r["degraded"] for r in results) / len(results), 4) if results else None,
+        "throughput_rps": round(ok / elapsed_s, 2),
+        "latency_ms": {
+            "mean": round(float(latencies.mean()), 1) if len(latencies) else None,
+            "p50": pct(50),
+            "p90": pct(90),
+            "p95": pct(95),
+            "p99": pct(99),
+            "max": round(float(latencies.max()), 1) if len(latencies) else None,
+        },
+        **resources,
+    }
+
+
+def find_saturation(levels, min_gain=0.05, max_error_rate=0.01, p95_factor=3.0):
+    """
+    First concurrency level past which adding load stops paying off
+
+    That is: throughput grew by less than min_gain, the error rate went over
+    max_error_rate, or p95 latency rose above p95_factor times the lightest level's.
+    """
+    if not levels:
+        return None
+    base_p95 = levels[0]["latency_ms"]["p95"] or 0
+    for previous, level in zip(levels, levels[1:]):
+        reasons = []
+        if previous["throughput_rps"] and level["throughput_rps"] < previous["throughput_rps"] * (1 + min_gain):
+            reasons.append("throughput_flat")
+        if (level["error_rate"] or 0) > max_error_rate:
+            reasons.append("errors")
+        if base_p95 and (level["latency_ms"]["p95"] or 0) > base_p95 * p95_factor:
+            reasons.append("latency")
+        if reasons:
+            return {
+                "concurrency": previous["concurrency"],
+                "throughput_rps": previous["throughput_rps"],
+                "reasons": reasons,
+            }
+    return None
+
+
+def _git_version():
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def check_offline_indexes(paths=OFFLINE_INDEXES):
+    """Abort before starting the server if a local index it needs is missing"""
+    missing = [path for path in paths if not os.path.exists(path)]
+    if missing:
+        raise SystemExit(f"Missing local indexes for an offline run: {', '.join(missing)}")
+
+
+def start_server(port, workers=1, cassette_path=None):
+    """Start uvicorn on main.app with the offline stand-ins; returns the process"""
+    env = {**os.environ, **OFFLINE_ENV, "HTTP_CASSETTE_PATH": cassette_path or const.CassetteConfig.PATH.value}
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--workers", str(workers),
+         "--log-level", "warning"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    # wait for warm-up so the first level isn't measuring a cold worker
+    for _ in range(300):
+        try:
+            if httpx.get(f"{base_url}/api/health/ready", timeout=1).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("Server did not come up")
+
+
+async def sweep(base_url, mix, concurrency_levels, duration_s, rate=None, pid=None):
+    levels = []
+    for concurrency in concurrency_levels:
+        print(f"Concurrency {concurrency}...")
+        monitor = ProcessMonitor(pid) if pid else None
+        level = await run_level(base_url, mix, concurrency, duration_s, rate=rate, monitor=monitor)
+        latency = level["latency_ms"]
+        print(
+            f"   {level['throughput_rps']} req/s, p50 {latency['p50']}ms, p95 {latency['p95']}ms, "
+            f"errors {level['error_rate']:.1%}"
+            + (f", cpu {level['cpu_percent']}%, rss {level['rss_mb_max']}MB" if pid else "")
+        )
+        levels.append(level)
+    return levels
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test /api/routes/generate")
+    parser.add_argument("--url", help="Running service; omitted, one is started with offline stand-ins")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--cassette", help="Recorded session the offline server replays; omitted, outbound calls fail")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--pid", type=int, help="Server process to watch for CPU and memory")
+    parser.add_argument("--concurrency", default="1,2,4,8,16,32", help="Comma separated levels to sweep")
+    parser.add_argument("--rate", type=float, help="Poisson arrival rate per second; default is closed loop")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds per concurrency level")
+    parser.add_argument("--jitter-m", type=float, default=0, help="Randomly move starts up to this far")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=f"load_test_{datetime.now():%Y%m%d_%H%M%S}.json")
+    args = parser.parse_args()
+
+    process = None
+    base_url, pid = args.url, args.pid
+    scratch = tempfile.TemporaryDirectory()
+    if base_url is None:
+        check_offline_indexes()
+        cassette_path = args.cassette
+        if cassette_path is None:
+            cassette_path = os.path.join(scratch.name, "empty.cassette")
+            # nothing recorded: under replay every outbound call fails instead of going out
+            cassette.write(cassette_path, [])
+        elif not os.path.exists(cassette_path):
+            raise SystemExit(f"No cassette at {cassette_path}")
+        process = start_server(args.port, args.workers, cassette_path)
+        base_url, pid = f"http://127.0.0.1:{args.port}", process.pid
+
+    mix = build_mix(jitter_m=args.jitter_m, seed=args.seed)
+    levels_to_run = [int(level) for level in args.concurrency.split(",")]
+    try:
+        levels = asyncio.run(sweep(base_url, mix, levels_to_run, args.duration, rate=args.rate, pid=pid))
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+        scratch.cleanup()
+
+    report = {
+        "version": _git_version(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": {
+            "url": base_url,
+            "workers": args.workers if process else None,
+            "duration_s": args.duration,
+            "rate_rps": args.rate,
+            "jitter_m": args.jitter_m,
+            "mix_size": len(mix),
+        },
+        "levels": levels,
+        "saturation": find_saturation(levels),
+    }
+    with open(args.output, "wb") as f:
+        f.write(orjson.dumps(report, option=orjson.OPT_INDENT_2))
+    print(f"✓ Saturation: {report['saturation']}")
+    print(f"✓ Wrote {args.output}")
@@ -1,11 +1,41 @@
-from fastapi import FastAPI
-from ai_agents import SafetyAnalysisAgent
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Optional
+
+from fastapi import FastAPI, Query, Request, Response
+from ai_agents import SafetyAnalysisAgent, templated_recommendation
 
 # from test_google_routes import GoogleRoutesAPI
 import get_routes
 import polyline_safety_analysis as p
+import route_library
+import outbound
+import cache
+import profiling
+import http_client
+import warmup
+import heatmap_tiles
+import get_weather
+import crash_hours
+import data_sync
+import cities
+import response_format
+from constants import DeadlineConfig, ProfilingConfig, TileConfig
+from deadline import Deadline
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # warm in the background so the worker can answer health checks meanwhile
+    startup.start()
+    reloader.start()
+    yield
+    reloader.stop()
+    http_client.close_clients()
+    await http_client.aclose_clients()
 
-app = FastAPI(title="runsafe-ai", version="0.1.0")
+
+app = FastAPI(title="runsafe-ai", version="0.1.0", lifespan=lifespan)
 
 safety_ai = None
 
@@ -27,20 +57,84 @@ def get_safety_ai():
     return safety_ai
 
 
+startup = warmup.Warmup(warmup.default_steps(get_safety_ai))
+# swaps in crash data published by data_sync.py without a restart
+reloader = data_sync.Reloader(data_sync.default_reload_steps())
+
+
+@app.get("/api/health/live")
+def health_live():
+    return {"status": "ok"}
+
+
+@app.get("/api/health/ready")
+def health_ready(response: Response):
+    """200 once warm-up has finished, 503 before, so deploys only route to warm workers"""
+    if not startup.ready:
+        response.status_code = 503
+    return startup.status()
+
+
 @app.get("/api/routes/generate")
 def generate_running_routes(
-    start_lat: float, start_lng: float, target_distance_km: float = 5.0
+    request: Request,
+    response: Response,
+    start_lat: float,
+    start_lng: float,
+    target_distance_km: float = 5.0,
+    budget_s: Optional[float] = None,
+    profile: Optional[str] = None,
+    start_time: Optional[datetime] = None,
+    fields: Optional[str] = None,
+    format: Optional[str] = None,
 ):
-    """Generate routes and get AI recommendations"""
+    """
+    Generate routes and get AI recommendations; start_time scores them for a planned run
+
+    The body is the recommendation, as JSON or MessagePack (Accept or ?format=),
+    zstd/gzip compressed when the client accepts it. With ?fields= it is the
+    whole result instead (recommendation, route_options, ...) cut down to the
+    given dotted paths, e.g. fields=route_options.direction,route_options.safety_analysis.overall_safety_score
+    or fields=-route_options.polyline,-route_options.safety_analysis.dangerous_segments
+    """
+
+    # opt-in profiling (X-Profile header, ?profile= or sampling); a no-op otherwise
+    mode = profiling.requested_mode(request.headers.get(ProfilingConfig.HEADER.value), profile)
+    with profiling.profile_request(mode, request.headers.get("X-Request-ID")) as profiled:
+        result = _generate_running_routes(
+            response, start_lat, start_lng, target_distance_km, budget_s, start_time
+        )
+    if profiled.request_id:
+        response.headers["X-Profile-Id"] = profiled.request_id
+
+    body = result if fields or result is None else result["recommendation"]
+    # a returned Response doesn't pick up headers set on the injected one
+    headers = {k: v for k, v in response.headers.items() if k.lower().startswith("x-")}
+    return response_format.render(request, body, fields=fields, format=format, headers=headers)
+
+
+def _generate_running_routes(response, start_lat, start_lng, target_distance_km, budget_s, start_time=None):
+    # every stage checks the remaining budget and degrades rather than overrun it
+    deadline = Deadline(budget_s or float(DeadlineConfig.DEFAULT_BUDGET_S))
 
     # Generate routes with safety analysis
     try:
-        enhanced_routes = p.generate_running_routes_with_polyline_safety(
-            start_lat,
-            start_lng,
-            target_distance_km,
-            get_routes.optimized_route_finder
+        # fast path: serve a nearby precomputed start, live generation only on a miss
+        # (precomputed routes are scored time-agnostic, so not for a planned start time)
+        precomputed = None if start_time else route_library.lookup_precomputed_routes(
+            start_lat, start_lng, target_distance_km
         )
+        if precomputed:
+            enhanced_routes = precomputed["routes"]
+        else:
+            enhanced_routes = p.generate_running_routes_with_polyline_safety(
+                start_lat,
+                start_lng,
+                target_distance_km,
+                get_routes.optimized_route_finder,
+                deadline=deadline,
+                when=start_time,
+            )
 
         # prep metadata for LLM
         route_metadata = {
@@ -48,8 +142,87 @@ def generate_running_routes(
             "target_distance_km": target_distance_km,
             "route_options": enhanced_routes,
         }
+        if precomputed:
+            route_metadata["route_freshness"] = precomputed["freshness"]
+        if start_time:
+            route_metadata["planned_start_time"] = start_time.isoformat()
+        if deadline.degradations:
+            # what the recommendation is written from; the final list is set below
+            route_metadata["degradations"] = list(deadline.degradations)
 
         ai_agent = get_safety_ai()
-        return ai_agent.make_call_to_llm(route_metadata)
+        if ai_agent is None:
+            deadline.degrade("templated_recommendation")
+            result = templated_recommendation(route_metadata)
+        else:
+            result = ai_agent.make_call_to_llm(route_metadata, deadline=deadline)
+
+        # after the recommendation, so its own fallback shows up in the body as in the header
+        if deadline.degradations:
+            route_metadata["degradations"] = list(deadline.degradations)
+        response.headers["X-Degradations"] = ",".join(deadline.degradations) or "none"
+        response.headers["X-Elapsed-Ms"] = f"{deadline.elapsed() * 1000:.0f}"
+        return {"recommendation": result, **route_metadata}
     except:
         print("no service!!")
+
+
+@app.get("/api/metrics/outbound")
+def outbound_metrics():
+    """Rate limiter, retry and circuit breaker state per external provider"""
+    return outbound.get_metrics()
+
+
+@app.get("/api/metrics/cache")
+def cache_metrics():
+    """Hit/miss counters and size of the shared cache per namespace"""
+    return cache.get_cache().stats()
+
+
+@app.get("/api/metrics/data")
+def data_metrics():
+    """Crash data version this worker serves, how its last hot reload went and its loaded city shards"""
+    return {**reloader.status(), "city_shards": cities.shard_status()}
+
+
+@app.get("/api/weather/best-times")
+def best_times_to_run(lat: float, lng: float, duration_h: int = Query(1, ge=1), hours: Optional[int] = Query(None, ge=1)):
+    """Ranked time windows to run in over the coming hours, from the geotile's cached forecast"""
+    return get_weather.best_run_windows(
+        lat, lng, duration_h=duration_h, hours=hours, hour_risk=crash_hours.hour_risk(lat, lng)
+    )
+
+
+def _etag_matches(if_none_match, etag):
+    """If-None-Match against a strong ETag: weak validators and lists compare too, "*" matches any"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == f'"{etag}"':
+            return True
+    return False
+
+
+@app.get("/api/tiles/{layer}/{z}/{x}/{y}.png")
+def heatmap_tile(layer: str, z: int, x: int, y: int, request: Request):
+    """XYZ heatmap tile of crash density or safety score, with ETag revalidation"""
+    if layer not in heatmap_tiles.LAYERS:
+        return Response(status_code=404)
+    if not int(TileConfig.MIN_ZOOM) <= z <= int(TileConfig.MAX_ZOOM) or not (0 <= x < 2**z and 0 <= y < 2**z):
+        return Response(status_code=404)
+
+    try:
+        heatmap_tiles.get_surface()
+    except Exception as e:
+        # no snapshot and no database: nothing to draw from yet, ask the client to come back
+        print(f"Heatmap surface unavailable: {e}")
+        return Response(status_code=503, headers={"Retry-After": "60"})
+
+    headers = {"Cache-Control": f"public, max-age={TileConfig.MAX_AGE_S}"}
+    etag = heatmap_tiles.tile_etag(layer, z, x, y)
+    if etag is not None and _etag_matches(request.headers.get("If-None-Match"), etag):
+        return Response(status_code=304, headers={**headers, "ETag": f'"{etag}"'})
+
+    etag, data = heatmap_tiles.get_tile(layer, z, x, y)
+    return Response(content=data, media_type="image/png", headers={**headers, "ETag": f'"{etag}"'})
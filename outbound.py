@@ -0,0 +1,267 @@
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import httpx
+from tenacity import (
+    Retrying,
+    retry_if_exception,
+    retry_if_result,
+    stop_after_attempt,
+    stop_before_delay,
+    wait_random_exponential,
+)
+
+from constants import outbound_providers
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_providers = {}
+_providers_lock = threading.Lock()
+_hedge_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hedge")
+
+
+class RateLimitedError(Exception):
+    """No token became available within the provider's wait budget"""
+
+
+class CircuitOpenError(Exception):
+    """The provider has been failing and calls are short-circuited for now"""
+
+
+class DeadlineExceededError(Exception):
+    """The caller's request budget ran out before the call could be made"""
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at rate tokens per second"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.granted = 0
+        self.throttled = 0
+        self.wait_seconds = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self):
+        with self.lock:
+            self._refill(time.monotonic())
+            if self.tokens >= 1:
+                self.tokens -= 1
+                self.granted += 1
+                return True
+            return False
+
+    def acquire(self, max_wait):
+        """Block until a token is available; False if that would take longer than max_wait"""
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            delay = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+            if delay > max_wait:
+                self.throttled += 1
+                return False
+            # reserve the token now so concurrent callers queue up behind us
+            self.tokens -= 1
+            self.granted += 1
+            self.wait_seconds += delay
+        if delay:
+            time.sleep(delay)
+        return True
+
+    def snapshot(self):
+        with self.lock:
+            self._refill(time.monotonic())
+            return {
+                "rate_per_s": self.rate,
+                "capacity": self.capacity,
+                "tokens_available": round(max(self.tokens, 0), 2),
+                "granted": self.granted,
+                "throttled": self.throttled,
+                "total_wait_s": round(self.wait_seconds, 3),
+            }
+
+
+class CircuitBreaker:
+    """Opens after consecutive failures, lets one trial call through after a cooldown"""
+
+    def __init__(self, failure_threshold, reset_after_s):
+        self.failure_threshold = failure_threshold
+        self.reset_after_s = reset_after_s
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+        self.short_circuited = 0
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_after_s:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        with self.lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            self.short_circuited += 1
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def cancel_trial(self):
+        with self.lock:
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class Provider:
+    def __init__(self, name, config):
+        self.name = name
+        self.config = config
+        self.bucket = TokenBucket(config["rate_per_s"], config["burst"])
+        self.breaker = CircuitBreaker(config["failure_threshold"], config["reset_after_s"])
+        self.stats = {"calls": 0, "failures": 0, "retries": 0, "hedges_sent": 0, "hedges_won": 0}
+        self.lock = threading.Lock()
+
+    def count(self, key, n=1):
+        with self.lock:
+            self.stats[key] += n
+
+
+def get_provider(name):
+    with _providers_lock:
+        if name not in _providers:
+            _providers[name] = Provider(name, outbound_providers[name])
+        return _providers[name]
+
+
+def _is_retryable_exception(exc):
+    return isinstance(exc, httpx.TransportError)
+
+
+def _is_retryable_response(response):
+    return getattr(response, "status_code", None) in RETRY_STATUSES
+
+
+def _send_hedged(provider, request_fn, timeout):
+    """Send the request, and a duplicate if the first is slow; first answer wins"""
+    primary = _hedge_pool.submit(request_fn, timeout)
+    done, _ = wait([primary], timeout=provider.config["hedge_after_s"])
+    if done or not provider.bucket.try_acquire():
+        return primary.result()
+
+    provider.count("hedges_sent")
+    hedge = _hedge_pool.submit(request_fn, timeout)
+    done, _ = wait([primary, hedge], return_when=FIRST_COMPLETED)
+    winner = done.pop()
+    if winner is hedge:
+        provider.count("hedges_won")
+    # the loser is left to finish in the background; its response is dropped
+    return winner.result()
+
+
+def call(name, request_fn, hedge=False, deadline=None):
+    """
+    Make an outbound call under the provider's rate limit, retry policy and breaker
+
+    Args:
+        name: Provider key in constants.outbound_providers
+        request_fn: Callable taking a timeout in seconds and returning a response
+        hedge: Send a duplicate request if the first hasn't answered in hedge_after_s
+        deadline: Optional Deadline; the token wait, each attempt's timeout and
+            the retries all stay inside what is left of it
+
+    Returns:
+        The response; a final 429/5xx response is returned as-is for the caller to handle
+    """
+    provider = get_provider(name)
+    config = provider.config
+
+    if deadline is not None and deadline.expired():
+        raise DeadlineExceededError(f"No time left to call {name}")
+    if not provider.breaker.allow():
+        raise CircuitOpenError(f"{name} circuit is open after repeated failures")
+
+    def attempt():
+        provider.count("calls")
+        max_wait, timeout = config["max_wait_s"], config["timeout_s"]
+        if deadline is not None:
+            max_wait, timeout = min(max_wait, deadline.remaining()), min(timeout, deadline.remaining())
+        if not provider.bucket.acquire(max_wait):
+            raise RateLimitedError(f"{name} rate limit reached")
+        if hedge and config.get("hedge_after_s"):
+            return _send_hedged(provider, request_fn, timeout)
+        return request_fn(timeout)
+
+    def before_sleep(retry_state):
+        provider.count("retries")
+
+    stop = stop_after_attempt(config["max_attempts"])
+    if deadline is not None:
+        # no retry is started, nor slept toward, past the caller's budget
+        stop = stop | stop_before_delay(deadline.remaining())
+
+    retrying = Retrying(
+        stop=stop,
+        wait=wait_random_exponential(multiplier=config["backoff_s"], max=config["backoff_max_s"]),
+        retry=retry_if_exception(_is_retryable_exception) | retry_if_result(_is_retryable_response),
+        before_sleep=before_sleep,
+        retry_error_callback=lambda retry_state: retry_state.outcome.result(),
+    )
+
+    try:
+        response = retrying(attempt)
+    except RateLimitedError:
+        provider.breaker.cancel_trial()  # we never reached the provider
+        raise
+    except Exception:
+        provider.count("failures")
+        provider.breaker.record_failure()
+        raise
+
+    if _is_retryable_response(response):
+        provider.count("failures")
+        provider.breaker.record_failure()
+    else:
+        provider.breaker.record_success()
+    return response
+
+
+def get_metrics():
+    """Limiter, breaker and call counters for every provider used so far"""
+    with _providers_lock:
+        providers = list(_providers.values())
+    return {
+        provider.name: {
+            **provider.bucket.snapshot(),
+            **provider.stats,
+            "circuit": provider.breaker.state,
+            "short_circuited": provider.breaker.short_circuited,
+        }
+        for provider in providers
+    }
+
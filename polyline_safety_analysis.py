@@ -1,22 +1,22 @@
 import polyline  # pip install polyline
-import psycopg2
-import math
+import numpy as np
 import utils
+import cities
+import crash_hours
+import edge_exposure
+import street_graph
+from constants import SafetyConfig, DeadlineConfig
+from deadline import has_time
+from safety_engine import (  # noqa: F401  crash queries and scoring, re-exported for callers
+    calculate_safety_score_logarithmic,
+    get_area_baselines,
+    get_area_crash_percentiles,
+    get_crashes_near_me,
+    get_db_connection,
+    safety_wrapper,
+)
 
 import os
-from dotenv import load_dotenv
-
-load_dotenv()
-
-def get_db_connection():
-    """Get database connection (Supabase or local fallback)"""
-    db_url = os.getenv("SUPABASE_DB_URL")
-    if db_url:
-        return psycopg2.connect(db_url)
-    else:
-        return psycopg2.connect(
-            host="localhost", database="runsafe_db", user="lpietrewicz", password=""
-        )
 
 def decode_route_polyline(encoded_polyline):
     """Decode Google's polyline to get all route coordinates"""
@@ -30,6 +30,101 @@ def decode_route_polyline(encoded_polyline):
         return []
 
 
+def decode_polyline_array(encoded_polyline, precision=5):
+    """Decode Google's polyline straight into an (n, 2) array of lat/lng, vectorized"""
+    if not encoded_polyline:
+        return np.empty((0, 2))
+
+    data = np.frombuffer(encoded_polyline.encode("ascii"), dtype=np.uint8).astype(np.int64) - 63
+    if data.min() < 0 or data.max() > 63:
+        raise ValueError("invalid polyline character")
+
+    # each value is a run of 5-bit chunks, the last chunk of a run has the 0x20 bit clear
+    ends = (data & 0x20) == 0
+    if not ends[-1]:
+        raise ValueError("truncated polyline")
+    starts = np.flatnonzero(np.concatenate(([True], ends[:-1])))
+    group = np.cumsum(np.concatenate(([0], ends[:-1])))
+    shift = 5 * (np.arange(len(data)) - starts[group])
+
+    values = np.add.reduceat((data & 0x1F) << shift, starts)
+    values = np.where(values & 1, ~(values >> 1), values >> 1)
+    if len(values) % 2:
+        raise ValueError("odd number of polyline values")
+
+    # values are deltas from the previous vertex
+    return np.cumsum(values.reshape(-1, 2), axis=0) / 10**precision
+
+
+def resample_route_by_distance(coords, spacing_m):
+    """
+    Resample a route at even arc-length spacing instead of by vertex index
+
+    Args:
+        coords: (n, 2) array of lat/lng vertices
+        spacing_m: Distance between samples in meters
+
+    Returns:
+        (samples, progress, vertex_index): (k, 2) lat/lng samples, percentage along
+        the route, and the index of the vertex each sample falls after
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    if len(coords) < 2:
+        return coords, np.zeros(len(coords)), np.zeros(len(coords), dtype=np.int64)
+
+    segment_m = utils.haversine_array(
+        coords[:-1, 0], coords[:-1, 1], coords[1:, 0], coords[1:, 1]
+    ) * 1000
+
+    # drop repeated vertices so cumulative distance is strictly increasing for interp
+    keep = np.concatenate(([True], segment_m > 0))
+    vertex_ids = np.flatnonzero(keep)
+    coords = coords[keep]
+    cumulative = np.concatenate(([0.0], np.cumsum(segment_m[segment_m > 0])))
+    total = cumulative[-1]
+
+    if total == 0:
+        return coords[:1], np.zeros(1), np.zeros(1, dtype=np.int64)
+
+    targets = np.arange(0, total, max(spacing_m, 1.0))
+    if total - targets[-1] > 1e-6:
+        targets = np.append(targets, total)  # always include the end of the route
+
+    samples = np.column_stack(
+        (np.interp(targets, cumulative, coords[:, 0]), np.interp(targets, cumulative, coords[:, 1]))
+    )
+    segment = np.clip(np.searchsorted(cumulative, targets, side="right") - 1, 0, len(coords) - 1)
+    return samples, targets / total * 100, vertex_ids[segment]
+
+
+def sample_route_points_by_distance(encoded_polyline, spacing_m=None, max_samples=5):
+    """Spatially uniform sample points along a route, in sample_route_points' dict shape"""
+    try:
+        coords = decode_polyline_array(encoded_polyline)
+    except ValueError as e:
+        print(f"Error decoding polyline: {e}")
+        return []
+    if len(coords) == 0:
+        return []
+
+    if spacing_m is None:
+        total_m = utils.haversine_array(
+            coords[:-1, 0], coords[:-1, 1], coords[1:, 0], coords[1:, 1]
+        ).sum() * 1000
+        spacing_m = total_m / max_samples if total_m > 0 else 1.0
+
+    samples, progress, vertex_index = resample_route_by_distance(coords, spacing_m)
+    return [
+        {
+            "lat": float(lat),
+            "lng": float(lng),
+            "route_index": int(index),
+            "route_progress": round(float(pct), 1),
+        }
+        for (lat, lng), pct, index in zip(samples, progress, vertex_index)
+    ]
+
+
 def sample_route_points(route_points, max_samples=10):
     """Sample points along route to avoid too many API calls"""
     if not route_points or len(route_points) <= max_samples:
@@ -50,7 +145,7 @@ def sample_route_points(route_points, max_samples=10):
         )
 
     # always include the last point
-    if route_points[-1] not in sampled_points:
+    if sampled_points[-1]["route_index"] != len(route_points) - 1:
         sampled_points.append(
             {
                 **route_points[-1],
@@ -62,34 +157,103 @@ def sample_route_points(route_points, max_samples=10):
     return sampled_points
 
 
-def analyze_route_safety_detailed(route):
+def analyze_route_safety_edges(route, when=None):
+    """Safety analysis summed over the route's street edges, None if no index is built"""
+    index = edge_exposure.get_edge_index()
+    graph = street_graph.get_street_graph()
+    if index is None or graph is None:
+        return None
+
+    try:
+        coords = decode_polyline_array(route.get("polyline", ""))
+    except ValueError as e:
+        print(f"Error decoding polyline: {e}")
+        return None
+    start = coords[:1]
+    if len(start) and not cities.city_at(float(start[0, 0]), float(start[0, 1])).is_default:
+        return None  # the edge index only covers the default city
+
+    dense_coords = None
+    if not route.get("edge_ids"):
+        dense_coords, _, _ = resample_route_by_distance(coords, spacing_m=10)
+
+    edge_ids = edge_exposure.route_edge_ids(graph, route, dense_coords)
+    score_function = calculate_safety_score_logarithmic
+    if when is not None:
+        # one time-of-day factor for the whole route, taken around where it starts
+        factor = crash_hours.time_factor(float(start[0, 0]), float(start[0, 1]), 1.0, when) if len(start) else 1.0
+
+        def score_function(crash_r, injury_r, fatality_r):
+            return calculate_safety_score_logarithmic(crash_r * factor, injury_r * factor, fatality_r * factor)
+
+    return edge_exposure.score_route_edges(index, graph, edge_ids, score_function=score_function)
+
+
+def analyze_route_safety_detailed(route, spacing_m=None, backend=None, deadline=None, when=None):
     """
     Comprehensive safety analysis using full route polyline
 
     Args:
         route: Route dict with 'polyline' field
-        get_crashes_function: Function to get crash data (like get_crashes_near_me)
+        spacing_m: Distance between safety samples; defaults to 5 even segments
+        backend: "radius" (crash queries per sample) or "edges" (per-edge index)
+        deadline: Optional Deadline; short budgets get fewer samples or a cheaper backend
+        when: Optional planned start time; scores then reflect crash risk at that hour and weekday
 
     Returns:
         Enhanced route with detailed safety analysis
     """
 
-    encoded_polyline = route.get("polyline", "")
-    route_points = decode_route_polyline(encoded_polyline)
+    backend = backend or os.getenv("SAFETY_BACKEND", SafetyConfig.BACKEND.value)
+    if backend == "edges":
+        edge_analysis = analyze_route_safety_edges(route, when=when)
+        if edge_analysis is not None:
+            return {**route, "safety_analysis": edge_analysis}
+
+    if not has_time(deadline, float(DeadlineConfig.SAFETY_MIN_S)):
+        edge_analysis = analyze_route_safety_edges(route, when=when)
+        if edge_analysis is not None:
+            deadline.degrade("edge_index_safety")
+            return {**route, "safety_analysis": edge_analysis}
+        deadline.degrade("skipped_safety")
+        return {
+            **route,
+            "safety_analysis": {
+                "overall_safety_score": None,
+                "dangerous_segments": [],
+                "skipped": True,
+            },
+        }
 
+    max_samples = 5
+    baselines = None
+    reduced = not has_time(deadline, float(DeadlineConfig.SAFETY_FULL_S))
+    if reduced:
+        # fewer points, and one neighbourhood baseline for the whole route
+        deadline.degrade("reduced_safety_samples")
+        deadline.degrade("shared_baselines")
+        max_samples, spacing_m = 2, None
 
-    sample_points = sample_route_points(route_points, max_samples=5)
+    encoded_polyline = route.get("polyline", "")
+    sample_points = sample_route_points_by_distance(
+        encoded_polyline, spacing_m=spacing_m, max_samples=max_samples
+    )
     segment_analyses = []  # analyze safety at each sample point
 
     for i, point in enumerate(sample_points):
         print(f"Processing point {i+1}/{len(sample_points)}: {point}")
 
+        if reduced and baselines is None:
+            baselines = get_area_baselines(point["lat"], point["lng"], radius_km=0.5)
+
         # get crash data near this point (smaller radius since we're checking multiple points)
         crashes_response = get_crashes_near_me(
             point["lat"],
             point["lng"],
             radius_km=0.5,  # WIP - smaller radius since we're sampling along route
             days_back=60,
+            baselines=baselines,
+            when=when,
         )
 
         print(f"Got crashes response for point {i+1}")
@@ -117,157 +281,17 @@ def analyze_route_safety_detailed(route):
 
 
 def generate_running_routes_with_polyline_safety(
-    start_lat, start_lng, target_distance_km, get_routes_function
+    start_lat, start_lng, target_distance_km, get_routes_function, deadline=None, when=None
 ):
     """
     Main function to generate routes with detailed polyline-based safety analysis
     """
-    routes = get_routes_function(start_lat, start_lng, target_distance_km)
+    routes = get_routes_function(start_lat, start_lng, target_distance_km, deadline=deadline)
     if not routes:
         return {}
 
     enhanced_routes = []
     for route in routes:
-        enhanced_route = analyze_route_safety_detailed(route)
+        enhanced_route = analyze_route_safety_detailed(route, deadline=deadline, when=when)
         enhanced_routes.append(enhanced_route)
     return enhanced_routes
-
-def get_area_crash_percentiles(lat: float, lng: float, radius_km: float = 1.0, attr="injuries"):
-    """Calculate crash percentiles for areas similar to the query location"""
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # create a grid of sample points around the area to get distribution
-        grid_size = 0.01
-        sample_points = []
-
-        sql = {
-            f"{attr}": f"COALESCE(SUM({attr}), 0)",
-            "crashes": "COUNT(*)",
-        }
-        
-        for lat_offset in [-2*grid_size, -grid_size, 0, grid_size, 2*grid_size]:
-            for lng_offset in [-2*grid_size, -grid_size, 0, grid_size, 2*grid_size]:
-                sample_lat = lat + lat_offset
-                sample_lng = lng + lng_offset
-                
-                lat_buffer = radius_km / 111.0
-                lng_buffer = radius_km / (111.0 * math.cos(math.radians(sample_lat)))
-                
-                cursor.execute(
-                    f"""
-                    SELECT 
-                        {sql[f"{attr}"]} as {attr}
-                    FROM crashes
-                    WHERE latitude BETWEEN %s AND %s
-                    AND longitude BETWEEN %s AND %s
-                    """,
-                    (sample_lat - lat_buffer, sample_lat + lat_buffer, 
-                     sample_lng - lng_buffer, sample_lng + lng_buffer),
-                )
-                
-                count = cursor.fetchone()[0]
-                sample_points.append(count)
-        
-        conn.close()
-        
-        sample_points.sort()
-        p50_index = int(0.5 * len(sample_points))
-        
-        return sample_points[p50_index]
-        
-    except Exception as e:
-        return {"error": f"Percentile calculation failed: {str(e)}"}
-
-
-def get_crashes_near_me(
-    lat: float, lng: float, radius_km: float = 0.5, days_back: int = 60
-):
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        # bounding box for query
-        lat_buffer = radius_km / 111.0
-        lng_buffer = radius_km / (111.0 * math.cos(math.radians(lat)))
-
-        cursor.execute(
-            """
-            SELECT collision_id, crash_date, latitude, longitude, injuries, fatalities
-            FROM crashes
-            WHERE latitude BETWEEN %s AND %s
-            AND longitude BETWEEN %s AND %s
-        """,
-            (lat - lat_buffer, lat + lat_buffer, lng - lng_buffer, lng + lng_buffer),
-        )
-
-        rough_crashes = cursor.fetchall()
-        conn.close()
-
-        # filter by exact distance
-        nearby_crashes = []
-        for crash in rough_crashes:
-            collision_id, crash_date, crash_lat, crash_lng, injuries, fatalities = crash
-            distance = utils.euc_distance(lat, lng, float(crash_lat), float(crash_lng))
-
-            if distance <= radius_km:
-                clean_crash = {
-                    "crash_id": collision_id,
-                    "date": str(crash_date),
-                    "distance_km": round(distance, 2),
-                    "location": {"lat": float(crash_lat), "lng": float(crash_lng)},
-                    "injuries": injuries or 0,
-                    "fatalities": fatalities or 0,
-                }
-                nearby_crashes.append(clean_crash)
-
-        # summary
-        safety_score, total_crashes, total_injuries, total_fatalities = safety_wrapper(lat, lng, radius_km, nearby_crashes)
-
-        return {
-            "search_location": {"lat": lat, "lng": lng},
-            "search_radius_km": radius_km,
-            "days_searched": days_back,
-            "summary": {
-                "total_crashes": total_crashes,
-                "total_injuries": total_injuries,
-                "total_fatalities": total_fatalities,
-            },
-            "safety": safety_score
-        }
-
-    except Exception as e:
-        return {"error": f"Database query failed: {str(e)}"}
-
-def calculate_safety_score_logarithmic(crash_ratio, injury_ratio, fatality_ratio):
-    """Calculate safety score using logarithmic scaling for extreme ratios"""
-    crash_penalty = min(30, max(0, 15 * math.log(max(crash_ratio, 0.1))))
-    injury_penalty = min(35, max(0, 20 * math.log(max(injury_ratio, 0.1))))
-    if fatality_ratio == 0:
-        fatality_penalty = 0
-    else:
-        fatality_penalty = min(50, max(0, 25 * math.log(max(fatality_ratio, 0.1))))
-    
-    safety_score = 100 - crash_penalty - injury_penalty - fatality_penalty
-    return max(0, min(100, safety_score))
-
-def safety_wrapper(lat, lng, radius_km, nearby_crashes):
-    total_crashes = len(nearby_crashes)
-    total_injuries = sum(crash["injuries"] for crash in nearby_crashes)
-    total_fatalities = sum(crash["fatalities"] for crash in nearby_crashes)
-
-
-    percentile50_crashes = get_area_crash_percentiles(lat, lng, radius_km=radius_km, attr="crashes")
-    percentile50_injuries = get_area_crash_percentiles(lat, lng, radius_km=radius_km, attr="injuries")
-    percentile50_fatalities = get_area_crash_percentiles(lat, lng, radius_km=radius_km, attr="fatalities")
-    try:
-        fatality_r = total_fatalities / percentile50_fatalities
-    except ZeroDivisionError:
-        fatality_r = total_fatalities
-
-    crash_r = total_crashes / percentile50_crashes
-    injury_r = total_injuries / percentile50_injuries
-
-    safety_score = calculate_safety_score_logarithmic(crash_r, injury_r, fatality_r)
-    return safety_score, total_crashes, total_injuries, total_fatalities
\ No newline at end of file
@@ -0,0 +1,184 @@
+import cProfile
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from constants import ProfilingConfig
+
+MODES = ("sampling", "deterministic")
+
+SAMPLE_RATE = float(ProfilingConfig.SAMPLE_RATE)
+# client-supplied ids name files, so anything else gets a generated one
+REQUEST_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+
+def requested_mode(header_value=None, query_value=None):
+    """
+    Profiling mode asked for by a request, or None (the common, free case)
+
+    Either the header or the query parameter can be "1"/"true" for the default
+    mode or name a mode; otherwise SAMPLE_RATE picks requests at random.
+    """
+    value = header_value or query_value
+    if value:
+        value = value.lower()
+        if value in MODES:
+            return value
+        if value in ("1", "true", "yes"):
+            return ProfilingConfig.DEFAULT_MODE.value
+        return None
+    if SAMPLE_RATE and random.random() < SAMPLE_RATE:
+        return ProfilingConfig.DEFAULT_MODE.value
+    return None
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """Samples one thread's Python stack on a timer, counting identical stacks"""
+
+    def __init__(self, thread_id, interval_s):
+        self.thread_id = thread_id
+        self.interval_s = interval_s
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval_s):
+            frame = sys._current_frames().get(self.thread_id)
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            if labels:
+                self.stacks[tuple(reversed(labels))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def folded(self):
+        """Stacks in the folded format flamegraph.pl and speedscope read"""
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common())
+
+    def top_functions(self, n):
+        """(function, self samples, total samples) for the n hottest functions"""
+        own, total = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for label in set(stack):
+                total[label] += count
+        return [(label, own[label], total[label]) for label, _ in own.most_common(n)]
+
+
+class ProfileSession:
+    """
+    Profiles the calling thread between start() and stop()
+
+    The sampler always runs, giving flame-graph stacks; deterministic mode also
+    runs cProfile for exact call counts at the price of more overhead.
+    """
+
+    def __init__(self, mode, request_id=None, output_dir=None):
+        self.mode = mode
+        if not (request_id and REQUEST_ID_PATTERN.fullmatch(request_id)):
+            request_id = uuid.uuid4().hex[:12]
+        self.request_id = request_id
+        self.output_dir = output_dir or ProfilingConfig.OUTPUT_DIR.value
+        self.sampler = StackSampler(
+            threading.get_ident(), float(ProfilingConfig.SAMPLE_INTERVAL_MS) / 1000
+        )
+        self.profiler = cProfile.Profile() if mode == "deterministic" else None
+        self.paths = {}
+
+    def start(self):
+        self.started = time.perf_counter()
+        self.sampler.start()
+        if self.profiler is not None:
+            self.profiler.enable()
+
+    def stop(self):
+        if self.profiler is not None:
+            self.profiler.disable()
+        self.sampler.stop()
+        self.elapsed_s = time.perf_counter() - self.started
+
+    def save(self):
+        """Write <request_id>.folded (and .prof in deterministic mode); returns the paths"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        folded_path = os.path.join(self.output_dir, f"{self.request_id}.folded")
+        with open(folded_path, "w") as f:
+            f.write(self.sampler.folded())
+        self.paths["folded"] = folded_path
+
+        if self.profiler is not None:
+            prof_path = os.path.join(self.output_dir, f"{self.request_id}.prof")
+            self.profiler.dump_stats(prof_path)
+            self.paths["prof"] = prof_path
+        return self.paths
+
+    def summary(self, n=None):
+        """Top functions, by cumulative time under cProfile, else by sampled self time"""
+        if n is None:
+            n = int(ProfilingConfig.TOP_N)
+        lines = [f"Profile {self.request_id} ({self.mode}, {self.elapsed_s * 1000:.0f}ms):"]
+        if self.profiler is not None:
+            stats = pstats.Stats(self.profiler).sort_stats(pstats.SortKey.CUMULATIVE)
+            for func in stats.fcn_list[:n]:
+                calls, _, own_s, cumulative_s, _ = stats.stats[func]
+                filename, line, name = func
+                lines.append(
+                    f"   {cumulative_s * 1000:8.1f}ms cum {own_s * 1000:8.1f}ms self "
+                    f"{calls:6d} calls  {name} ({os.path.basename(filename)}:{line})"
+                )
+        else:
+            samples = sum(self.sampler.stacks.values()) or 1
+            for label, own, total in self.sampler.top_functions(n):
+                lines.append(f"   {own / samples:6.1%} self {total / samples:6.1%} total  {label}")
+        return "\n".join(lines)
+
+
+class profile_request:
+    """
+    Context manager profiling a block when mode is set, and doing nothing otherwise
+
+        with profiling.profile_request(mode) as session:
+            ...
+        session.request_id  # None when not profiled
+    """
+
+    def __init__(self, mode, request_id=None):
+        self.session = ProfileSession(mode, request_id) if mode else None
+
+    @property
+    def request_id(self):
+        return self.session.request_id if self.session else None
+
+    def __enter__(self):
+        if self.session:
+            self.session.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.session:
+            self.session.stop()
+            try:
+                paths = self.session.save()
+                print(self.session.summary())
+                print(f"   Saved {', '.join(paths.values())}")
+            except OSError as e:
+                print(f"Could not save profile {self.session.request_id}: {e}")
+        return False
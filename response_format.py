@@ -0,0 +1,181 @@
+import gzip
+
+import numpy as np
+import orjson
+import ormsgpack
+import zstandard
+from fastapi import Response
+
+from constants import ResponseConfig
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+# accepted spellings of each format, for Accept headers and ?format=
+MEDIA_TYPES = {
+    "json": JSON,
+    JSON: JSON,
+    "msgpack": MSGPACK,
+    MSGPACK: MSGPACK,
+    "application/x-msgpack": MSGPACK,
+    "application/vnd.msgpack": MSGPACK,
+}
+
+_zstd = zstandard.ZstdCompressor(level=int(ResponseConfig.ZSTD_LEVEL))
+
+
+def _default(value):
+    # OpenAI completions are pydantic models; numpy scalars can come out of the indexes
+    if hasattr(value, "model_dump"):
+        return value.model_dump()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Type is not serializable: {type(value).__name__}")
+
+
+def to_builtin(value):
+    """Plain dicts and lists, so fields can be selected from model objects too"""
+    if isinstance(value, dict):
+        return value
+    if hasattr(value, "model_dump"):
+        return value.model_dump()
+    return value
+
+
+def parse_weighted(header):
+    """
+    Values of an Accept-style header with their q, best first
+
+    Values refused with q=0 are left out; equal weights keep the header's order.
+    """
+    weighted = []
+    for part in (header or "").split(","):
+        value, *params = [item.strip() for item in part.split(";")]
+        if not value:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, number = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(number)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            weighted.append((value.lower(), q))
+    return sorted(weighted, key=lambda item: -item[1])
+
+
+def negotiate(accept=None, format=None):
+    """Media type to answer with: ?format= wins, then the best weighted known type in Accept, else JSON"""
+    if format:
+        return MEDIA_TYPES.get(format.lower())
+    for value, _ in parse_weighted(accept):
+        media_type = MEDIA_TYPES.get(value)
+        if media_type:
+            return media_type
+    return JSON
+
+
+def parse_fields(fields):
+    """'a.b,c,-d.e' into include paths and exclude paths, as tuples of keys"""
+    include, exclude = [], []
+    for field in (fields or "").split(","):
+        field = field.strip()
+        if not field:
+            continue
+        target = exclude if field.startswith("-") else include
+        target.append(tuple(field.lstrip("-").split(".")))
+    return include, exclude
+
+
+def _project(value, paths):
+    if isinstance(value, list):
+        return [_project(item, paths) for item in value]
+    if not isinstance(value, dict):
+        return value
+    # a path that ends here takes the whole value, deeper paths recurse
+    selected = {}
+    for key in dict.fromkeys(path[0] for path in paths):
+        if key not in value:
+            continue
+        rest = [path[1:] for path in paths if path[0] == key]
+        selected[key] = value[key] if any(not r for r in rest) else _project(to_builtin(value[key]), rest)
+    return selected
+
+
+def _drop(value, paths):
+    if isinstance(value, list):
+        return [_drop(item, paths) for item in value]
+    if not isinstance(value, dict):
+        return value
+    dropped = {key for key, *rest in paths if not rest}
+    result = {}
+    for key, item in value.items():
+        if key in dropped:
+            continue
+        rest = [path[1:] for path in paths if path[0] == key and len(path) > 1]
+        result[key] = _drop(to_builtin(item), rest) if rest else item
+    return result
+
+
+def select_fields(data, fields):
+    """
+    Keep only the requested fields of a response
+
+    Args:
+        data: Response dict; lists apply the selection to each element
+        fields: Comma separated dotted paths ('route_options.direction'); paths
+            starting with '-' are removed instead. With only removals, everything
+            else is kept.
+
+    Returns:
+        The selected part of data
+    """
+    include, exclude = parse_fields(fields)
+    data = to_builtin(data)
+    if include:
+        data = _project(data, include)
+    if exclude:
+        data = _drop(data, exclude)
+    return data
+
+
+def encode(data, media_type=JSON):
+    if media_type == MSGPACK:
+        return ormsgpack.packb(data, default=_default, option=ormsgpack.OPT_SERIALIZE_NUMPY)
+    return orjson.dumps(data, default=_default, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+def compress(body, accept_encoding=None):
+    """(body, content encoding): zstd if the client takes it, else gzip, else as is"""
+    if len(body) < int(ResponseConfig.MIN_COMPRESS_BYTES):
+        return body, None
+    weights = dict(reversed(parse_weighted(accept_encoding)))
+    refused = {part.split(";")[0].strip().lower() for part in (accept_encoding or "").split(",")} - set(weights)
+    # a wildcard stands for any coding the client didn't name or refuse
+    wildcard = weights.get("*", 0)
+    candidates = {
+        coding: weights.get(coding, 0 if coding in refused else wildcard) for coding in ("zstd", "gzip")
+    }
+    # the client's preference decides, zstd on a tie
+    coding = max(candidates, key=lambda name: (candidates[name], name == "zstd"))
+    if not candidates[coding]:
+        return body, None
+    if coding == "zstd":
+        return _zstd.compress(body), "zstd"
+    return gzip.compress(body, compresslevel=int(ResponseConfig.GZIP_LEVEL)), "gzip"
+
+
+def render(request, data, fields=None, format=None, headers=None):
+    """Serialize data in the negotiated format and encoding; 406 for an unknown ?format="""
+    media_type = negotiate(request.headers.get("Accept"), format)
+    if media_type is None:
+        return Response(status_code=406, content=f"Unsupported format: {format}")
+    if fields:
+        data = select_fields(data, fields)
+
+    body, encoding = compress(encode(data, media_type), request.headers.get("Accept-Encoding"))
+    headers = {**(headers or {}), "Vary": "Accept, Accept-Encoding"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type=media_type, headers=headers)
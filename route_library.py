@@ -0,0 +1,210 @@
+import os
+import time
+import argparse
+from datetime import datetime, timezone
+
+import numpy as np
+import orjson
+import zstandard
+
+import constants as const
+import get_routes
+import polyline_safety_analysis as psa
+import utils
+from constants import RouteLibraryConfig
+
+LIBRARY_VERSION = 1
+
+_library = None  # lazily loaded index, shared by every request in this worker
+
+
+def grid_starts(lat_min, lat_max, lng_min, lng_max, step_km=1.0):
+    """Generate a regular grid of start points covering a bounding box"""
+    lat_step = step_km / 111.0
+    lng_step = step_km / (111.0 * np.cos(np.radians((lat_min + lat_max) / 2)))
+
+    starts = []
+    for lat in np.arange(lat_min, lat_max + 1e-9, lat_step):
+        for lng in np.arange(lng_min, lng_max + 1e-9, lng_step):
+            starts.append(
+                {"name": f"grid {lat:.4f},{lng:.4f}", "lat": float(lat), "lng": float(lng)}
+            )
+    return starts
+
+
+def build_route_library(
+    starts=const.popular_starts,
+    distances_km=const.standard_distances_km,
+    path=RouteLibraryConfig.PATH.value,
+):
+    """
+    Offline job: generate and safety-score routes for every start/distance pair
+
+    Args:
+        starts: List of dicts with 'name', 'lat', 'lng' keys
+        distances_km: Target distances to precompute for each start
+        path: Where to write the zstd-compressed index
+
+    Returns:
+        Number of entries written
+    """
+    entries = []
+    total = len(starts) * len(distances_km)
+
+    for start in starts:
+        for distance in distances_km:
+            print(f"[{len(entries) + 1}/{total}] {start['name']} - {distance}km")
+            try:
+                routes = psa.generate_running_routes_with_polyline_safety(
+                    start["lat"],
+                    start["lng"],
+                    distance,
+                    get_routes.optimized_route_finder,
+                )
+            except Exception as e:
+                print(f"   Skipping: {e}")
+                continue
+
+            if not routes:
+                print("   No routes found, skipping")
+                continue
+
+            entries.append(
+                {
+                    "name": start["name"],
+                    "lat": start["lat"],
+                    "lng": start["lng"],
+                    "distance_km": distance,
+                    "built_at": time.time(),
+                    "routes": routes,
+                }
+            )
+
+    library = {"version": LIBRARY_VERSION, "built_at": time.time(), "entries": entries}
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(zstandard.ZstdCompressor(level=19).compress(orjson.dumps(library)))
+    os.replace(tmp_path, path)  # atomic swap so serving workers never see a partial file
+
+    print(f"✓ Wrote {len(entries)} entries to {path}")
+    return len(entries)
+
+
+def load_route_library(path=RouteLibraryConfig.PATH.value):
+    """Load the index into memory along with coordinate arrays for nearest lookup"""
+    global _library
+
+    if not os.path.exists(path):
+        return None
+
+    with open(path, "rb") as f:
+        library = orjson.loads(zstandard.ZstdDecompressor().decompress(f.read()))
+
+    if library.get("version") != LIBRARY_VERSION:
+        print(f"Route library version {library.get('version')} not supported, ignoring")
+        # remembered without entries, so the file isn't read again until it is rewritten
+        _library = {"path": path, "mtime": os.path.getmtime(path), "entries": None}
+        return None
+
+    entries = library["entries"]
+    _library = {
+        "path": path,
+        "mtime": os.path.getmtime(path),
+        "entries": entries,
+        "lat": np.array([e["lat"] for e in entries], dtype=np.float64),
+        "lng": np.array([e["lng"] for e in entries], dtype=np.float64),
+        "distance_km": np.array([e["distance_km"] for e in entries], dtype=np.float64),
+        "built_at": np.array([e["built_at"] for e in entries], dtype=np.float64),
+    }
+    return _library
+
+
+def get_route_library(path=RouteLibraryConfig.PATH.value):
+    """Return the loaded index, reloading if the offline job rewrote the file; None if it was rejected"""
+    if _library is None or _library["path"] != path:
+        return load_route_library(path)
+    try:
+        if os.path.getmtime(path) != _library["mtime"]:
+            return load_route_library(path)
+    except OSError:
+        return None
+    return _library if _library["entries"] is not None else None
+
+
+def lookup_precomputed_routes(
+    start_lat,
+    start_lng,
+    target_distance_km,
+    tolerance_m=float(RouteLibraryConfig.START_TOLERANCE_METERS),
+    max_age_hours=float(RouteLibraryConfig.MAX_AGE_HOURS),
+    path=RouteLibraryConfig.PATH.value,
+):
+    """
+    Find the nearest precomputed start within tolerance for the requested distance
+
+    Returns:
+        Dict with 'routes' and 'freshness' metadata, or None on a miss
+    """
+    library = get_route_library(path)
+    if library is None or not library["entries"]:
+        return None
+
+    # stale entries are skipped here, so a fresh one a little further away still answers
+    usable = (
+        np.abs(library["distance_km"] - target_distance_km)
+        <= float(RouteLibraryConfig.DISTANCE_TOLERANCE_KM)
+    ) & (library["built_at"] >= time.time() - max_age_hours * 3600)
+    if not usable.any():
+        return None
+
+    offsets_m = utils.haversine_array(start_lat, start_lng, library["lat"], library["lng"]) * 1000
+    offsets_m = np.where(usable, offsets_m, np.inf)
+    best = int(np.argmin(offsets_m))
+
+    if offsets_m[best] > tolerance_m:
+        return None
+
+    entry = library["entries"][best]
+    age_hours = (time.time() - entry["built_at"]) / 3600
+
+    return {
+        "routes": entry["routes"],
+        "freshness": {
+            "source": "precomputed",
+            "start_name": entry["name"],
+            "start_location": {"lat": entry["lat"], "lng": entry["lng"]},
+            "start_offset_m": round(float(offsets_m[best]), 1),
+            "built_at": datetime.fromtimestamp(entry["built_at"], tz=timezone.utc).isoformat(),
+            "age_hours": round(age_hours, 1),
+        },
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the precomputed route library")
+    parser.add_argument("--starts", help="JSON file with a list of {name, lat, lng} starts")
+    parser.add_argument(
+        "--grid",
+        nargs=5,
+        type=float,
+        metavar=("LAT_MIN", "LAT_MAX", "LNG_MIN", "LNG_MAX", "STEP_KM"),
+        help="Use a regular grid of starts instead of the popular list",
+    )
+    parser.add_argument("--distances", nargs="+", type=float, default=const.standard_distances_km)
+    parser.add_argument("--path", default=RouteLibraryConfig.PATH.value)
+    args = parser.parse_args()
+
+    if args.grid:
+        starts = grid_starts(*args.grid)
+    elif args.starts:
+        with open(args.starts, "rb") as f:
+            starts = orjson.loads(f.read())
+    else:
+        starts = const.popular_starts
+
+    print("=" * 60)
+    print("ROUTE LIBRARY BUILD")
+    print("=" * 60)
+    build_route_library(starts, args.distances, args.path)
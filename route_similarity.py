@@ -0,0 +1,76 @@
+import math
+
+import numpy as np
+
+import polyline_safety_analysis as psa
+import utils
+from constants import RouteDedupeConfig
+
+
+def downsample_route(encoded_polyline, num_points=None):
+    """Route resampled to a fixed number of evenly spaced points, in local meters"""
+    if num_points is None:
+        num_points = int(RouteDedupeConfig.SAMPLES)
+    try:
+        coords = psa.decode_polyline_array(encoded_polyline)
+    except ValueError:
+        return None
+    if len(coords) < 2:
+        return None
+
+    total_m = utils.haversine_array(
+        coords[:-1, 0], coords[:-1, 1], coords[1:, 0], coords[1:, 1]
+    ).sum() * 1000
+    samples, _, _ = psa.resample_route_by_distance(coords, max(total_m / (num_points - 1), 1.0))
+
+    # pad short routes by repeating the end so every route stacks to the same shape
+    if len(samples) < num_points:
+        samples = np.vstack((samples, np.repeat(samples[-1:], num_points - len(samples), axis=0)))
+    samples = samples[:num_points]
+
+    lat0 = math.radians(coords[0, 0])
+    return np.column_stack((samples[:, 1] * 111320 * math.cos(lat0), samples[:, 0] * 110540))
+
+
+def pairwise_hausdorff(routes_m):
+    """Symmetric Hausdorff distance in meters between every pair of (R, n, 2) routes"""
+    diff = routes_m[:, None, :, None, :] - routes_m[None, :, None, :, :]
+    dist = np.sqrt((diff**2).sum(axis=-1))  # (R, R, n, n)
+    forward = dist.min(axis=3).max(axis=2)
+    return np.maximum(forward, forward.T)
+
+
+def prune_near_duplicates(routes, threshold_m=None):
+    """
+    Drop routes that retrace an earlier, better-ranked route
+
+    Args:
+        routes: Route dicts with 'polyline', best first
+        threshold_m: Routes closer than this (Hausdorff) count as duplicates
+
+    Returns:
+        The distinct routes, original order preserved
+    """
+    if threshold_m is None:
+        threshold_m = float(RouteDedupeConfig.HAUSDORFF_METERS)
+
+    sampled = [downsample_route(route.get("polyline", "")) for route in routes]
+    comparable = [i for i, s in enumerate(sampled) if s is not None]
+    if len(comparable) < 2:
+        return routes
+
+    # all routes share a projection origin so their distances are comparable
+    origin = np.array(sampled[comparable[0]][0])
+    distances = pairwise_hausdorff(np.stack([sampled[i] - origin for i in comparable]))
+
+    kept, kept_positions = [], []
+    position = {route_index: p for p, route_index in enumerate(comparable)}
+    for i, route in enumerate(routes):
+        if i in position:
+            p = position[i]
+            if any(distances[p, q] < threshold_m for q in kept_positions):
+                print(f"   Dropping {route.get('direction')} - near duplicate of a better route")
+                continue
+            kept_positions.append(p)
+        kept.append(route)
+    return kept
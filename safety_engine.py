@@ -0,0 +1,323 @@
+import math
+import os
+
+import numpy as np
+import psycopg2
+from dotenv import load_dotenv
+
+import cache
+import cities
+import crash_cells
+import crash_hours
+import crash_snapshot
+import spatial_key
+import utils
+from constants import SafetyConfig
+
+load_dotenv()
+
+ATTRS = ("crashes", "injuries", "fatalities")
+
+# neighbourhood the baselines are drawn from: 5x5 sample points, 0.01 degrees apart
+BASELINE_GRID_SIZE = 0.01
+BASELINE_OFFSETS = [-2 * BASELINE_GRID_SIZE, -BASELINE_GRID_SIZE, 0, BASELINE_GRID_SIZE, 2 * BASELINE_GRID_SIZE]
+
+
+def get_db_connection():
+    """Get database connection (Supabase or local fallback)"""
+    db_url = os.getenv("SUPABASE_DB_URL")
+    if db_url:
+        return psycopg2.connect(db_url)
+    else:
+        # Fallback to local
+        return psycopg2.connect(
+            host="localhost", database="runsafe_db", user="lpietrewicz", password=""
+        )
+
+
+def bounding_box(lat, lng, radius_km):
+    """(lat_min, lat_max, lng_min, lng_max) around a point"""
+    lat_buffer = radius_km / 111.0
+    lng_buffer = radius_km / (111.0 * math.cos(math.radians(lat)))
+    return (lat - lat_buffer, lat + lat_buffer, lng - lng_buffer, lng + lng_buffer)
+
+
+def box_city(box):
+    """City a query box belongs to, by its center"""
+    lat_min, lat_max, lng_min, lng_max = box
+    return cities.city_at((lat_min + lat_max) / 2, (lng_min + lng_max) / 2)
+
+
+class CrashDataBackend:
+    """
+    Where crash counts come from
+
+    Every backend must give the same answers; test_safety_backends.py checks
+    that on a shared fixture.
+    """
+
+    name = None
+
+    def available(self):
+        return True
+
+    def box_totals(self, attr, boxes):
+        """COUNT(*) for attr 'crashes', else SUM(attr), inside each lat/lng box"""
+        raise NotImplementedError
+
+    def radius_totals(self, lat, lng, radius_km):
+        """(crashes, injuries, fatalities) within radius_km (utils.euc_distance) of a point"""
+        raise NotImplementedError
+
+
+class PostgresBackend(CrashDataBackend):
+    """Aggregates raw crash rows on every query, from the table of the city they fall in"""
+
+    name = "postgres"
+
+    def __init__(self, connect=None):
+        self.connect = connect or get_db_connection
+
+    def available(self):
+        try:
+            self.connect().close()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _where(self, cursor, box):
+        city = box_city(box)
+        # the Hilbert keys span the default city's bounds only
+        where, params = spatial_key.box_where(cursor, box, use_keys=None if city.is_default else False)
+        return city.table, where, params
+
+    def _box_total(self, cursor, attr, box):
+        table, where, params = self._where(cursor, box)
+        aggregate = "COUNT(*)" if attr == "crashes" else f"COALESCE(SUM({attr}), 0)"
+        cursor.execute(f"SELECT {aggregate} FROM {table} WHERE {where}", params)
+        return cursor.fetchone()[0]
+
+    def _radius_totals(self, cursor, lat, lng, radius_km, box):
+        table, where, params = self._where(cursor, box)
+        cursor.execute(
+            f"SELECT latitude, longitude, injuries, fatalities FROM {table} WHERE {where}",
+            params,
+        )
+        totals = [0, 0, 0]
+        for crash_lat, crash_lng, injuries, fatalities in cursor.fetchall():
+            if utils.euc_distance(lat, lng, float(crash_lat), float(crash_lng)) <= radius_km:
+                totals[0] += 1
+                totals[1] += injuries or 0
+                totals[2] += fatalities or 0
+        return tuple(totals)
+
+    def box_totals(self, attr, boxes):
+        if attr not in ATTRS:
+            raise ValueError(f"Unknown crash attribute: {attr}")
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            return [int(self._box_total(cursor, attr, box)) for box in boxes]
+        finally:
+            conn.close()
+
+    def radius_totals(self, lat, lng, radius_km):
+        conn = self.connect()
+        try:
+            return self._radius_totals(conn.cursor(), lat, lng, radius_km, bounding_box(lat, lng, radius_km))
+        finally:
+            conn.close()
+
+
+class CellsBackend(PostgresBackend):
+    """Sums whole cells from crash_cells, raw rows only along the region's edge"""
+
+    name = "cells"
+
+    def _cells_available(self, cursor, box):
+        # crash_cells aggregates the default city's table; other cities use raw rows
+        return box_city(box).is_default and crash_cells.cells_available(cursor)
+
+    def _box_total(self, cursor, attr, box):
+        if not self._cells_available(cursor, box):
+            return super()._box_total(cursor, attr, box)
+        return crash_cells.aggregate_box(cursor, attr, *box)
+
+    def _radius_totals(self, cursor, lat, lng, radius_km, box):
+        if not self._cells_available(cursor, box):
+            return super()._radius_totals(cursor, lat, lng, radius_km, box)
+        return crash_cells.radius_totals(cursor, lat, lng, radius_km, box)
+
+
+class SnapshotBackend(CrashDataBackend):
+    """
+    Answers from the memory-mapped crash snapshot, no database round trips
+
+    Without an explicit snapshot each query uses the shard of the city it
+    falls in, and one with no exported shard goes to the database instead.
+    """
+
+    name = "snapshot"
+
+    def __init__(self, snapshot=None):
+        self._snapshot = snapshot
+
+    @property
+    def snapshot(self):
+        return self._snapshot or crash_snapshot.get_snapshot()
+
+    def available(self):
+        return self.snapshot is not None
+
+    def snapshot_at(self, lat, lng):
+        return self._snapshot or cities.snapshot_at(lat, lng)
+
+    def box_totals(self, attr, boxes):
+        if attr not in ATTRS:
+            raise ValueError(f"Unknown crash attribute: {attr}")
+        if not boxes:
+            return []
+        # baseline boxes all sit around one point, so they share a city
+        snapshot = self._snapshot or cities.get_shard(box_city(boxes[0]))
+        if snapshot is None:
+            return CellsBackend().box_totals(attr, boxes)
+        return [snapshot.aggregate_box(attr, *box) for box in boxes]
+
+    def radius_totals(self, lat, lng, radius_km):
+        snapshot = self.snapshot_at(lat, lng)
+        if snapshot is None:
+            return CellsBackend().radius_totals(lat, lng, radius_km)
+        idx = snapshot.box_indices(*bounding_box(lat, lng, radius_km))
+        near = idx[utils.euc_distance_array(lat, lng, snapshot.lat[idx], snapshot.lng[idx]) <= radius_km]
+        return (
+            int(len(near)),
+            int(snapshot.injuries[near].sum(dtype=np.int64)),
+            int(snapshot.fatalities[near].sum(dtype=np.int64)),
+        )
+
+
+BACKENDS = {
+    PostgresBackend.name: PostgresBackend,
+    CellsBackend.name: CellsBackend,
+    SnapshotBackend.name: SnapshotBackend,
+}
+
+
+def get_backend(name=None):
+    """Configured crash data backend; 'auto' prefers the snapshot, then crash_cells"""
+    if isinstance(name, CrashDataBackend):
+        return name
+    name = name or os.getenv("SAFETY_DATA_BACKEND", SafetyConfig.DATA_BACKEND.value)
+    if name == "auto":
+        snapshot = SnapshotBackend()
+        # cells falls back to raw rows by itself when crash_cells hasn't been built
+        return snapshot if snapshot.available() else CellsBackend()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown safety data backend: {name}")
+    return BACKENDS[name]()
+
+
+@cache.cached("safety", versioned=True)
+def get_area_crash_percentiles(lat: float, lng: float, radius_km: float = 1.0, attr="injuries", backend=None):
+    """Calculate crash percentiles for areas similar to the query location"""
+    try:
+        # create a grid of sample points around the area to get distribution
+        boxes = [
+            bounding_box(lat + lat_offset, lng + lng_offset, radius_km)
+            for lat_offset in BASELINE_OFFSETS
+            for lng_offset in BASELINE_OFFSETS
+        ]
+        sample_points = sorted(get_backend(backend).box_totals(attr, boxes))
+        p50_index = int(0.5 * len(sample_points))
+
+        return sample_points[p50_index]
+
+    except Exception as e:
+        return {"error": f"Percentile calculation failed: {str(e)}"}
+
+
+def get_area_baselines(lat, lng, radius_km, backend=None):
+    """p50 crashes, injuries and fatalities for the neighbourhood around a point"""
+    return tuple(
+        get_area_crash_percentiles(lat, lng, radius_km=radius_km, attr=attr, backend=backend)
+        for attr in ATTRS
+    )
+
+
+def get_crashes_near_me(
+    lat: float, lng: float, radius_km: float = 0.5, days_back: int = 60, baselines=None, backend=None, when=None
+):
+    try:
+        totals = get_backend(backend).radius_totals(lat, lng, radius_km)
+
+        # summary
+        safety_score, total_crashes, total_injuries, total_fatalities = safety_wrapper(
+            lat, lng, radius_km, [], baselines=baselines, totals=totals, backend=backend, when=when
+        )
+
+        return {
+            "search_location": {"lat": lat, "lng": lng},
+            "search_radius_km": radius_km,
+            "days_searched": days_back,
+            "summary": {
+                "total_crashes": total_crashes,
+                "total_injuries": total_injuries,
+                "total_fatalities": total_fatalities,
+            },
+            "safety": safety_score
+        }
+
+    except Exception as e:
+        return {"error": f"Database query failed: {str(e)}"}
+
+
+def calculate_safety_score_logarithmic(crash_ratio, injury_ratio, fatality_ratio):
+    """Calculate safety score using logarithmic scaling for extreme ratios"""
+    crash_penalty = min(30, max(0, 15 * math.log(max(crash_ratio, 0.1))))
+    injury_penalty = min(35, max(0, 20 * math.log(max(injury_ratio, 0.1))))
+    if fatality_ratio == 0:
+        fatality_penalty = 0
+    else:
+        fatality_penalty = min(50, max(0, 25 * math.log(max(fatality_ratio, 0.1))))
+
+    safety_score = 100 - crash_penalty - injury_penalty - fatality_penalty
+    return max(0, min(100, safety_score))
+
+
+def safety_score_array(crash_ratio, injury_ratio, fatality_ratio):
+    """calculate_safety_score_logarithmic over NumPy arrays of ratios"""
+    crash_penalty = np.clip(15 * np.log(np.maximum(crash_ratio, 0.1)), 0, 30)
+    injury_penalty = np.clip(20 * np.log(np.maximum(injury_ratio, 0.1)), 0, 35)
+    fatality_penalty = np.where(
+        fatality_ratio == 0, 0, np.clip(25 * np.log(np.maximum(fatality_ratio, 0.1)), 0, 50)
+    )
+    return np.clip(100 - crash_penalty - injury_penalty - fatality_penalty, 0, 100)
+
+
+def safety_wrapper(lat, lng, radius_km, nearby_crashes, baselines=None, totals=None, backend=None, when=None):
+    if totals is None:
+        totals = (
+            len(nearby_crashes),
+            sum(crash["injuries"] for crash in nearby_crashes),
+            sum(crash["fatalities"] for crash in nearby_crashes),
+        )
+    total_crashes, total_injuries, total_fatalities = totals
+
+    if baselines is None:
+        baselines = get_area_baselines(lat, lng, radius_km, backend=backend)
+    percentile50_crashes, percentile50_injuries, percentile50_fatalities = baselines
+    try:
+        fatality_r = total_fatalities / percentile50_fatalities
+    except ZeroDivisionError:
+        fatality_r = total_fatalities
+
+    crash_r = total_crashes / percentile50_crashes
+    injury_r = total_injuries / percentile50_injuries
+
+    if when is not None:
+        # planned start time: scale by how this area's crash rate at that hour and weekday compares to its average
+        factor = crash_hours.time_factor(lat, lng, radius_km, when)
+        crash_r, injury_r, fatality_r = crash_r * factor, injury_r * factor, fatality_r * factor
+
+    safety_score = calculate_safety_score_logarithmic(crash_r, injury_r, fatality_r)
+    return safety_score, total_crashes, total_injuries, total_fatalities
@@ -0,0 +1,307 @@
+import argparse
+import time
+
+import numpy as np
+
+from constants import SpatialKeyConfig
+
+# Crashes carry a Hilbert curve key (crashes.hkey). Points close on the map get
+# close keys, so a box query becomes a handful of key ranges on one B-tree index
+# instead of a scan of a whole latitude band.
+ORDER = int(SpatialKeyConfig.ORDER)
+SIDE = 1 << ORDER
+LAT_MIN = float(SpatialKeyConfig.LAT_MIN)
+LAT_MAX = float(SpatialKeyConfig.LAT_MAX)
+LNG_MIN = float(SpatialKeyConfig.LNG_MIN)
+LNG_MAX = float(SpatialKeyConfig.LNG_MAX)
+
+_key_column_exists = None
+
+
+def _to_cells(lat, lng):
+    x = np.floor((np.asarray(lng, dtype=np.float64) - LNG_MIN) / (LNG_MAX - LNG_MIN) * SIDE)
+    y = np.floor((np.asarray(lat, dtype=np.float64) - LAT_MIN) / (LAT_MAX - LAT_MIN) * SIDE)
+    return (
+        np.clip(x, 0, SIDE - 1).astype(np.int64),
+        np.clip(y, 0, SIDE - 1).astype(np.int64),
+    )
+
+
+def _cells_to_keys(x, y):
+    x = np.array(x, dtype=np.int64, copy=True)
+    y = np.array(y, dtype=np.int64, copy=True)
+    keys = np.zeros(np.shape(x), dtype=np.int64)
+    s = SIDE >> 1
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        keys += s * s * ((3 * rx.astype(np.int64)) ^ ry.astype(np.int64))
+        # rotate the quadrant so the curve stays continuous
+        flip = ~ry & rx
+        x = np.where(flip, SIDE - 1 - x, x)
+        y = np.where(flip, SIDE - 1 - y, y)
+        x, y = np.where(~ry, y, x), np.where(~ry, x, y)
+        s >>= 1
+    return keys
+
+
+def _cell_key(x, y):
+    """Scalar _cells_to_keys, much faster than NumPy for single cells"""
+    key = 0
+    s = SIDE >> 1
+    while s > 0:
+        rx = 1 if x & s else 0
+        ry = 1 if y & s else 0
+        key += s * s * ((3 * rx) ^ ry)
+        if not ry:
+            if rx:
+                x, y = SIDE - 1 - x, SIDE - 1 - y
+            x, y = y, x
+        s >>= 1
+    return key
+
+
+def hilbert_keys(lat, lng):
+    """Hilbert keys for arrays (or scalars) of coordinates"""
+    return _cells_to_keys(*_to_cells(lat, lng))
+
+
+def hilbert_key(lat, lng):
+    x, y = _to_cells(lat, lng)
+    return _cell_key(int(x), int(y))
+
+
+def box_to_ranges(lat_min, lat_max, lng_min, lng_max, max_ranges=None):
+    """
+    Cover a lat/lng box with inclusive Hilbert key ranges
+
+    Quadtree nodes are contiguous runs of the curve, so the box is refined level
+    by level: nodes inside it become whole ranges, nodes outside are dropped, and
+    partly covered nodes are split until there would be more than max_ranges of
+    them. The ranges can cover some points outside the box, never miss one inside.
+
+    Returns:
+        Sorted, merged list of (first_key, last_key)
+    """
+    if max_ranges is None:
+        max_ranges = int(SpatialKeyConfig.MAX_RANGES)
+    (x_lo, x_hi), (y_lo, y_hi) = (
+        (int(v) for v in pair) for pair in _to_cells([lat_min, lat_max], [lng_min, lng_max])
+    )
+
+    ranges = []
+    partial = [(0, 0, ORDER)]  # (x0, y0, log2 of the node's side)
+    while partial:
+        refined = []
+        for x0, y0, level in (child for node in partial for child in _children(*node)):
+            size = 1 << level
+            x1, y1 = x0 + size - 1, y0 + size - 1
+            if x0 > x_hi or x1 < x_lo or y0 > y_hi or y1 < y_lo:
+                continue
+            if level == 0 or (x0 >= x_lo and x1 <= x_hi and y0 >= y_lo and y1 <= y_hi):
+                ranges.append(_node_range(x0, y0, level))
+            else:
+                refined.append((x0, y0, level))
+
+        if len(ranges) + len(refined) > max_ranges:
+            # out of budget: keep the partly covered nodes whole
+            ranges.extend(_node_range(*node) for node in refined)
+            break
+        partial = refined
+
+    return _merge(ranges)
+
+
+def _children(x0, y0, level):
+    half = 1 << (level - 1)
+    return [(x0 + dx, y0 + dy, level - 1) for dx in (0, half) for dy in (0, half)]
+
+
+def _node_range(x0, y0, level):
+    span = 1 << (2 * level)
+    first = _cell_key(x0, y0) // span * span
+    return first, first + span - 1
+
+
+def _merge(ranges):
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+        else:
+            merged.append((first, last))
+    return merged
+
+
+def key_column_available(cursor):
+    """True once migrate() has added crashes.hkey"""
+    global _key_column_exists
+    if not _key_column_exists:
+        # only a positive answer is kept, so a worker started before migrate() picks the keys up
+        cursor.execute(
+            """
+            SELECT EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_name = 'crashes' AND column_name = 'hkey'
+            )
+            """
+        )
+        _key_column_exists = bool(cursor.fetchone()[0])
+    return _key_column_exists
+
+
+def box_where(cursor, box, use_keys=None):
+    """
+    WHERE clause and params selecting the rows of a table inside a box
+
+    Adds the Hilbert key ranges when the table has them; the exact latitude and
+    longitude bounds are always kept, so the result is the same either way.
+    """
+    sql = "latitude BETWEEN %s AND %s AND longitude BETWEEN %s AND %s"
+    params = list(box)
+    if use_keys is None:
+        use_keys = key_column_available(cursor)
+    if not use_keys:
+        return sql, params
+
+    ranges = box_to_ranges(*box)
+    sql = "(" + " OR ".join(["hkey BETWEEN %s AND %s"] * len(ranges)) + ") AND " + sql
+    return sql, [key for key_range in ranges for key in key_range] + params
+
+
+def migrate(conn, batch_size=50000):
+    """
+    Add and fill the hkey column and its index; safe to run any number of times
+
+    Returns:
+        Number of rows that were given a key
+    """
+    cursor = conn.cursor()
+    cursor.execute("ALTER TABLE crashes ADD COLUMN IF NOT EXISTS hkey BIGINT")
+    conn.commit()
+
+    filled = 0
+    while True:
+        cursor.execute(
+            """
+            SELECT collision_id, latitude, longitude FROM crashes
+            WHERE hkey IS NULL AND latitude IS NOT NULL AND longitude IS NOT NULL
+            LIMIT %s
+            """,
+            (batch_size,),
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        ids = [row[0] for row in rows]
+        keys = hilbert_keys([float(row[1]) for row in rows], [float(row[2]) for row in rows])
+        cursor.execute(
+            """
+            UPDATE crashes SET hkey = batch.hkey
+            FROM unnest(%s::bigint[], %s::bigint[]) AS batch(collision_id, hkey)
+            WHERE crashes.collision_id = batch.collision_id
+            """,
+            (ids, keys.tolist()),
+        )
+        conn.commit()
+        filled += len(rows)
+        print(f"   Keyed {filled} crashes")
+
+    cursor.execute("CREATE INDEX IF NOT EXISTS crashes_hkey_idx ON crashes (hkey)")
+    conn.commit()
+    return filled
+
+
+def benchmark(conn, num_rows=1_000_000, num_queries=200, radius_km=0.5, seed=0):
+    """
+    Time box queries with and without the key ranges on a synthetic table
+
+    Builds crashes_bench with a lat/lng B-tree index on each column (what the
+    plain BETWEEN filter can use) and an hkey index, then runs the same random
+    boxes both ways. Returns the timings in milliseconds.
+    """
+    rng = np.random.default_rng(seed)
+    lat = rng.uniform(LAT_MIN + 0.05, LAT_MAX - 0.05, num_rows)
+    lng = rng.uniform(LNG_MIN + 0.05, LNG_MAX - 0.05, num_rows)
+    keys = hilbert_keys(lat, lng)
+
+    cursor = conn.cursor()
+    cursor.execute("DROP TABLE IF EXISTS crashes_bench")
+    cursor.execute(
+        """
+        CREATE TABLE crashes_bench (
+            id BIGINT PRIMARY KEY, latitude DOUBLE PRECISION, longitude DOUBLE PRECISION,
+            injuries INTEGER, hkey BIGINT
+        )
+        """
+    )
+    print(f"Loading {num_rows} synthetic crashes...")
+    for start in range(0, num_rows, 100_000):
+        stop = min(start + 100_000, num_rows)
+        cursor.execute(
+            """
+            INSERT INTO crashes_bench
+            SELECT * FROM unnest(%s::bigint[], %s::float8[], %s::float8[], %s::int[], %s::bigint[])
+            """,
+            (
+                list(range(start, stop)),
+                lat[start:stop].tolist(),
+                lng[start:stop].tolist(),
+                rng.integers(0, 3, stop - start).tolist(),
+                keys[start:stop].tolist(),
+            ),
+        )
+    cursor.execute("CREATE INDEX ON crashes_bench (latitude)")
+    cursor.execute("CREATE INDEX ON crashes_bench (longitude)")
+    cursor.execute("CREATE INDEX ON crashes_bench (hkey)")
+    cursor.execute("ANALYZE crashes_bench")
+    conn.commit()
+
+    centers = np.column_stack(
+        (rng.uniform(LAT_MIN + 0.1, LAT_MAX - 0.1, num_queries), rng.uniform(LNG_MIN + 0.1, LNG_MAX - 0.1, num_queries))
+    )
+    timings = {}
+    for mode in ("lat_lng_between", "hilbert_ranges"):
+        elapsed, counts = [], []
+        for c_lat, c_lng in centers:
+            lat_buffer = radius_km / 111.0
+            lng_buffer = radius_km / (111.0 * np.cos(np.radians(c_lat)))
+            box = (c_lat - lat_buffer, c_lat + lat_buffer, c_lng - lng_buffer, c_lng + lng_buffer)
+            if mode == "hilbert_ranges":
+                where, params = box_where(cursor, box, use_keys=True)
+            else:
+                where, params = "latitude BETWEEN %s AND %s AND longitude BETWEEN %s AND %s", list(box)
+
+            started = time.perf_counter()
+            cursor.execute(f"SELECT COUNT(*), COALESCE(SUM(injuries), 0) FROM crashes_bench WHERE {where}", params)
+            counts.append(cursor.fetchone())
+            elapsed.append((time.perf_counter() - started) * 1000)
+        timings[mode] = {
+            "p50_ms": round(float(np.percentile(elapsed, 50)), 2),
+            "p95_ms": round(float(np.percentile(elapsed, 95)), 2),
+            "results": counts,
+        }
+
+    if timings["lat_lng_between"].pop("results") != timings["hilbert_ranges"].pop("results"):
+        print("WARNING: key-range queries returned different rows")
+    cursor.execute("DROP TABLE crashes_bench")
+    conn.commit()
+    return timings
+
+
+if __name__ == "__main__":
+    import safety_engine
+
+    parser = argparse.ArgumentParser(description="Hilbert key column for crash box queries")
+    parser.add_argument("--migrate", action="store_true", help="add, fill and index crashes.hkey")
+    parser.add_argument("--benchmark", action="store_true", help="compare query plans on synthetic rows")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    conn = safety_engine.get_db_connection()
+    if args.migrate:
+        print(f"✓ Keyed {migrate(conn)} crashes, index crashes_hkey_idx in place")
+    if args.benchmark:
+        for mode, stats in benchmark(conn, num_rows=args.rows).items():
+            print(f"   {mode:>16}: p50 {stats['p50_ms']}ms, p95 {stats['p95_ms']}ms")
+    conn.close()
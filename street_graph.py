@@ -0,0 +1,252 @@
+import math
+import os
+import sys
+
+import numpy as np
+import orjson
+import polyline
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+import utils
+from constants import StreetGraphConfig
+
+_graph = None  # loaded once per worker
+
+
+class StreetGraph:
+    """Pedestrian street graph held as a CSR adjacency matrix of edge lengths in meters"""
+
+    def __init__(self, node_lat, node_lng, edge_u, edge_v, edge_length_m=None):
+        self.node_lat = np.asarray(node_lat, dtype=np.float64)
+        self.node_lng = np.asarray(node_lng, dtype=np.float64)
+        edge_u = np.asarray(edge_u, dtype=np.int64)
+        edge_v = np.asarray(edge_v, dtype=np.int64)
+
+        if edge_length_m is None:
+            edge_length_m = utils.haversine_array(
+                self.node_lat[edge_u], self.node_lng[edge_u],
+                self.node_lat[edge_v], self.node_lng[edge_v],
+            ) * 1000
+        edge_length_m = np.asarray(edge_length_m, dtype=np.float64)
+
+        # undirected edges keyed (min, max); keep the shortest of any parallel edges
+        lo, hi = np.minimum(edge_u, edge_v), np.maximum(edge_u, edge_v)
+        valid = lo != hi
+        lo, hi, edge_length_m = lo[valid], hi[valid], np.maximum(edge_length_m[valid], 0.01)
+        order = np.lexsort((edge_length_m, hi, lo))
+        lo, hi, edge_length_m = lo[order], hi[order], edge_length_m[order]
+        first = np.concatenate(([True], (lo[1:] != lo[:-1]) | (hi[1:] != hi[:-1])))
+
+        self.edge_u = lo[first]
+        self.edge_v = hi[first]
+        self.edge_length_m = edge_length_m[first]
+
+        # both directions, with the undirected edge id carried alongside for lookups
+        n = len(self.node_lat)
+        edge_ids = np.arange(len(self.edge_u))
+        rows = np.concatenate((self.edge_u, self.edge_v))
+        cols = np.concatenate((self.edge_v, self.edge_u))
+        order = np.lexsort((cols, rows))
+        indptr = np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=n))))
+        self.csr = csr_matrix(
+            (np.concatenate((self.edge_length_m, self.edge_length_m))[order], cols[order], indptr),
+            shape=(n, n),
+        )
+        self.csr_edge_id = np.concatenate((edge_ids, edge_ids))[order]
+
+        self._tree = None  # (source, limit_m, distances, predecessors) of the last search
+
+    @property
+    def num_nodes(self):
+        return len(self.node_lat)
+
+    @property
+    def num_edges(self):
+        return len(self.edge_u)
+
+    def nearest_node(self, lat, lng):
+        """Closest graph node and its distance in meters"""
+        # equirectangular distance is plenty to rank candidates at city scale
+        dx = (self.node_lng - lng) * math.cos(math.radians(lat))
+        dy = self.node_lat - lat
+        node = int(np.argmin(dx * dx + dy * dy))
+        return node, float(
+            utils.haversine_array(lat, lng, self.node_lat[node], self.node_lng[node]) * 1000
+        )
+
+    def shortest_path_tree(self, source, limit_m=np.inf):
+        """Dijkstra from source, reusing the previous tree when it already covers limit_m"""
+        if self._tree is not None:
+            cached_source, cached_limit, distances, predecessors = self._tree
+            if cached_source == source and cached_limit >= limit_m:
+                return distances, predecessors
+
+        distances, predecessors = dijkstra(
+            self.csr, directed=False, indices=source, return_predecessors=True, limit=limit_m
+        )
+        self._tree = (source, limit_m, distances, predecessors)
+        return distances, predecessors
+
+    def path_nodes(self, predecessors, target):
+        """Walk a predecessor array back from target to the tree's source"""
+        nodes = [target]
+        while predecessors[nodes[-1]] >= 0:
+            nodes.append(int(predecessors[nodes[-1]]))
+        nodes.reverse()
+        return nodes
+
+    def path_edges(self, nodes):
+        """Undirected edge ids traversed by a node path"""
+        edge_ids = []
+        for u, v in zip(nodes[:-1], nodes[1:]):
+            start, stop = self.csr.indptr[u], self.csr.indptr[u + 1]
+            offset = np.searchsorted(self.csr.indices[start:stop], v)
+            edge_ids.append(int(self.csr_edge_id[start + offset]))
+        return edge_ids
+
+    def route_dict(self, nodes, distance_m):
+        """Route in the same shape as get_routes.test_google_routes_distance"""
+        coords = list(zip(self.node_lat[nodes].tolist(), self.node_lng[nodes].tolist()))
+        return {
+            "distance_km": distance_m / 1000,
+            "duration_minutes": distance_m / 1000 / float(StreetGraphConfig.WALKING_SPEED_KMH) * 60,
+            "polyline": polyline.encode(coords),
+            "edge_ids": self.path_edges(nodes),
+            "backend": "local",
+            "success": True,
+        }
+
+    def compute_route(self, start_lat, start_lng, end_lat, end_lng):
+        """One-way shortest walking route between two coordinates"""
+        max_snap = float(StreetGraphConfig.MAX_SNAP_METERS)
+        source, source_snap = self.nearest_node(start_lat, start_lng)
+        target, target_snap = self.nearest_node(end_lat, end_lng)
+        if source_snap > max_snap or target_snap > max_snap:
+            return {"error": "Location is not near the street network", "success": False}
+
+        # detours rarely exceed 2x the straight line, searching further only wastes time
+        straight_m = utils.euc_distance(start_lat, start_lng, end_lat, end_lng) * 1000
+        distances, predecessors = self.shortest_path_tree(source, limit_m=max(straight_m * 2.5, 1000))
+
+        if not np.isfinite(distances[target]):
+            return {"error": "No routes found", "success": False}
+
+        nodes = self.path_nodes(predecessors, target)
+        return self.route_dict(nodes, float(distances[target]))
+
+    def loop_route(self, start_lat, start_lng, target_distance_km, bearing=0, detour_factor=1.3):
+        """
+        Loop through two waypoints so the triangle's walking length is near the target
+
+        Returns:
+            Route dict covering the whole loop (not one-way), or an error dict
+        """
+        side_km = target_distance_km / (3 * detour_factor)
+        waypoints = []
+        for offset in (bearing - 30, bearing + 30):
+            rad = math.radians(offset)
+            waypoints.append(
+                (
+                    start_lat + side_km / 111.0 * math.cos(rad),
+                    start_lng + side_km / (111.0 * math.cos(math.radians(start_lat))) * math.sin(rad),
+                )
+            )
+
+        legs = [(start_lat, start_lng), *waypoints, (start_lat, start_lng)]
+        nodes, distance_m, turns = [], 0.0, []
+        for (lat1, lng1), (lat2, lng2) in zip(legs[:-1], legs[1:]):
+            source, _ = self.nearest_node(lat1, lng1)
+            target, snap = self.nearest_node(lat2, lng2)
+            turns.append(target)
+            if snap > float(StreetGraphConfig.MAX_SNAP_METERS):
+                return {"error": "Waypoint is not near the street network", "success": False}
+
+            distances, predecessors = self.shortest_path_tree(
+                source, limit_m=target_distance_km * 1000
+            )
+            if not np.isfinite(distances[target]):
+                return {"error": "No routes found", "success": False}
+
+            leg = self.path_nodes(predecessors, target)
+            nodes.extend(leg if not nodes else leg[1:])
+            distance_m += float(distances[target])
+
+        route = self.route_dict(nodes, distance_m)
+        route["loop"] = True
+        # the two snapped waypoints the loop turns at
+        route["waypoints"] = [
+            {"lat": float(self.node_lat[node]), "lng": float(self.node_lng[node])} for node in turns[:-1]
+        ]
+        return route
+
+
+def load_street_graph(path=StreetGraphConfig.PATH.value):
+    """Load a graph saved as .npz with node_lat, node_lng, edge_u, edge_v[, edge_length_m]"""
+    with np.load(path) as data:
+        return StreetGraph(
+            data["node_lat"],
+            data["node_lng"],
+            data["edge_u"],
+            data["edge_v"],
+            data["edge_length_m"] if "edge_length_m" in data else None,
+        )
+
+
+def get_street_graph(path=StreetGraphConfig.PATH.value):
+    """Shared graph for this worker, or None when no graph file is available"""
+    global _graph
+    if _graph is None:
+        if not os.path.exists(path):
+            return None
+        _graph = load_street_graph(path)
+        print(f"Loaded street graph: {_graph.num_nodes} nodes, {_graph.num_edges} edges")
+    return _graph
+
+
+def build_graph_from_geojson(geojson_path, out_path=StreetGraphConfig.PATH.value, precision=6):
+    """Convert GeoJSON LineStrings (e.g. an OSM footway export) into the .npz graph format"""
+    with open(geojson_path, "rb") as f:
+        features = orjson.loads(f.read())["features"]
+
+    node_ids = {}
+    node_lat, node_lng, edge_u, edge_v = [], [], [], []
+
+    def node_for(lng, lat):
+        key = (round(lat, precision), round(lng, precision))
+        if key not in node_ids:
+            node_ids[key] = len(node_lat)
+            node_lat.append(key[0])
+            node_lng.append(key[1])
+        return node_ids[key]
+
+    for feature in features:
+        geom = feature.get("geometry") or {}
+        if geom.get("type") == "LineString":
+            lines = [geom["coordinates"]]
+        elif geom.get("type") == "MultiLineString":
+            lines = geom["coordinates"]
+        else:
+            continue
+
+        for line in lines:
+            for (lng1, lat1, *_), (lng2, lat2, *_) in zip(line[:-1], line[1:]):
+                edge_u.append(node_for(lng1, lat1))
+                edge_v.append(node_for(lng2, lat2))
+
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    np.savez_compressed(
+        out_path,
+        node_lat=np.array(node_lat),
+        node_lng=np.array(node_lng),
+        edge_u=np.array(edge_u, dtype=np.int32),
+        edge_v=np.array(edge_v, dtype=np.int32),
+    )
+    print(f"✓ Wrote {len(node_lat)} nodes, {len(edge_u)} edges to {out_path}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python street_graph.py <streets.geojson> [out.npz]")
+        sys.exit(1)
+    build_graph_from_geojson(*sys.argv[1:3])
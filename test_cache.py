@@ -0,0 +1,101 @@
+import os
+import tempfile
+import time
+
+import cache
+
+
+def test_make_key_rounding():
+    """Floats equal to 6 decimals, dict order and tuples vs lists give the same key"""
+    assert cache.make_key(40.7580001, -73.9855) == cache.make_key(40.758, -73.98550004)
+    assert cache.make_key({"a": 1, "b": 2}) == cache.make_key({"b": 2, "a": 1})
+    assert cache.make_key((1, 2)) == cache.make_key([1, 2])
+    assert cache.make_key(40.758) != cache.make_key(40.759)
+    print("✓ Keys are stable under rounding and ordering")
+
+
+def check_backend(backend):
+    backend.set("route", "a", {"km": 5.0})
+    assert backend.get("route", "a") == {"km": 5.0}
+    assert backend.get("route", "b") is cache.MISSING
+    assert backend.get("weather", "a") is cache.MISSING  # namespaces don't mix
+
+    backend.set("route", "old", 1, ttl_s=0.01)
+    time.sleep(0.05)
+    assert backend.get("route", "old") is cache.MISSING
+
+    backend.delete("route", "a")
+    assert backend.get("route", "a") is cache.MISSING
+    backend.set("route", "a", 1)
+    backend.set("weather", "a", 2)
+    backend.clear("route")
+    assert backend.get("route", "a") is cache.MISSING and backend.get("weather", "a") == 2
+
+
+def test_backends():
+    """Every backend: round trip, namespaces, expired TTLs read as MISSING, delete and clear"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "cache.sqlite3")
+        for backend in (
+            cache.LRUCache(1 << 20),
+            cache.SQLiteCache(path, 1 << 20),
+            cache.TieredCache(cache.LRUCache(1 << 20), cache.SQLiteCache(path, 1 << 20)),
+        ):
+            backend.clear()
+            check_backend(backend)
+            print(f"✓ {backend.stats()['backend']} backend")
+
+
+def test_lru_evicts_oldest():
+    lru = cache.LRUCache(max_bytes=30)
+    for i in range(5):
+        lru.set("ns", str(i), "x" * 8)  # 10 bytes serialized
+    assert lru.size_bytes <= 30
+    assert lru.get("ns", "0") is cache.MISSING and lru.get("ns", "4") == "x" * 8
+
+
+def test_sqlite_errors_degrade_to_misses():
+    """A broken cache file is a miss or a skipped write, counted in stats, never an exception"""
+    with tempfile.TemporaryDirectory() as tmp:
+        backend = cache.SQLiteCache(os.path.join(tmp, "cache.sqlite3"), 1 << 20)
+        backend.set("route", "a", 1)
+        backend._conn().execute("DROP TABLE cache")
+
+        assert backend.get("route", "a") is cache.MISSING
+        backend.set("route", "a", 1)
+        backend.delete("route", "a")
+        backend.clear("route")
+        backend.clear()
+        stats = backend.stats()
+        assert stats["namespaces"]["route"]["errors"] == 4
+        assert "no such table" in stats["last_error"]
+    print("✓ SQLite errors are counted, not raised")
+
+
+def test_cached_skips_errors():
+    """Results are memoized per argument, error results are not"""
+    calls = []
+
+    @cache.cached("geocode")
+    def lookup(lat, lng):
+        calls.append((lat, lng))
+        return {"error": "quota"} if lat < 0 else {"address": f"{lat},{lng}"}
+
+    original = cache._cache
+    cache._cache = cache.LRUCache(1 << 20)
+    try:
+        assert lookup(40.75, -73.98) == lookup(40.7500000001, -73.98)
+        lookup(-1.0, 0.0)
+        lookup(-1.0, 0.0)
+        assert calls == [(40.75, -73.98), (-1.0, 0.0), (-1.0, 0.0)]
+    finally:
+        cache._cache = original
+    print("✓ cached() stores results and retries errors")
+
+
+if __name__ == "__main__":
+    test_make_key_rounding()
+    test_backends()
+    test_lru_evicts_oldest()
+    test_sqlite_errors_degrade_to_misses()
+    test_cached_skips_errors()
@@ -0,0 +1,71 @@
+import multiprocessing
+import os
+import tempfile
+
+import httpx
+
+import cassette
+
+CLOSURES = "https://data.cityofnewyork.us/resource/i6b5-j7bu.json"
+
+
+def closures_request(when, app_token="secret"):
+    params = {"$where": f"work_start_date <= '{when}' AND work_end_date >= '{when}'", "$$app_token": app_token}
+    return httpx.Request("GET", CLOSURES, params=params)
+
+
+def test_request_key():
+    """Keys ignore credentials, query order, JSON formatting and the dates a query embeds"""
+    assert cassette.request_key(closures_request("2026-10-19T01:00:00")) == cassette.request_key(
+        closures_request("2027-03-02T17:00:00", app_token="other")
+    )
+    assert cassette.request_key(httpx.Request("GET", "https://x.test/a?b=1&key=k1&c=2")) == cassette.request_key(
+        httpx.Request("GET", "https://x.test/a?c=2&b=1&key=k2")
+    )
+    assert cassette.request_key(httpx.Request("POST", "https://x.test/a", content=b'{"a": 1, "b": 2}')) == (
+        cassette.request_key(httpx.Request("POST", "https://x.test/a", content=b'{"b":2,"a":1}'))
+    )
+    assert cassette.request_key(httpx.Request("GET", "https://x.test/a?b=1")) != cassette.request_key(
+        httpx.Request("GET", "https://x.test/a?b=2")
+    )
+    print("✓ Request keys ignore secrets, ordering and dates")
+
+
+def record_session(path, worker):
+    answer = lambda request: httpx.Response(200, headers={"set-cookie": "s=1"}, json={"worker": worker})
+    recording = cassette.Cassette(path, "record")
+    client = httpx.Client(transport=cassette.CassetteTransport(httpx.MockTransport(answer), recording))
+    for i in range(3):
+        client.get(f"https://x.test/a?i={i}&key=k")
+    recording.save()
+
+
+def test_record_replay():
+    """Worker processes recording into one cassette all keep their requests, and replay needs no network"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "session.cassette")
+        workers = [multiprocessing.Process(target=record_session, args=(path, n)) for n in range(3)]
+        for process in workers:
+            process.start()
+        for process in workers:
+            process.join()
+
+        replay = cassette.Cassette(path, "replay")
+        assert len(replay.interactions) == 9
+        assert all("key=" not in interaction["url"] for interaction in replay.interactions)
+        assert all(k != "set-cookie" for i in replay.interactions for k, _ in i["headers"])
+
+        client = httpx.Client(transport=cassette.CassetteTransport(None, replay, latency="zero"))
+        answers = {client.get("https://x.test/a?i=1&key=other").json()["worker"] for _ in range(3)}
+        assert answers == {0, 1, 2}  # repeats replay each recording in turn
+        try:
+            client.get("https://x.test/unrecorded")
+            assert False, "an unrecorded request must not go out"
+        except cassette.CassetteMissError:
+            pass
+    print("✓ Recordings from every worker replay offline")
+
+
+if __name__ == "__main__":
+    test_request_key()
+    test_record_replay()
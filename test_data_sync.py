@@ -0,0 +1,179 @@
+import json
+import math
+import os
+import re
+import tempfile
+
+import psycopg2
+
+import cache
+import crash_cells
+import data_sync
+
+
+class FakeCrashDB:
+    """
+    The crashes and crash_cells tables in memory, answering the statements
+    data_sync.apply_changes and crash_cells issue
+
+    Like Postgres, comparing the bigint collision_id to a text array without a
+    cast is an error.
+    """
+
+    def __init__(self, rows=()):
+        self.crashes = {}
+        self.cells = {}
+        self.encoding = "UTF8"
+        for row in rows:
+            self.crashes[int(row[0])] = row
+        self.rebuild_cells()
+
+    @staticmethod
+    def cell(row):
+        return (math.floor(float(row[2]) / crash_cells.CELL_DEG), math.floor(float(row[3]) / crash_cells.CELL_DEG))
+
+    def aggregate(self, rows):
+        cells = {}
+        for row in rows:
+            totals = cells.setdefault(self.cell(row) + (str(row[1])[:10],), [0, 0, 0])
+            totals[0] += 1
+            totals[1] += int(row[4] or 0)
+            totals[2] += int(row[5] or 0)
+        return cells
+
+    def rebuild_cells(self):
+        self.cells = self.aggregate(self.crashes.values())
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self.connection = db
+        self.result = []
+        self.rowcount = 0
+        self.pending = []
+
+    def mogrify(self, template, args):
+        self.pending.append(args)
+        return b"(...)"
+
+    def _ids(self, sql, values):
+        if "= ANY(%s::bigint[])" not in sql and any(isinstance(v, str) for v in values):
+            raise psycopg2.ProgrammingError("operator does not exist: bigint = text")
+        return {int(v) for v in values}
+
+    def execute(self, sql, params=()):
+        if isinstance(sql, bytes):
+            sql = sql.decode()
+        sql = " ".join(sql.split())
+        db = self.db
+        self.result = []
+
+        if "to_regclass('crash_cells')" in sql:
+            self.result = [(True,)]
+        elif sql.startswith("SELECT collision_id FROM crashes WHERE collision_id = ANY"):
+            self.result = [(i,) for i in self._ids(sql, params[0]) if i in db.crashes]
+        elif sql.startswith("SELECT DISTINCT"):
+            ids = self._ids(sql, params[0])
+            self.result = list({db.cell(db.crashes[i]) for i in ids if i in db.crashes})
+        elif sql.startswith("INSERT INTO crashes"):
+            for row in self.pending:
+                db.crashes[int(row[0])] = row
+            self.rowcount, self.pending = len(self.pending), []
+        elif sql.startswith("INSERT INTO crash_cells") and "collision_id = ANY" in sql:
+            ids = self._ids(sql, params[0])
+            added = db.aggregate(db.crashes[i] for i in ids if i in db.crashes)
+            for key, totals in added.items():
+                current = db.cells.setdefault(key, [0, 0, 0])
+                for k in range(3):
+                    current[k] += totals[k]
+            self.rowcount = len(added)
+        elif sql.startswith("DELETE FROM crash_cells"):
+            wanted = set(zip(*params))
+            db.cells = {key: totals for key, totals in db.cells.items() if key[:2] not in wanted}
+        elif sql.startswith("INSERT INTO crash_cells"):
+            wanted = set(zip(*params))
+            recounted = db.aggregate(row for row in db.crashes.values() if db.cell(row) in wanted)
+            db.cells.update(recounted)
+            self.rowcount = len(recounted)
+        else:
+            raise AssertionError(f"unexpected statement: {sql[:80]}")
+
+    def fetchone(self):
+        return self.result[0] if self.result else None
+
+    def fetchall(self):
+        return list(self.result)
+
+
+def crash(collision_id, lat, lng, injured=0, day="2025-06-01"):
+    """An NYC Open Data record, with the string fields the API returns"""
+    return {
+        "collision_id": str(collision_id),
+        "crash_date": f"{day}T00:00:00.000",
+        "latitude": str(lat),
+        "longitude": str(lng),
+        "number_of_persons_injured": str(injured),
+        "number_of_persons_killed": "0",
+        "crash_time": "8:15",
+    }
+
+
+def test_apply_changes_keeps_cells_exact():
+    """New crashes are added to their cells, edited ones recounted, from string ids"""
+    existing = [
+        (1, "2025-06-01", 40.7500, -73.9900, 1, 0, "8:00"),
+        (2, "2025-06-01", 40.7512, -73.9871, 0, 0, "9:00"),
+    ]
+    db = FakeCrashDB(existing)
+    changes = [
+        crash(3, 40.7531, -73.9855, injured=2),  # new
+        crash(1, 40.7601, -73.9702, injured=1),  # edited, moved to another cell
+    ]
+
+    inserted, updated = data_sync.apply_changes(db, changes)
+
+    assert [int(row[0]) for row in inserted] == [3]
+    assert updated == 1
+    expected = db.aggregate(db.crashes.values())
+    assert {key: totals for key, totals in db.cells.items() if totals[0]} == expected
+    print(f"✓ {len(expected)} crash cells match a full recount")
+
+
+def test_reloader_only_moves_version_when_every_step_succeeds():
+    original_version = cache.data_version()
+    failing = {"fail": True}
+
+    def flaky_step():
+        if failing["fail"]:
+            raise RuntimeError("index file truncated")
+
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "data_version.json")
+            reloader = data_sync.Reloader([("ok", lambda: None), ("flaky", flaky_step)], path=path)
+            with open(path, "w") as f:
+                json.dump({"version": original_version + 1}, f)
+
+            assert not reloader.check()
+            assert cache.data_version() == original_version
+            assert re.search("truncated", reloader.errors["flaky"])
+
+            failing["fail"] = False
+            assert reloader.check()  # retried without a new publish
+            assert cache.data_version() == original_version + 1
+            assert reloader.errors == {}
+    finally:
+        cache.set_data_version(original_version)
+    print("✓ Data version moves only after a clean reload")
+
+
+if __name__ == "__main__":
+    test_apply_changes_keeps_cells_exact()
+    test_reloader_only_moves_version_when_every_step_succeeds()
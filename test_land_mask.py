@@ -0,0 +1,60 @@
+import json
+import os
+import tempfile
+
+import numpy as np
+
+import land_mask
+
+# a 0.01 degree square around midtown, with a repeated corner like real GeoJSON often has
+SQUARE = [
+    [-73.99, 40.75],
+    [-73.98, 40.75],
+    [-73.98, 40.75],
+    [-73.98, 40.76],
+    [-73.99, 40.76],
+    [-73.99, 40.75],
+]
+
+
+def test_repeated_vertices():
+    """Zero-length ring edges are dropped on load and harmless if they reach rasterize"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "land.geojson")
+        with open(path, "w") as f:
+            json.dump({"type": "Polygon", "coordinates": [SQUARE]}, f)
+        edges = land_mask.polygon_edges_from_geojson(path)
+    assert len(edges) == 4
+
+    raw_edges = np.hstack((np.array(SQUARE[:-1]), np.array(SQUARE[1:])))
+    cell_deg = 0.001
+    for polygon_edges in (edges, raw_edges):
+        cells, origin = land_mask.rasterize(polygon_edges, cell_deg)
+        center = (int((40.755 - origin[0]) / cell_deg), int((-73.985 - origin[1]) / cell_deg))
+        assert cells[center] == land_mask.INSIDE
+        assert cells[-1, -1] == land_mask.OUTSIDE
+    print("✓ Rings with repeated vertices rasterize")
+
+
+def test_traversal_matches_dense_sampling():
+    """Every cell an edge passes through is marked, including corners it only clips"""
+    rng = np.random.default_rng(31)
+    cell_deg = 0.001
+    origin = (40.75, -73.99)
+    edges = np.column_stack((
+        origin[1] + rng.uniform(0, 0.01, 50), origin[0] + rng.uniform(0, 0.01, 50),
+        origin[1] + rng.uniform(0, 0.01, 50), origin[0] + rng.uniform(0, 0.01, 50),
+    ))
+    r, c = land_mask._traversed_cells(edges, origin, cell_deg)
+    marked = set(zip(r.tolist(), c.tolist()))
+
+    t = np.linspace(0, 1, 100_000)
+    for lng1, lat1, lng2, lat2 in edges:
+        rows = np.floor((lat1 + t * (lat2 - lat1) - origin[0]) / cell_deg).astype(int)
+        cols = np.floor((lng1 + t * (lng2 - lng1) - origin[1]) / cell_deg).astype(int)
+        assert set(zip(rows.tolist(), cols.tolist())) <= marked
+
+
+if __name__ == "__main__":
+    test_repeated_vertices()
+    test_traversal_matches_dense_sampling()
@@ -0,0 +1,122 @@
+import threading
+import time
+
+import httpx
+
+import outbound
+from deadline import Deadline
+
+
+def provider(name, **overrides):
+    """A fresh provider with the default limits and the given overrides"""
+    config = {**outbound.outbound_providers["google_routes"], "backoff_s": 0.01, "backoff_max_s": 0.02, **overrides}
+    outbound._providers[name] = outbound.Provider(name, config)
+    return outbound._providers[name]
+
+
+def test_token_bucket():
+    """Bursts up to capacity, then refills at rate; waits longer than max_wait are refused"""
+    bucket = outbound.TokenBucket(rate=20, capacity=3)
+    assert all(bucket.try_acquire() for _ in range(3))
+    assert not bucket.try_acquire()
+    assert not bucket.acquire(max_wait=0.01)
+
+    started = time.monotonic()
+    assert bucket.acquire(max_wait=1)
+    assert 0.02 < time.monotonic() - started < 0.2
+    print("✓ Token bucket bursts, refills and refuses long waits")
+
+
+def test_circuit_breaker():
+    """Opens after N failures, half-opens after the cooldown with a single trial, closes on success"""
+    breaker = outbound.CircuitBreaker(failure_threshold=3, reset_after_s=0.05)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    assert not breaker.allow()  # one trial at a time
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow()
+    print("✓ Breaker opens, half-opens and closes")
+
+
+def test_retries_then_short_circuits():
+    p = provider("test_flaky", max_attempts=3, failure_threshold=2, reset_after_s=60)
+    attempts = []
+
+    def down(timeout):
+        attempts.append(timeout)
+        return httpx.Response(503)
+
+    assert outbound.call("test_flaky", down).status_code == 503
+    assert len(attempts) == 3 and p.stats["retries"] == 2
+    outbound.call("test_flaky", down)
+    try:
+        outbound.call("test_flaky", down)
+        assert False, "an open circuit must not call the provider"
+    except outbound.CircuitOpenError:
+        pass
+    assert len(attempts) == 6
+
+
+def test_hedging():
+    """A slow first request gets a duplicate and the faster answer wins"""
+    p = provider("test_hedge", hedge_after_s=0.05)
+    first = threading.Event()
+
+    def request(timeout):
+        if not first.is_set():
+            first.set()
+            time.sleep(0.5)
+            return httpx.Response(200, text="slow")
+        return httpx.Response(200, text="fast")
+
+    started = time.monotonic()
+    assert outbound.call("test_hedge", request, hedge=True).text == "fast"
+    assert time.monotonic() - started < 0.3
+    assert p.stats["hedges_sent"] == 1 and p.stats["hedges_won"] == 1
+    print("✓ Hedged request beats the slow one")
+
+
+def test_deadline_caps_retries():
+    """Timeouts and retries stay inside the caller's remaining budget"""
+    provider("test_deadline", max_attempts=10, backoff_s=0.1, backoff_max_s=0.2)
+    timeouts = []
+
+    def down(timeout):
+        timeouts.append(timeout)
+        raise httpx.ConnectError("down")
+
+    deadline = Deadline(0.3)
+    started = time.monotonic()
+    try:
+        outbound.call("test_deadline", down, deadline=deadline)
+    except httpx.ConnectError:
+        pass
+    assert time.monotonic() - started < 0.45
+    assert len(timeouts) < 10 and all(timeout <= 0.3 for timeout in timeouts)
+
+    try:
+        outbound.call("test_deadline", down, deadline=Deadline(0))
+        assert False, "an expired deadline must not call the provider"
+    except outbound.DeadlineExceededError:
+        pass
+    print(f"✓ Gave up after {len(timeouts)} attempts inside the deadline")
+
+
+if __name__ == "__main__":
+    test_token_bucket()
+    test_circuit_breaker()
+    test_retries_then_short_circuits()
+    test_hedging()
+    test_deadline_caps_retries()
@@ -0,0 +1,89 @@
+import gzip
+
+import orjson
+import ormsgpack
+import zstandard
+from starlette.requests import Request
+
+import response_format
+
+ROUTES = {
+    "start_location": {"lat": 40.768, "lng": -73.982},
+    "route_options": [
+        {"direction": "North", "polyline": "abc", "safety_analysis": {"overall_safety_score": 81, "segments": [1, 2]}},
+        {"direction": "South loop", "polyline": "def", "safety_analysis": {"overall_safety_score": 64, "segments": []}},
+    ],
+}
+
+
+def make_request(headers):
+    scope = {"type": "http", "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()]}
+    return Request(scope)
+
+
+def test_parse_fields():
+    include, exclude = response_format.parse_fields("route_options.direction, -route_options.polyline,,start_location")
+    assert include == [("route_options", "direction"), ("start_location",)]
+    assert exclude == [("route_options", "polyline")]
+
+
+def test_select_fields():
+    """Includes project into lists, excludes drop paths and keep the rest"""
+    selected = response_format.select_fields(ROUTES, "route_options.direction,route_options.safety_analysis.overall_safety_score")
+    assert selected == {
+        "route_options": [
+            {"direction": "North", "safety_analysis": {"overall_safety_score": 81}},
+            {"direction": "South loop", "safety_analysis": {"overall_safety_score": 64}},
+        ]
+    }
+
+    dropped = response_format.select_fields(ROUTES, "-route_options.polyline,-route_options.safety_analysis.segments")
+    assert dropped["start_location"] == ROUTES["start_location"]
+    assert dropped["route_options"][1] == {"direction": "South loop", "safety_analysis": {"overall_safety_score": 64}}
+    assert "polyline" in ROUTES["route_options"][0]  # the original is untouched
+    print("✓ fields= includes and excludes")
+
+
+def test_negotiate():
+    assert response_format.negotiate(None) == response_format.JSON
+    assert response_format.negotiate("text/html, application/x-msgpack") == response_format.MSGPACK
+    assert response_format.negotiate("application/msgpack;q=0, application/json") == response_format.JSON
+    assert response_format.negotiate("application/json;q=0.4, application/msgpack;q=0.9") == response_format.MSGPACK
+    assert response_format.negotiate("application/json", format="msgpack") == response_format.MSGPACK
+    assert response_format.negotiate(None, format="xml") is None
+
+
+def test_compress():
+    body = b"x" * 5000
+    assert response_format.compress(body, "gzip, zstd")[1] == "zstd"
+    assert response_format.compress(body, "zstd;q=0, gzip")[1] == "gzip"
+    assert response_format.compress(body, "gzip;q=1, zstd;q=0.2")[1] == "gzip"
+    assert response_format.compress(body, "*")[1] == "zstd"
+    assert response_format.compress(body, "identity") == (body, None)
+    assert response_format.compress(b"x" * 10, "zstd") == (b"x" * 10, None)  # too small to bother
+    print("✓ Content coding follows the client's q-values")
+
+
+def test_render_round_trip():
+    """A rendered body decodes back to the selected data in every format and coding"""
+    cases = [
+        ({"Accept-Encoding": "gzip"}, gzip.decompress, orjson.loads),
+        ({"Accept": "application/msgpack", "Accept-Encoding": "zstd"}, zstandard.ZstdDecompressor().decompress,
+         ormsgpack.unpackb),
+    ]
+    data = {**ROUTES, "route_options": ROUTES["route_options"] * 20}
+    for headers, decompress, decode in cases:
+        response = response_format.render(make_request(headers), data, fields="-route_options.polyline")
+        assert response.headers["Vary"] == "Accept, Accept-Encoding"
+        decoded = decode(decompress(response.body))
+        assert decoded == response_format.select_fields(data, "-route_options.polyline")
+    assert response_format.render(make_request({}), data, format="xml").status_code == 406
+    print("✓ Rendered bodies round-trip")
+
+
+if __name__ == "__main__":
+    test_parse_fields()
+    test_select_fields()
+    test_negotiate()
+    test_compress()
+    test_render_round_trip()
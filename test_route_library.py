@@ -0,0 +1,83 @@
+import os
+import tempfile
+import time
+
+import orjson
+import zstandard
+
+import route_library
+
+START = (40.768044, -73.981893)
+
+
+def entry(name, lat, lng, distance_km, age_hours=1):
+    return {
+        "name": name,
+        "lat": lat,
+        "lng": lng,
+        "distance_km": distance_km,
+        "built_at": time.time() - age_hours * 3600,
+        "routes": [{"direction": name}],
+    }
+
+
+def write_library(path, entries, version=route_library.LIBRARY_VERSION):
+    with open(path, "wb") as f:
+        f.write(zstandard.ZstdCompressor().compress(orjson.dumps({"version": version, "entries": entries})))
+
+
+def test_lookup_precomputed_routes():
+    """Nearest fresh start within tolerance for the requested distance, else a miss"""
+    entries = [
+        entry("near but stale", START[0], START[1], 5.0, age_hours=1000),
+        entry("100m north", START[0] + 0.0009, START[1], 5.0),
+        entry("250m south", START[0] - 0.00225, START[1], 5.0),
+        entry("10km start", START[0], START[1], 10.0),
+    ]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "route_library.json.zst")
+        write_library(path, entries)
+
+        def lookup(distance_km, lat=START[0], lng=START[1]):
+            hit = route_library.lookup_precomputed_routes(lat, lng, distance_km, path=path)
+            return hit and hit["freshness"]["start_name"]
+
+        # the stale entry sits right on the start, the nearest fresh one answers instead
+        assert lookup(5.0) == "100m north"
+        assert lookup(5.2) == "100m north"  # within the distance tolerance
+        assert lookup(6.0) is None
+        assert lookup(10.0) == "10km start"
+        assert lookup(5.0, lat=START[0] - 0.0011) == "250m south"  # both in tolerance, the nearer wins
+        assert lookup(5.0, lat=START[0] + 0.01) is None  # over a kilometre from any start
+
+        hit = route_library.lookup_precomputed_routes(*START, 5.0, path=path)
+        assert hit["routes"] == [{"direction": "100m north"}]
+        assert 90 < hit["freshness"]["start_offset_m"] < 110
+    print("✓ Lookups pick the nearest fresh start within tolerance")
+
+
+def test_rejected_library_is_not_reread():
+    """A library of another version is remembered as rejected until the file changes"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "route_library.json.zst")
+        write_library(path, [entry("old format", *START, 5.0)], version=route_library.LIBRARY_VERSION + 1)
+        assert route_library.get_route_library(path) is None
+
+        loads = []
+        original = route_library.load_route_library
+        route_library.load_route_library = lambda p: loads.append(p) or original(p)
+        try:
+            assert route_library.lookup_precomputed_routes(*START, 5.0, path=path) is None
+            assert loads == []
+
+            write_library(path, [entry("rebuilt", *START, 5.0)])
+            os.utime(path, (time.time() + 5, time.time() + 5))
+            assert route_library.lookup_precomputed_routes(*START, 5.0, path=path) is not None
+            assert loads == [path]
+        finally:
+            route_library.load_route_library = original
+
+
+if __name__ == "__main__":
+    test_lookup_precomputed_routes()
+    test_rejected_library_is_not_reread()
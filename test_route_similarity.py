@@ -0,0 +1,43 @@
+import polyline
+
+import route_similarity
+
+START = (40.7680, -73.9819)
+
+
+def out_and_back(d_lat, d_lng, steps=20):
+    """Encoded out-and-back route from START along a straight line"""
+    out = [(START[0] + d_lat * k / steps, START[1] + d_lng * k / steps) for k in range(steps + 1)]
+    return out + out[-2::-1]
+
+
+def route(direction, coords):
+    return {"direction": direction, "polyline": polyline.encode(coords)}
+
+
+def test_prune_near_duplicates():
+    """Identical and retraced routes are dropped; routes in other directions and unscoreable ones are kept"""
+    north = out_and_back(0.02, 0.0)
+    routes = [
+        route("North", north),
+        route("North again", north),
+        route("North reversed", north[::-1]),
+        route("North, a block over", [(lat, lng + 0.0005) for lat, lng in north]),
+        route("South", out_and_back(-0.02, 0.0)),
+        {"direction": "No polyline", "polyline": ""},
+    ]
+    kept = route_similarity.prune_near_duplicates(routes, threshold_m=250)
+    assert [r["direction"] for r in kept] == ["North", "South", "No polyline"]
+    print("✓ Near duplicates pruned, distinct routes kept in order")
+
+
+def test_threshold():
+    """Routes further apart than the threshold all survive"""
+    north = out_and_back(0.02, 0.0)
+    routes = [route("North", north), route("North, a block over", [(lat, lng + 0.0005) for lat, lng in north])]
+    assert len(route_similarity.prune_near_duplicates(routes, threshold_m=20)) == 2
+
+
+if __name__ == "__main__":
+    test_prune_near_duplicates()
+    test_threshold()
@@ -0,0 +1,272 @@
+import os
+import random
+import tempfile
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+import crash_cells
+import crash_snapshot
+import safety_engine
+import utils
+
+
+class ReferenceBackend(safety_engine.CrashDataBackend):
+    """Brute force over the fixture rows, the behaviour every backend must match"""
+
+    name = "reference"
+
+    def __init__(self, rows):
+        self.rows = [(float(r[2]), float(r[3]), r[4] or 0, r[5] or 0) for r in rows]
+
+    def box_totals(self, attr, boxes):
+        column = safety_engine.ATTRS.index(attr)
+        totals = []
+        for lat_min, lat_max, lng_min, lng_max in boxes:
+            inside = [r for r in self.rows if lat_min <= r[0] <= lat_max and lng_min <= r[1] <= lng_max]
+            totals.append(len(inside) if column == 0 else sum(r[column + 1] for r in inside))
+        return totals
+
+    def radius_totals(self, lat, lng, radius_km):
+        near = [r for r in self.rows if utils.euc_distance(lat, lng, r[0], r[1]) <= radius_km]
+        return (len(near), sum(r[2] for r in near), sum(r[3] for r in near))
+
+
+class FakeCrashDB:
+    """
+    The crashes and crash_cells tables in memory, answering the statements the
+    Postgres and cells backends issue, so their SQL paths run without a database
+
+    There is no hkey column, so box queries are the plain latitude/longitude bounds.
+    """
+
+    def __init__(self, rows):
+        self.lat = np.array([float(r[2]) for r in rows])
+        self.lng = np.array([float(r[3]) for r in rows])
+        self.injuries = np.array([r[4] or 0 for r in rows])
+        self.fatalities = np.array([r[5] or 0 for r in rows])
+        self.rows = rows
+        self.cell_lat = np.floor(self.lat / crash_cells.CELL_DEG).astype(int)
+        self.cell_lng = np.floor(self.lng / crash_cells.CELL_DEG).astype(int)
+        self.cells = {}
+        for k in range(len(rows)):
+            totals = self.cells.setdefault((self.cell_lat[k], self.cell_lng[k]), [0, 0, 0])
+            totals[0] += 1
+            totals[1] += int(self.injuries[k])
+            totals[2] += int(self.fatalities[k])
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def close(self):
+        pass
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self.result = []
+
+    def _matching(self, sql, params):
+        """Row indices inside any of the boxes, outside the excluded cells if the query has them"""
+        db = self.db
+        num_boxes = sql.count("latitude BETWEEN")
+        inside = np.zeros(len(db.rows), dtype=bool)
+        for b in range(num_boxes):
+            lat_min, lat_max, lng_min, lng_max = params[4 * b : 4 * b + 4]
+            inside |= (db.lat >= lat_min) & (db.lat <= lat_max) & (db.lng >= lng_min) & (db.lng <= lng_max)
+        if "NOT IN" in sql:
+            excluded = set(zip(params[-2], params[-1]))
+            inside &= [(i, j) not in excluded for i, j in zip(db.cell_lat, db.cell_lng)]
+        return np.flatnonzero(inside)
+
+    def execute(self, sql, params=()):
+        sql = " ".join(sql.split())
+        db = self.db
+        if "to_regclass('crash_cells')" in sql:
+            self.result = [(True,)]
+        elif "information_schema.columns" in sql:
+            self.result = [(False,)]
+        elif "FROM crash_cells" in sql:
+            totals = [db.cells.get(cell, [0, 0, 0]) for cell in zip(params[0], params[1])]
+            self.result = [tuple(sum(t[k] for t in totals) for k in range(3))]
+        elif sql.startswith("SELECT COUNT(*)"):
+            self.result = [(len(self._matching(sql, params)),)]
+        elif sql.startswith("SELECT COALESCE(SUM("):
+            column = getattr(db, sql[len("SELECT COALESCE(SUM(") :].split(")")[0])
+            self.result = [(int(column[self._matching(sql, params)].sum()),)]
+        elif sql.startswith("SELECT latitude, longitude, injuries, fatalities"):
+            self.result = [tuple(db.rows[k][2:6]) for k in self._matching(sql, params)]
+        elif sql.startswith("SELECT collision_id, crash_date, latitude"):
+            self.result = [tuple(db.rows[k][:6]) for k in self._matching(sql, params)]
+        else:
+            raise AssertionError(f"unexpected statement: {sql[:80]}")
+
+    def fetchone(self):
+        return self.result[0]
+
+    def fetchall(self):
+        return list(self.result)
+
+
+def make_fixture_rows(num_rows=20000, seed=7):
+    """Synthetic crashes around midtown, clustered on a few corridors like the real data"""
+    rng = random.Random(seed)
+    corridors = [(40.7549, -73.9840), (40.7505, -73.9934), (40.7614, -73.9776), (40.7420, -73.9890)]
+    rows = []
+    for collision_id in range(num_rows):
+        if rng.random() < 0.6:
+            center_lat, center_lng = rng.choice(corridors)
+            lat, lng = rng.gauss(center_lat, 0.004), rng.gauss(center_lng, 0.004)
+        else:
+            lat, lng = rng.uniform(40.72, 40.79), rng.uniform(-74.02, -73.95)
+        rows.append(
+            (
+                collision_id,
+                date(2025, 1, 1) + timedelta(days=rng.randrange(300)),
+                round(lat, 6),
+                round(lng, 6),
+                rng.choice([0, 0, 0, 1, 1, 2]),
+                1 if rng.random() < 0.01 else 0,
+            )
+        )
+    return rows
+
+
+def fixture_backends(tmp_dir, fake_db=True):
+    """
+    Every available backend over one shared dataset, plus the reference
+
+    With a reachable database the fixture is the crashes table: the Postgres
+    backends query it and the snapshot is exported from the same rows. Offline,
+    synthetic rows feed the snapshot backend and, with fake_db, the Postgres
+    and cells backends through FakeCrashDB. The snapshot is written to tmp_dir.
+    """
+    postgres = safety_engine.PostgresBackend()
+    if postgres.available():
+        conn = safety_engine.get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT collision_id, crash_date, latitude, longitude, injuries, fatalities
+            FROM crashes WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+            """
+        )
+        rows = cursor.fetchall()
+        conn.close()
+        backends = [postgres, safety_engine.CellsBackend()]
+    else:
+        rows = make_fixture_rows()
+        if fake_db:
+            print("Database not reachable, running the backends on synthetic rows and an in-memory database")
+            db = FakeCrashDB(rows)
+            backends = [safety_engine.PostgresBackend(lambda: db), safety_engine.CellsBackend(lambda: db)]
+        else:
+            print("Database not reachable, running the snapshot backend on synthetic rows")
+            backends = []
+
+    path = os.path.join(tmp_dir, "crashes.rscs")
+    crash_snapshot.write_snapshot(rows, path)
+    backends.append(safety_engine.SnapshotBackend(crash_snapshot.CrashSnapshot(path)))
+    return ReferenceBackend(rows), backends
+
+
+def fixture_queries(reference, num_queries, seed=11):
+    """Query points on top of the fixture's crashes, with the radii the app uses"""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(num_queries):
+        lat, lng, _, _ = rng.choice(reference.rows)
+        queries.append((lat + rng.uniform(-0.002, 0.002), lng + rng.uniform(-0.002, 0.002), rng.choice([0.3, 0.5, 1.0])))
+    return queries
+
+
+def test_safety_backends(num_queries=25):
+    """
+    Conformance: every backend returns the reference's counts and summaries
+    """
+    print("=" * 60)
+    print("SAFETY BACKEND CONFORMANCE")
+    print("=" * 60)
+    with tempfile.TemporaryDirectory(prefix="safety_fixture_") as tmp_dir:
+        _check_conformance(*fixture_backends(tmp_dir), num_queries)
+
+
+def _check_conformance(reference, backends, num_queries):
+    queries = fixture_queries(reference, num_queries)
+    print(f"Fixture: {len(reference.rows)} crashes, {len(queries)} queries")
+    print(f"Backends: {', '.join(backend.name for backend in backends)}")
+
+    mismatches = []
+    for lat, lng, radius_km in queries:
+        boxes = [safety_engine.bounding_box(lat, lng, radius_km)]
+        expected_boxes = {attr: reference.box_totals(attr, boxes) for attr in safety_engine.ATTRS}
+        expected_radius = reference.radius_totals(lat, lng, radius_km)
+        expected_summary = safety_engine.get_crashes_near_me(lat, lng, radius_km, backend=reference)
+
+        for backend in backends:
+            got_boxes = {attr: backend.box_totals(attr, boxes) for attr in safety_engine.ATTRS}
+            got_radius = backend.radius_totals(lat, lng, radius_km)
+            got_summary = safety_engine.get_crashes_near_me(lat, lng, radius_km, backend=backend)
+            if (got_boxes, got_radius, got_summary) != (expected_boxes, expected_radius, expected_summary):
+                mismatches.append(
+                    {
+                        "backend": backend.name,
+                        "query": (lat, lng, radius_km),
+                        "expected": (expected_boxes, expected_radius, expected_summary),
+                        "got": (got_boxes, got_radius, got_summary),
+                    }
+                )
+
+    for mismatch in mismatches:
+        print(f"   MISMATCH {mismatch}")
+    print(f"✓ {len(queries) * len(backends) - len(mismatches)}/{len(queries) * len(backends)} checks match the reference")
+    assert not mismatches
+
+
+def benchmark_safety_backends(num_queries=200):
+    """Latency of one crashes-near-me lookup and one baseline computation per backend"""
+    print("=" * 60)
+    print("SAFETY BACKEND BENCHMARK")
+    print("=" * 60)
+    # the in-memory database would only time this file, so offline the snapshot runs alone
+    with tempfile.TemporaryDirectory(prefix="safety_fixture_") as tmp_dir:
+        return _benchmark(*fixture_backends(tmp_dir, fake_db=False), num_queries)
+
+
+def _benchmark(reference, backends, num_queries):
+    queries = fixture_queries(reference, num_queries)
+    results = {}
+
+    for backend in backends:
+        timings = {"radius_totals": [], "baselines": []}
+        for lat, lng, radius_km in queries:
+            started = time.perf_counter()
+            backend.radius_totals(lat, lng, radius_km)
+            timings["radius_totals"].append((time.perf_counter() - started) * 1000)
+
+            started = time.perf_counter()
+            for attr in safety_engine.ATTRS:
+                safety_engine.get_area_crash_percentiles.uncached(lat, lng, radius_km, attr, backend=backend)
+            timings["baselines"].append((time.perf_counter() - started) * 1000)
+
+        results[backend.name] = {
+            name: {
+                "p50_ms": round(float(np.percentile(values, 50)), 3),
+                "p95_ms": round(float(np.percentile(values, 95)), 3),
+            }
+            for name, values in timings.items()
+        }
+        for name, stats in results[backend.name].items():
+            print(f"   {backend.name:>9} {name:>14}: p50 {stats['p50_ms']}ms, p95 {stats['p95_ms']}ms")
+    return results
+
+
+if __name__ == "__main__":
+    test_safety_backends()
+    benchmark_safety_backends()
+
+    print("=" * 60)
+    print("SAFETY BACKENDS COMPLETE ✓")
+    print("=" * 60)
@@ -0,0 +1,69 @@
+import numpy as np
+import polyline
+
+import street_graph
+import utils
+
+# a 25x25 street grid around midtown, blocks 0.001 degrees apart
+GRID = 25
+ORIGIN = (40.75, -73.99)
+STEP_DEG = 0.001
+
+
+def make_grid_graph():
+    i, j = np.meshgrid(np.arange(GRID), np.arange(GRID), indexing="ij")
+    node_lat = (ORIGIN[0] + i * STEP_DEG).ravel()
+    node_lng = (ORIGIN[1] + j * STEP_DEG).ravel()
+    ids = np.arange(GRID * GRID).reshape(GRID, GRID)
+    edge_u = np.concatenate((ids[:, :-1].ravel(), ids[:-1, :].ravel()))
+    edge_v = np.concatenate((ids[:, 1:].ravel(), ids[1:, :].ravel()))
+    return street_graph.StreetGraph(node_lat, node_lng, edge_u, edge_v)
+
+
+def node_at(i, j):
+    return ORIGIN[0] + i * STEP_DEG, ORIGIN[1] + j * STEP_DEG
+
+
+def polyline_length_km(coords):
+    return sum(utils.euc_distance(*a, *b) for a, b in zip(coords[:-1], coords[1:]))
+
+
+def test_compute_route():
+    """A one-way route has the Google route dict's shape and a polyline that decodes to its path"""
+    graph = make_grid_graph()
+    start, end = node_at(2, 3), node_at(10, 15)
+    route = graph.compute_route(*start, *end)
+
+    assert route["success"] and route["backend"] == "local"
+    for field in ("distance_km", "duration_minutes", "polyline", "edge_ids"):
+        assert field in route
+    coords = polyline.decode(route["polyline"])
+    assert np.allclose(coords[0], start) and np.allclose(coords[-1], end)
+    assert len(route["edge_ids"]) == len(coords) - 1 == 8 + 12  # a shortest grid path is a staircase
+    assert abs(polyline_length_km(coords) - route["distance_km"]) < 0.01
+    print(f"✓ One-way route of {route['distance_km']:.2f}km over {len(route['edge_ids'])} blocks")
+
+    off_network = graph.compute_route(ORIGIN[0] - 0.05, ORIGIN[1], *end)
+    assert not off_network["success"]
+
+
+def test_loop_route():
+    """A loop starts and ends at the start and comes out near the target length"""
+    graph = make_grid_graph()
+    start = node_at(GRID // 2, GRID // 2)
+    for bearing in (0, 90, 225):
+        target_km = 2.0
+        route = graph.loop_route(*start, target_km, bearing=bearing)
+
+        assert route["success"] and route["loop"]
+        coords = polyline.decode(route["polyline"])
+        assert np.allclose(coords[0], start) and np.allclose(coords[-1], start)
+        assert len(route["waypoints"]) == 2
+        assert abs(polyline_length_km(coords) - route["distance_km"]) < 0.01
+        assert abs(route["distance_km"] - target_km) / target_km < 0.3, route["distance_km"]
+    print(f"✓ Loops near the {target_km}km target")
+
+
+if __name__ == "__main__":
+    test_compute_route()
+    test_loop_route()
@@ -15,11 +15,17 @@ def analyze_route_safety(route_dict: dict):
 @tool
 def get_weather_conditions(lat: float, lng: float):
     """Get current weather conditions for route planning."""
-    import requests
     import os
+    import http_client
+    import outbound
     api_key = os.getenv("OPENWEATHER_API_KEY")
-    response = requests.get(
-        f"https://api.openweathermap.org/data/2.5/weather?lat={lat}&lon={lng}&appid={api_key}&units=imperial"
+    response = outbound.call(
+        "openweather",
+        lambda timeout: http_client.get(
+            "https://api.openweathermap.org/data/2.5/weather",
+            params={"lat": lat, "lon": lng, "appid": api_key, "units": "imperial"},
+            timeout=timeout,
+        ),
     )
     data = response.json()
     return {
@@ -1,4 +1,7 @@
 import math
+import numpy as np
+
+import constants as const
 
 
 def euc_distance(lat1: float, lng1: float, lat2: float, lng2: float):  # utils?
@@ -18,3 +21,25 @@ def euc_distance(lat1: float, lng1: float, lat2: float, lng2: float):  # utils?
     c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
 
     return R * c
+
+
+def euc_distance_array(lat1, lng1, lat2, lng2):
+    """euc_distance over numpy arrays, same formula so results agree to the last bit or so"""
+    lat1_rad = np.radians(lat1)
+    lat2_rad = np.radians(lat2)
+    dlat = lat2_rad - lat1_rad
+    dlng = np.radians(lng2) - np.radians(lng1)
+
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1_rad) * np.cos(lat2_rad) * np.sin(dlng / 2) ** 2
+    return 6371 * (2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a)))
+
+
+def haversine_array(lat1, lng1, lat2, lng2):
+    """Vectorized haversine distance in km; accepts scalars or numpy arrays"""
+    lat1_rad = np.radians(lat1)
+    lat2_rad = np.radians(lat2)
+    dlat = lat2_rad - lat1_rad
+    dlng = np.radians(lng2) - np.radians(lng1)
+
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1_rad) * np.cos(lat2_rad) * np.sin(dlng / 2) ** 2
+    return 2 * const.R * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
@@ -0,0 +1,88 @@
+import threading
+import time
+
+import cache
+import crash_hours
+import crash_snapshot
+import edge_exposure
+import get_closures
+import heatmap_tiles
+import http_client
+import land_mask
+import route_library
+import safety_engine
+import street_graph
+from constants import popular_starts
+
+
+class Warmup:
+    """
+    Runs startup steps in a background thread and tracks readiness
+
+    A failing step is recorded and skipped rather than retried: the request path
+    already copes with a missing index, so the worker is ready once every step
+    has been attempted.
+    """
+
+    def __init__(self, steps):
+        self.steps = steps
+        self.timings_ms = {}
+        self.errors = {}
+        self.started_at = None
+        self.done = threading.Event()
+
+    def start(self):
+        self.started_at = time.monotonic()
+        threading.Thread(target=self._run, name="warmup", daemon=True).start()
+
+    def _run(self):
+        print("Warming up...")
+        for name, step in self.steps:
+            started = time.perf_counter()
+            try:
+                step()
+            except Exception as e:
+                self.errors[name] = str(e)
+                print(f"   Warm-up step {name} failed: {e}")
+            self.timings_ms[name] = round((time.perf_counter() - started) * 1000, 1)
+        self.done.set()
+        print(f"✓ Warm in {time.monotonic() - self.started_at:.1f}s {self.timings_ms}")
+
+    @property
+    def ready(self):
+        return self.done.is_set()
+
+    def status(self):
+        return {
+            "status": "ready" if self.ready else "warming",
+            "completed": list(self.timings_ms),
+            "pending": [name for name, _ in self.steps if name not in self.timings_ms],
+            "timings_ms": dict(self.timings_ms),
+            "errors": dict(self.errors),
+        }
+
+
+def warmup_query():
+    """A safety lookup at a popular start: pages in the snapshot and fills the baseline cache"""
+    start = popular_starts[0]
+    result = safety_engine.get_crashes_near_me(start["lat"], start["lng"], radius_km=0.5)
+    if "error" in result:
+        raise RuntimeError(result["error"])
+
+
+def default_steps(get_llm_client):
+    """Everything the first request would otherwise build, cheapest first"""
+    return [
+        ("cache", cache.get_cache),
+        ("http_pools", lambda: (http_client.get_client(), http_client.get_async_client())),
+        ("crash_snapshot", crash_snapshot.get_snapshot),
+        ("crash_hours", crash_hours.get_crash_hours),
+        ("street_graph", street_graph.get_street_graph),
+        ("edge_index", edge_exposure.get_edge_index),
+        ("land_mask", land_mask.get_land_mask),
+        ("route_library", route_library.get_route_library),
+        ("heatmap_surface", heatmap_tiles.get_surface),
+        ("closure_index", get_closures.get_closure_index),
+        ("llm_client", get_llm_client),
+        ("warmup_query", warmup_query),
+    ]